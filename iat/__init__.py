@@ -1,6 +1,7 @@
 import time
 import random
 import logging
+from pathlib import Path
 
 # from .admin_report_functions import *
 from otree.api import *
@@ -8,6 +9,14 @@ from otree import settings
 from . import stimuli
 from . import stats
 from . import blocks
+from . import trialcache
+from . import sequences
+from . import images
+from . import stiat
+from . import exports
+from . import counterbalance
+from . import registry
+from . import pagecache
 import math
 from statistics import mean, stdev
 from decimal import Decimal
@@ -19,240 +28,18 @@ Implicit Association Test, draft
 from statistics import mean, stdev
 
 
-# funciones para calcular d-scores.
+# funciones para calcular d-scores (ver stats.py).
+from .stats import dscore1, dscore2
 
-def dscore1(data3: list, data4: list, data6: list, data7: list):
-    # Filtrar valores demasiado largos.
-    def not_long(value):
-        return value < 10.0
 
-    data3 = list(filter(not_long, data3))
-    data4 = list(filter(not_long, data4))
-    data6 = list(filter(not_long, data6))
-    data7 = list(filter(not_long, data7))
-
-    # Filtrar valores demasiado cortos
-    def too_short(value):
-        return value < 0.300
-
-    total_data = data3 + data4 + data6 + data7
-    short_data = list(filter(too_short, total_data))
-
-    if len(total_data) == 0 or (len(short_data) / len(total_data) > 0.1):
-        return None
-
-    # Calcular el d-score
-    combined_3_6 = data3 + data6
-    combined_4_7 = data4 + data7
-
-    if len(combined_3_6) < 2 or len(combined_4_7) < 2:
-        # stdev requiere al menos dos datos
-        return None
-
-    std_3_6 = stdev(combined_3_6)
-    std_4_7 = stdev(combined_4_7)
-
-    mean_3_6 = mean(data6) - mean(data3) if len(data6) > 0 and len(data3) > 0 else 0
-    mean_4_7 = mean(data7) - mean(data4) if len(data7) > 0 and len(data4) > 0 else 0
-
-    dscore_3_6 = mean_3_6 / std_3_6 if std_3_6 > 0 else 0
-    dscore_4_7 = mean_4_7 / std_4_7 if std_4_7 > 0 else 0
-
-    dscore_mean1 = (dscore_3_6 + dscore_4_7) * 0.5
-    return dscore_mean1
-
-
-def dscore2(data10: list, data13: list, data11: list, data14: list):
-    # Filtrar valores demasiado largos
-    def not_long(value):
-        return value < 10.0
-
-    data10 = list(filter(not_long, data10))
-    data13 = list(filter(not_long, data13))
-    data11 = list(filter(not_long, data11))
-    data14 = list(filter(not_long, data14))
-
-    # Filtrar valores demasiado cortos
-    def too_short(value):
-        return value < 0.300
-
-    total_data = data10 + data13 + data11 + data14
-    short_data = list(filter(too_short, total_data))
-
-    if len(total_data) == 0 or (len(short_data) / len(total_data) > 0.1):
-        return None
-
-    # Calcular el d-score
-    combined_10_11 = data10 + data11
-    combined_13_14 = data13 + data14
-
-    if len(combined_10_11) < 2 or len(combined_13_14) < 2:
-        # stdev requiere al menos dos datos
-        return None
-
-    std_10_11 = stdev(combined_10_11)
-    std_13_14 = stdev(combined_13_14)
-
-    mean_10_11 = mean(data11) - mean(data10) if len(data11) > 0 and len(data10) > 0 else 0
-    mean_13_14 = mean(data14) - mean(data13) if len(data14) > 0 and len(data13) > 0 else 0
-
-    dscore_10_11 = mean_10_11 / std_10_11 if std_10_11 > 0 else 0
-    dscore_13_14 = mean_13_14 / std_13_14 if std_13_14 > 0 else 0
-
-    dscore_mean2 = (dscore_10_11 + dscore_13_14) * 0.5
-    return dscore_mean2
-
-
-# === ST-IAT: parseo y D-score (MinnoJS) ======================================
-import csv, io
-from typing import Dict, Any, List, Tuple, Optional
-
-# Por defecto, en el script de Project Implicit (qstiat6.js) los dos bloques críticos
-# suelen ser: 3 = Target+Pleasant  (compatible) y 5 = Target+Unpleasant (incompatible).
-# Si en el futuro cambias el orden, cambia estos IDs vía session.config['stiat_block_map']
-DEFAULT_STIAT_BLOCK_MAP = {
-    "compatible":   [3],
-    "incompatible": [5],
-}
-
-def _to_bool(x):
-    # Acepta 1/0, "true"/"false", "True"/"False", etc.
-    if isinstance(x, bool):
-        return x
-    if x is None:
-        return None
-    s = str(x).strip().lower()
-    if s in ("1","true","t","yes","y","si","sí"):
-        return True
-    if s in ("0","false","f","no","n"):
-        return False
-    return None
-
-#funcion para el dscore de black. (o del primer st-iat)
-def parse_minno_stiat_csv(csv_text: str) -> List[Dict[str, Any]]:
-    """
-    Devuelve una lista de dicts con los campos que necesitamos:
-    block (int), rt (segundos), correct (bool).
-    Soporta columnas comunes de Minno: 'block','latency','rt','correct','error'
-    """
-    rows = []
-    if not csv_text:
-        return rows
-    f = io.StringIO(csv_text)
-    reader = csv.DictReader(f)
-    for r in reader:
-        # --- block ---
-        blk = r.get('block') or r.get('Block') or r.get('blockNum') or r.get('phase')
-        try:
-            block = int(str(blk).strip())
-        except:
-            # si no hay número, salta fila
-            continue
-
-        # --- latencia (ms o s) ---
-        lat = r.get('latency') or r.get('rt') or r.get('latency_ms') or r.get('responseLatency')
-        if lat is None:
-            continue
-        try:
-            rt = float(lat)
-        except:
-            continue
-        # Si parece estar en milisegundos, pásalo a segundos
-        if rt > 50:  # heurística: >50 es casi seguro milisegundos
-            rt = rt / 1000.0
-
-        # --- correct / error ---
-        correct = _to_bool(r.get('correct'))
-        if correct is None:
-            # Algunas hojas traen 'error' (1 = error)
-            err = r.get('error') or r.get('Error')
-            if err is not None:
-                correct = not _to_bool(err)
-        # Si sigue None, asumimos "desconocido"; los tratamos como incorrectos para ser conservadores
-        if correct is None:
-            correct = False
-
-        rows.append(dict(block=block, rt=rt, correct=bool(correct)))
-    return rows
-
-def compute_stiat_d(
-    trials: List[Dict[str, Any]],
-    compat_blocks: List[int],
-    incompat_blocks: List[int],
-    *,
-    error_penalty_s: float = 0.600,  # 600 ms
-    min_rt_s: float = 0.300,
-    max_rt_s: float = 10.000,
-    max_fast_prop: float = 0.10,
-) -> Tuple[Optional[float], Dict[str, Any]]:
-    """
-    Implementación estilo Greenwald et al. (2003) adaptada a ST-IAT:
-      • descarta RT < 300 ms y > 10 s
-      • exclusión si >10% de todos los trials (antes de descartar por >10s) < 300 ms
-      • penaliza errores sumando 600 ms al RT del ensayo
-      • D = (mean_incompat - mean_compat) / sd_pooled(trials de ambos bloques críticos)
-    Devuelve (D, meta) donde meta trae contadores/flags útiles para depurar.
-    """
-    meta = {
-        "n_total": len(trials),
-        "n_fast_300ms": 0,
-        "excluded_fast_prop": False,
-        "n_compat_used": 0,
-        "n_incompat_used": 0,
-        "sd_pooled": None,
-    }
-    if not trials:
-        return None, meta
-
-    # Proporción <300 ms (con el conjunto completo que vino)
-    fast = [t for t in trials if t["rt"] < min_rt_s]
-    meta["n_fast_300ms"] = len(fast)
-    if meta["n_total"] > 0 and (len(fast) / meta["n_total"]) > max_fast_prop:
-        meta["excluded_fast_prop"] = True
-        return None, meta  # recomendación habitual: excluir participante
-
-    # Mantén solo bloque crítico y RT dentro de [300ms,10s]; aplica penalización a errores
-    compat_rts = []
-    incompat_rts = []
-    for t in trials:
-        if t["rt"] < min_rt_s or t["rt"] > max_rt_s:
-            continue
-        rt = t["rt"] + (error_penalty_s if not t["correct"] else 0.0)
-        if t["block"] in compat_blocks:
-            compat_rts.append(rt)
-        elif t["block"] in incompat_blocks:
-            incompat_rts.append(rt)
-
-    meta["n_compat_used"] = len(compat_rts)
-    meta["n_incompat_used"] = len(incompat_rts)
-
-    if len(compat_rts) < 2 or len(incompat_rts) < 2:
-        return None, meta
-
-    pooled = compat_rts + incompat_rts
-    sd = stdev(pooled) if len(pooled) >= 2 else 0.0
-    meta["sd_pooled"] = sd
-
-    if sd == 0:
-        return None, meta
-
-    d = (mean(incompat_rts) - mean(compat_rts)) / sd
-    return float(round(d, 4)), meta
-
-def classify_stiat_black(d: Optional[float]) -> str:
-    """
-    Umbrales habituales: |D| < .15 = Neutral; .15–.35 = Leve; .35–.65 = Moderada; >.65 = Fuerte.
-    Para ST-IAT de 'Black people':
-      D > 0 → Black+Pleasant más rápido (evaluación implícita positiva hacia Black)
-      D < 0 → Black+Unpleasant más rápido (evaluación implícita negativa hacia Black)
-    """
-    if d is None:
-        return "Sin clasificación"
-    x = abs(d)
-    if x < 0.15:
-        return "Neutral"
-    level = "Leve" if x <= 0.35 else ("Moderada" if x <= 0.65 else "Fuerte")
-    return f"{level}: {'Black+positivo' if d>0 else 'Black+negativo'}"
+# === ST-IAT: parseo y D-score (MinnoJS), ver stiat.py ========================
+from .stiat import (
+    DEFAULT_STIAT_BLOCK_MAP,
+    compute_stiat_d,
+    classify_stiat_black,
+    encode_stiat,
+    StiatLog,
+)
 
 
 # clase de Constants para definir las variables globales del experimento. 
@@ -466,10 +253,36 @@ class Constants(BaseConstants):
     )
 
 
-def url_for_image(filename):
+# versiones optimizadas de las imágenes (ver images.py); vacío si no se ha corrido el build
+IMAGE_MANIFEST = images.load_manifest()
+
+
+def url_for_image(filename, fallback=False):
+    built = IMAGE_MANIFEST.get(filename)
+    if built:
+        return f"/static/images/{built['fallback' if fallback else 'webp']}"
     return f"/static/images/{filename}"
 
 
+# índice de estímulos validado al arrancar (ver registry.py): si falta una imagen, la app no arranca.
+# Se recarga solo si cambia stimuli.csv; cada sesión sigue con la versión con que se creó.
+STIMULI = registry.Library(stimuli.load, stimuli.CSV_FILE, url_for_image)
+STIMULI.watch()
+
+# contextos de RoundN e Intro ya calculados (ver pagecache.py); se vacía al recargar los estímulos
+PAGE_CONTEXTS = pagecache.ContextCache()
+STIMULI.subscribe(lambda new_registry: PAGE_CONTEXTS.invalidate())
+
+
+def session_stimuli(session):
+    """Registro de estímulos con que se creó la sesión"""
+    version = session.vars.get('stimuli_version')
+    if version is None:
+        # sesiones creadas antes de fijar la versión
+        return STIMULI.current
+    return STIMULI.pinned(version, session.vars['stimuli_pools'])
+
+
 # clase Subsession para definir las variables de sesión
 class Subsession(BaseSubsession):
     practice = models.BooleanField()
@@ -480,42 +293,79 @@ class Subsession(BaseSubsession):
 
 
 #función que se ejecuta al crear la sesión
-def creating_session(self):
-    session = self.session
-    defaults = dict(
-        retry_delay=0.5,
-        trial_delay=0.5,
-        primary=[None, None],
-        primary_images=False,
-        secondary=[None, None],
-        secondary_images=False,
-        num_iterations={
-            1: 5, 2: 5, 3: 10, 4: 20, 5: 5, 6: 10, 7: 20,
-            8: 5, 9: 5, 10: 10, 11: 20, 12: 5, 13: 10, 14: 20,
-            15: 1, 16: 1
-        },
+PARAM_DEFAULTS = dict(
+    retry_delay=0.5,
+    trial_delay=0.5,
+    primary=[None, None],
+    primary_images=False,
+    secondary=[None, None],
+    secondary_images=False,
+    # True: el cliente precarga el bloque completo ('block'); False: usa 'answer_next'
+    prefetch_block=True,
+    num_iterations={
+        1: 5, 2: 5, 3: 10, 4: 20, 5: 5, 6: 10, 7: 20,
+        8: 5, 9: 5, 10: 10, 11: 20, 12: 5, 13: 10, 14: 20,
+        15: 1, 16: 1
+    },
+)
+
+
+def plan_session(subsession):
+    """Preparación de la sesión, una sola vez (en la ronda 1):
+    parámetros, bloques compilados, orden y semilla de cada participante y
+    categorías del dictador. Lo que necesita cada ronda queda en session.vars['iat_plan'].
+    """
+    session = subsession.session
+    session.params = {param: session.config.get(param, default) for param, default in PARAM_DEFAULTS.items()}
+    session.vars['params_fingerprint'] = pagecache.fingerprint(session.params)
+
+    # la sesión se queda con la versión actual de los estímulos aunque después cambie stimuli.csv
+    current = STIMULI.current
+    pools = current.pools
+    session.vars['stimuli_version'] = current.version
+    session.vars['stimuli_pools'] = pools
+
+    # compilar todos los bloques una sola vez; falla aquí si falta alguna categoría
+    table = blocks.compile_blocks(session.params, pools)
+    for layout in blocks.LAYOUTS.values():
+        blocks.compile_blocks(session.params, pools, layout)
+
+    # orden de los IAT y disposición de teclas, balanceados por id_in_session (ver counterbalance.py)
+    options = counterbalance.conditions(
+        session.config.get('iat_orders', tuple(counterbalance.ORDERS)),
+        session.config.get('iat_layouts', counterbalance.LAYOUT_IDS),
     )
-    session.params = {}
-    for param in defaults:
-        session.params[param] = session.config.get(param, defaults[param])
+    session.vars['iat_conditions'] = options
+    for p in subsession.get_players():
+        assign_condition(p.participant, options)
+        # semilla para reproducir las secuencias de trials del participante
+        p.participant.vars['iat_seed'] = sequences.make_seed()
+
+    # Mantén categorías del Dictador como estaban (sin aleatorización)
+    session.vars['shuffled_dictator_categories'] = Constants.categories.copy()
+
+    # por ronda, con el orden directo y la primera disposición (los de cada participante
+    # están en su condición): (practice, primary_left, primary_right, secondary_left, secondary_right)
+    rounds = {}
+    for rnd in range(1, Constants.num_rounds + 1):
+        block = table.get(rnd, NO_BLOCK)
+        rounds[rnd] = (block.get('practice', False),) + block_corners(block)
+    session.vars['iat_plan'] = dict(rounds=rounds)
 
+
+def creating_session(self):
+    session = self.session
     if self.round_number == 1:
-        # --- CAMBIO AQUÍ: TODOS CON ORDEN DIRECTO 1..14 ---
-        orden_directo = list(range(1, 15))
-        for p in self.get_players():
-            p.participant.vars['iat_round_order'] = orden_directo
-
-        # Mantén categorías del Dictador como estaban (sin aleatorización)
-        shuffled_categories = Constants.categories.copy()
-        random.shuffle(shuffled_categories)
-        session.vars['shuffled_dictator_categories'] = Constants.categories.copy()
-        
-    block = get_block_for_round(self.round_number, session.params)
-    self.practice = block.get('practice', False)
-    self.primary_left = block.get('left', {}).get('primary', "")
-    self.primary_right = block.get('right', {}).get('primary', "")
-    self.secondary_left = block.get('left', {}).get('secondary', "")
-    self.secondary_right = block.get('right', {}).get('secondary', "")
+        plan_session(self)
+
+    # las demás rondas sólo copian lo que ya se calculó
+    (
+        self.practice,
+        self.primary_left,
+        self.primary_right,
+        self.secondary_left,
+        self.secondary_right,
+    ) = session.vars['iat_plan']['rounds'][self.round_number]
 
     if self.round_number in [15, 16]:
         shuffled_categories = session.vars.get('shuffled_dictator_categories')
@@ -524,32 +374,66 @@ def creating_session(self):
             for group in self.get_groups():
                 group.dictator_category = assigned_category
 
+    # para las herramientas fuera de línea (rescore.py, incremental.py), que no leen participant.vars
+    for p in self.get_players():
+        p.iat_round = get_actual_iat_round(p)
 
-#funcion para obtener el bloque de la ronda
-def get_block_for_round(rnd, params):
-    """Get a round setup from BLOCKS with actual categories' names substituted from session config"""
-    if rnd in blocks.BLOCKS:
-        block = blocks.BLOCKS[rnd]
-        result = blocks.configure(block, params)
-        return result
-    else:
-        # Retorna un bloque vacío o predeterminado para rondas que no lo necesitan
-        return {}
 
-def thumbnails_for_block(block, params):
-    """Return image urls for each category in block.
+NO_BLOCK = blocks.FrozenBlock()
+
+
+def block_corners(block):
+    """(primary_left, primary_right, secondary_left, secondary_right) de un bloque"""
+    left, right = block.get('left', {}), block.get('right', {})
+    return (
+        left.get('primary', ""),
+        right.get('primary', ""),
+        left.get('secondary', ""),
+        right.get('secondary', ""),
+    )
+
+
+#funcion para obtener el bloque de la ronda
+def get_block_for_round(rnd, params, layout=1, pools=None):
+    """Get a round setup from BLOCKS with actual categories' names substituted from session config
+    Los bloques vienen de la tabla compilada (de sólo lectura), no se copian en cada llamada.
+    layout: disposición de teclas (blocks.LAYOUTS); la de cada participante la da get_player_block.
+    pools: estímulos de la sesión (session_stimuli); por defecto, la versión actual.
+    """
+    if pools is None:
+        pools = STIMULI.current.pools
+    table = blocks.compile_blocks(params, pools, blocks.LAYOUTS[layout])
+    # Retorna un bloque vacío para rondas que no lo necesitan
+    return table.get(rnd, NO_BLOCK)
+
+def thumbnails_for_block(block, params, stimuli_registry=None):
+    """Return image (registry.Stimulus, with url and fallback_url) for each category in block.
     Taking first image in the category as a thumbnail.
     """
+    if stimuli_registry is None:
+        stimuli_registry = STIMULI.current
     thumbnails = {'left': {}, 'right': {}}
     for side in ['left', 'right']:
         for cls in ['primary', 'secondary']:
             if cls in block[side] and params[f"{cls}_images"]:
                 # use first image in categopry as a corner thumbnail
-                images = stimuli.DICT[block[side][cls]]
-                thumbnails[side][cls] = url_for_image(images[0])
+                thumbnails[side][cls] = stimuli_registry.thumbnail(block[side][cls])
     return thumbnails
 
 
+def images_for_block(block, stimuli_registry=None):
+    """Return [url, fallback_url] of all images the block can show as stimuli
+    The client preloads and decodes them before the round starts,
+    switching to the fallback if the optimized (WebP) version can't be decoded.
+    """
+    if stimuli_registry is None:
+        stimuli_registry = STIMULI.current
+    sources = []
+    for side, cls, cat, pool in block.get('candidates', ()):
+        sources.extend(list(pair) for pair in stimuli_registry.image_sources(cat))
+    return sources
+
+
 def labels_for_block(block):
     """Return category labels for each category in block
     Just stripping prefix "something:"
@@ -579,21 +463,22 @@ class Player(BasePlayer):
 
     #integración de variables para single target IAT, black
      # ...
-    stiat_raw = models.LongStringField(blank=True)   # CSV emitido por MinnoJS
+    stiat_raw = models.LongStringField(blank=True)   # CSV emitido por MinnoJS (se guarda compacto, ver StiatLog)
     stiat_d   = models.FloatField(blank=True)        # opcional: D-score del ST-IAT
 
 
      # NUEVOS: Sexuality
-    stiat_sex_raw     = models.LongStringField(blank=True)
+    stiat_sex_raw     = models.LongStringField(blank=True)   # compacto, como stiat_raw
     stiat_sex_d       = models.FloatField(blank=True)
     stiat_sex_reason  = models.LongStringField(blank=True)
 
     # NUEVOS: Disability
-    stiat_dis_raw     = models.LongStringField(blank=True)
+    stiat_dis_raw     = models.LongStringField(blank=True)   # compacto, como stiat_raw
     stiat_dis_d       = models.FloatField(blank=True)
     stiat_dis_reason  = models.LongStringField(blank=True)
 
     iteration = models.IntegerField(initial=0)  # Contador para iteraciones del jugador
+    iat_round = models.IntegerField()  # ronda de BLOCKS que se muestra en esta ronda (ver get_actual_iat_round)
     num_trials = models.IntegerField(initial=0)  # Número total de intentos del jugador
     num_correct = models.IntegerField(initial=0)  # Número de respuestas correctas
     edad = models.IntegerField(label="Edad", min=18, max=120, )
@@ -624,6 +509,11 @@ class Player(BasePlayer):
 
     dscore1 = models.FloatField()  # D-score del primer iat
     dscore2 = models.FloatField()  # D-score del segundo iat
+    # intervalos de confianza bootstrap al 95% (ver stats.bootstrap_dscore)
+    dscore1_ci_low = models.FloatField(blank=True)
+    dscore1_ci_high = models.FloatField(blank=True)
+    dscore2_ci_low = models.FloatField(blank=True)
+    dscore2_ci_high = models.FloatField(blank=True)
 
     # ─── Cuestionario de comprensión 1────────────────────────────────────
     comp_q1 = models.StringField(
@@ -1131,11 +1021,84 @@ class Group(BaseGroup):
     )
 
 
-def get_actual_iat_round(player: Player):
-    order = player.participant.vars.get('iat_round_order')
-    if order and player.round_number <= 14:
-        return order[player.round_number - 1]
-    return player.round_number
+def assign_condition(participant, options=None):
+    """Asigna y guarda la condición de contrabalanceo del participante"""
+    if options is None:
+        options = counterbalance.conditions()
+    condition = counterbalance.assign(participant.id_in_session, options)
+    participant.vars['iat_condition'] = condition
+    participant.vars['iat_round_order'] = counterbalance.round_order(condition)
+    return condition
+
+
+def iat_condition(player: Player):
+    """{'order': 'direct'|'inverted', 'layout': 1|2} del participante"""
+    pv = player.participant.vars
+    condition = pv.get('iat_condition')
+    if condition is None:
+        if 'iat_round_order' in pv:
+            # participantes creados antes del contrabalanceo
+            condition = pv['iat_condition'] = counterbalance.legacy_condition(pv['iat_round_order'])
+        else:
+            condition = assign_condition(player.participant, player.session.vars.get('iat_conditions'))
+    return condition
+
+
+def iat_order(player: Player):
+    return iat_condition(player)['order']
+
+
+def get_actual_iat_round(player: Player, rnd=None):
+    """Bloque (de BLOCKS) que se muestra en la ronda `rnd` (por defecto la actual) según el orden del participante"""
+    if rnd is None:
+        rnd = player.round_number
+    order = counterbalance.ORDERS[iat_order(player)]
+    if rnd <= 14:
+        return order[rnd - 1]
+    return rnd
+
+
+def get_player_block(player: Player, rnd=None):
+    """Bloque compilado de la ronda `rnd` (por defecto la actual) con el orden y las teclas del participante.
+    Todas las páginas y el live method obtienen el bloque por aquí.
+    """
+    layout = iat_condition(player)['layout']
+    pools = session_stimuli(player.session).pools
+    return get_block_for_round(get_actual_iat_round(player, rnd), player.session.params, layout, pools)
+
+
+def page_context_key(player: Player, kind, rnd=None):
+    """Llave de los contextos de página: todo aquello de lo que dependen.
+    (tipo de página, parámetros de la sesión, versión de estímulos, disposición de teclas, bloque)
+    """
+    session = player.session
+    fingerprint = session.vars.get('params_fingerprint')
+    if fingerprint is None:
+        # sesiones creadas antes de guardar la huella
+        fingerprint = session.vars['params_fingerprint'] = pagecache.fingerprint(session.params)
+    return (
+        kind,
+        fingerprint,
+        session_stimuli(session).version,
+        iat_condition(player)['layout'],
+        get_actual_iat_round(player, rnd),
+    )
+
+
+def round_context(player: Player):
+    """Lo que RoundN calcula a partir del bloque de la ronda (compartido, no modificar)"""
+
+    def build():
+        block = get_player_block(player)
+        stimuli_registry = session_stimuli(player.session)
+        return dict(
+            block=block,
+            thumbnails=thumbnails_for_block(block, player.session.params, stimuli_registry),
+            labels=labels_for_block(block),
+            preload=images_for_block(block, stimuli_registry),
+        )
+
+    return PAGE_CONTEXTS.get(page_context_key(player, 'round'), build)
 
 
 def set_payoffs(group: Group, player: Player):
@@ -1177,43 +1140,266 @@ class Trial(ExtraModel):
     retries = models.IntegerField(initial=0)
 
 
-def generate_trial(player: Player) -> Trial:
+# trials de la ronda activa en memoria; se escriben a Trial en lote
+trial_cache = trialcache.TrialCache(Trial)
+
+
+def get_block_plan(player: Player):
+    """Secuencia completa de trials del bloque (ronda) actual.
+    Se genera una sola vez por ronda, balanceada y a partir de la semilla del participante
+    (ver sequences.py), y se guarda en participant.vars como arreglos de índices.
+    Así los mensajes 'next' y 'block' sirven exactamente los mismos trials.
+    """
+    key = f'iat_plan_r{player.round_number}'
+    pv = player.participant.vars
+    plan = pv.get(key)
+    if plan is None:
+        seed = pv.get('iat_seed')
+        if seed is None:
+            seed = pv['iat_seed'] = sequences.make_seed()
+        block = get_player_block(player)
+        plan = sequences.generate(block, get_num_iterations_for_round(player), seed, player.round_number)
+        pv[key] = plan
+    return plan
+
+
+def planned_trial(player: Player, iteration):
+    """El trial planeado para una iteración (desde 1), como (cls, cat, stimulus, side)"""
+    block = get_player_block(player)
+    return sequences.trial_at(block, get_block_plan(player), iteration - 1)
+
+
+def generate_trial(player: Player, timestamp=None) -> Trial:
     """Create new question for a player"""
-    actual_round = get_actual_iat_round(player)
-    block = get_block_for_round(actual_round, player.session.params)
-    chosen_side = random.choice(['left', 'right'])
-    chosen_cls = random.choice(list(block[chosen_side].keys()))
-    chosen_cat = block[chosen_side][chosen_cls]
-    stimulus = random.choice(stimuli.DICT[chosen_cat])
+    chosen_cls, chosen_cat, stimulus, chosen_side = planned_trial(player, player.iteration + 1)
 
 # 27 de febrero del 2025. esto era lo que faltaba para que las imágnes se mostraran correctamente.
-    player.iteration += 1
-    return Trial.create(
-        player=player,
-        iteration=player.iteration,
-        timestamp=time.time(),
+    trial = trial_cache.create(
+        player,
+        iteration=player.iteration + 1,
+        timestamp=time.time() if timestamp is None else timestamp,
         stimulus_cls=chosen_cls,
         stimulus_cat=chosen_cat,
         stimulus=stimulus,
         correct=chosen_side,
+        retries=0,
     )
+    player.iteration += 1
+    return trial
 
 def get_current_trial(player: Player):
     """Get last (current) question for a player"""
-    trials = Trial.filter(player=player, iteration=player.iteration)
-    if trials:
-        [trial] = trials
-        return trial
+    return trial_cache.current(player)
+
+
+def encode_stimulus(cls, cat, stimulus, stimuli_registry=None):
+    """stimuli_registry: el de la sesión (session_stimuli); por defecto, la versión actual"""
+    if stimuli_registry is None:
+        stimuli_registry = STIMULI.current
+    entry = stimuli_registry.get(stimulus)
+    data = dict(
+        cls=cls,
+        cat=cat,
+        stimulus=entry.url,
+    )
+    if entry.fallback_url != entry.url:
+        # PNG/JPEG para los navegadores que no decodifican WebP
+        data['fallback'] = entry.fallback_url
+    return data
+
+
+def encode_trial(trial: Trial, stimuli_registry=None):
+    data = encode_stimulus(trial.stimulus_cls, trial.stimulus_cat, trial.stimulus, stimuli_registry)
+    data['iteration'] = trial.iteration
+    return data
+
+
+def encode_block(player: Player, current):
+    """Trials pendientes del bloque, para que el cliente los recorra localmente.
+    Si el trial actual no se ha contestado correctamente, la secuencia empieza en él.
+    No incluye el lado correcto: la validación sigue ocurriendo en el servidor.
+    """
+    if current is not None and not current.is_correct:
+        start = current.iteration
+    else:
+        start = player.iteration + 1
+    stimuli_registry = session_stimuli(player.session)
+    trials = []
+    for iteration in range(start, get_num_iterations_for_round(player) + 1):
+        cls, cat, stimulus, _ = planned_trial(player, iteration)
+        data = encode_stimulus(cls, cat, stimulus, stimuli_registry)
+        data['iteration'] = iteration
+        trials.append(data)
+    return trials
+
+
+# rondas (de página) cuyos tiempos entran en los d-scores
+DSCORE_ROUNDS = (3, 4, 6, 7, 10, 11, 13, 14)
 
 
-def encode_trial(trial: Trial):
+def update_running_dscore(player: Player, old_rt, new_rt):
+    """Actualiza los acumuladores del d-score con la respuesta de un trial.
+    old_rt es el tiempo de la respuesta anterior del mismo trial (reintento) o None.
+    """
+    if player.round_number not in DSCORE_ROUNDS:
+        return
+    pv = player.participant.vars
+    running = pv.get('iat_running', {})
+    acc = running.get(player.round_number) or stats.running_new()
+    if old_rt is not None:
+        stats.running_remove(acc, old_rt)
+    stats.running_add(acc, new_rt)
+    running[player.round_number] = acc
+    pv['iat_running'] = running
+
+
+def running_dscores(player: Player):
+    """(dscore1, dscore2) desde los acumuladores, o None si no cubren todos los trials
+    (p. ej. sesiones anteriores a los acumuladores o datos generados con "cheat").
+    """
+    running = player.participant.vars.get('iat_running', {})
+    num_iterations = player.session.params['num_iterations']
+    for rnd in DSCORE_ROUNDS:
+        acc = running.get(rnd)
+        if acc is None or acc[0] + acc[4] != num_iterations[rnd]:
+            return None
+    # los acumuladores van por ronda de la página; el d-score, por ronda de BLOCKS
+    running = {get_actual_iat_round(player, rnd): running[rnd] for rnd in DSCORE_ROUNDS}
+    return (
+        stats.dscore_from_running(running, stats.IAT1_PAIRS),
+        stats.dscore_from_running(running, stats.IAT2_PAIRS),
+    )
+
+
+def iat_trials(player: Player):
+    """{ronda de BLOCKS: [(tiempo de reacción, es_error)]} de las rondas con d-score, leyendo una sola vez
+    los trials de cada ronda. Un trial cuenta como error si se respondió mal antes de acertar.
+    Las llaves son las rondas de BLOCKS (get_actual_iat_round), así que IAT1_PAIRS es siempre el primer
+    IAT, sin importar el orden en que lo hizo el participante.
+    """
+    return {
+        get_actual_iat_round(player, rnd): [
+            (t.reaction_time, bool(t.retries))
+            for t in Trial.filter(player=player.in_round(rnd))
+            if t.reaction_time is not None
+        ]
+        for rnd in DSCORE_ROUNDS
+    }
+
+
+def iat_dscore_variants(blocks):
+    """Variantes D1-D6 de ambos IAT: {'iat1': {...}, 'iat2': {...}}"""
     return dict(
-        cls=trial.stimulus_cls,
-        cat=trial.stimulus_cat,
-        stimulus=url_for_image(trial.stimulus) if trial.stimulus.endswith((".png", ".jpg")) else str(trial.stimulus),
+        iat1=stats.dscore_variants(blocks, stats.IAT1_PAIRS),
+        iat2=stats.dscore_variants(blocks, stats.IAT2_PAIRS),
     )
 
 
+def iat_dscore_intervals(blocks, seed=None):
+    """Intervalos bootstrap de ambos IAT: {'iat1': (inferior, superior) o None, 'iat2': ...}
+    Con la semilla del participante el intervalo es el mismo cada vez que se calcula.
+    """
+    rts = {rnd: [rt for rt, _ in trials] for rnd, trials in blocks.items()}
+    return dict(
+        iat1=stats.bootstrap_dscore(rts, stats.IAT1_PAIRS, seed=f"{seed}:iat1"),
+        iat2=stats.bootstrap_dscore(rts, stats.IAT2_PAIRS, seed=f"{seed}:iat2"),
+    )
+
+
+def clasificar(dscore, category):
+    """Clasifica la asociación según el dscore y la categoría"""
+    if dscore is None:
+        # sin trials válidos no hay d-score
+        return "Sin clasificación"
+    if abs(dscore) < 0.15:
+        return "Neutral"
+    if dscore < 0:
+        if -0.35 <= dscore <= -0.15:
+            if category == "Personas obesas/Personas delgadas":
+                return "Leve: Personas delgadas+bueno, Personas obesas+malo"
+            else:  # Personas homosexuales/Personas heterosexuales
+                return "Leve: Personas heterosexuales+bueno, Personas homosexuales+malo"
+        elif -0.65 <= dscore < -0.35:
+            if category == "Personas obesas/Personas delgadas":
+                return "Moderada: Personas delgadas+bueno, Personas obesas+malo"
+            else:
+                return "Moderada: Personas heterosexuales+bueno, Personas homosexuales+malo"
+        elif -2 <= dscore < -0.65:
+            if category == "Personas obesas/Personas delgadas":
+                return "Fuerte: Personas delgadas+bueno, Personas obesas+malo"
+            else:
+                return "Fuerte: Personas heterosexuales+bueno, Personas homosexuales+malo"
+    else:  # dscore > 0
+        if 0.15 <= dscore <= 0.35:
+            if category == "Personas obesas/Personas delgadas":
+                return "Leve: Personas obesas+bueno, Personas delgadas+malo"
+            else:
+                return "Leve: Personas homosexuales+bueno, Personas heterosexuales+malo"
+        elif 0.35 < dscore <= 0.65:
+            if category == "Personas obesas/Personas delgadas":
+                return "Moderada: Personas obesas+bueno, Personas delgadas+malo"
+            else:
+                return "Moderada: Personas homosexuales+bueno, Personas heterosexuales+malo"
+        elif 0.65 < dscore <= 2:
+            if category == "Personas obesas/Personas delgadas":
+                return "Fuerte: Personas obesas+bueno, Personas delgadas+malo"
+            else:
+                return "Fuerte: Personas homosexuales+bueno, Personas heterosexuales+malo"
+    return "Sin clasificación"
+
+
+INDETERMINADO = "Indeterminado"
+
+# un d-score dentro de cada clasificación, de la más negativa a la más positiva
+CLASSIFICATION_POINTS = (-1.0, -0.5, -0.25, 0.0, 0.25, 0.5, 1.0)
+
+
+def clasificaciones(dscore, interval, category):
+    """Clasificaciones compatibles con el d-score: las que cubre su intervalo de confianza.
+    Sin intervalo (pocos trials) sólo la del d-score.
+    """
+    if dscore is None or interval is None:
+        return [clasificar(dscore, category)]
+    labels = [clasificar(d, category) for d in CLASSIFICATION_POINTS]
+
+    def position(d):
+        label = clasificar(d, category)
+        if label in labels:
+            return labels.index(label)
+        # |d| > 2 queda fuera de las bandas; cuenta como la más extrema
+        return 0 if d < 0 else len(labels) - 1
+
+    low, high = interval
+    return labels[position(low):position(high) + 1]
+
+
+def iat_reliability(subsession: Subsession):
+    """Confiabilidad split-half de ambos IAT con los participantes que ya terminaron el IAT.
+    El resultado se guarda en session.vars y sólo se recalcula cuando termina alguien más.
+    """
+    session = subsession.session
+    finished = [p for p in subsession.get_players() if p.participant.vars.get('iat_assessment_completed')]
+    cached = session.vars.get('iat_reliability')
+    if cached is not None and cached['finished'] == len(finished):
+        return cached
+
+    participants = {}
+    for p in finished:
+        blocks = iat_trials(p)
+        participants[p.participant.code] = {rnd: [rt for rt, _ in trials] for rnd, trials in blocks.items()}
+    result = dict(
+        finished=len(finished),
+        iat1=stats.split_half_reliability(participants, stats.IAT1_PAIRS, seed=f"{session.code}:iat1"),
+        iat2=stats.split_half_reliability(participants, stats.IAT2_PAIRS, seed=f"{session.code}:iat2"),
+    )
+    session.vars['iat_reliability'] = result
+    return result
+
+
+def vars_for_admin_report(subsession: Subsession):
+    return iat_reliability(subsession)
+
+
 def get_progress(player: Player):
     """Return current player progress"""
     return dict(
@@ -1230,6 +1416,7 @@ def custom_export(players):
         "session",
         "participant_code",
         "round",
+        "iat_round",
         "primary_left",
         "primary_right",
         "secondary_left",
@@ -1243,6 +1430,7 @@ def custom_export(players):
         "response",
         "is_correct",
         "reaction_time",
+        "retries",
         "dictator_category",
         "dictator_offer",
         "assigned",
@@ -1250,43 +1438,138 @@ def custom_export(players):
         "payoff"
 
     ]
-    for p in players:
-        if p.round_number not in (3, 4, 6, 7, 10, 11, 13, 14, 15, 16):
+    # los trials que sigan en memoria se escriben antes de leer
+    trial_cache.sweep(max_age=0)
+    # las rondas se filtran antes de leer los trials; los trials se leen en lote (ver exports.py)
+    for p, trials in exports.trials_by_player(Trial, exports.export_players(players)):
+        if not trials:
+            continue
+        rnd = p.round_number
+        pv = p.participant.vars
+        # las categorías de cada esquina dependen del orden y las teclas del participante
+        prefix = [p.session.code, p.participant.code, rnd, get_actual_iat_round(p), *block_corners(get_player_block(p))]
+        # Leemos de participant.vars:
+        suffix = [
+            pv.get(f'cat_r{rnd}'),
+            pv.get(f'dictator_offer_r{rnd}'),
+            pv.get(f'assigned_r{rnd}'),
+            pv.get(f'kept_r{rnd}'),
+            pv.get(f'payoff_r{rnd}'),
+            # ... (más campos IAT si los deseas) ...
+        ]
+        for t in trials:
+            # t sigue el orden de exports.TRIAL_FIELDS, igual que las columnas
+            yield prefix + list(t) + suffix
+
+
+def export_trial_files(players, out_dir, *, participants_per_file=exports.PARTICIPANTS_PER_FILE, compress=True):
+    """Escribe custom_export en varios archivos de `participants_per_file` participantes cada uno
+    (trials.0001.csv.gz, trials.0002.csv.gz, ...), cada uno con su encabezado. La memoria
+    no depende del tamaño del estudio: sólo hay un grupo de trials a la vez y cada fila se
+    comprime al escribirla. Para estudios grandes, desde `otree shell`:
+        import iat
+        iat.export_trial_files(iat.Player.objects_filter(), 'export_trials')
+    result: [(ruta, número de trials)]
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    suffix = '.csv.gz' if compress else '.csv'
+    written = []
+    for i, group in enumerate(exports.participant_groups(players, participants_per_file), start=1):
+        path = out_dir / f"trials.{i:04d}{suffix}"
+        written.append((path, exports.write_csv(custom_export(group), path)))
+    return written
+
+
+BLOCK_SUMMARY_COLUMNS = (
+    "session",
+    "participant_code",
+    "round",
+    "iat_round",
+    "n_trials",
+    "n_trimmed_long",
+    "n_trimmed_short",
+    "mean_rt",
+    "sd_rt",
+    "mean_rt_correct",
+    "error_rate",
+    "fast_prop",
+)
+
+
+def custom_export_blocks(players):
+    """Una fila por participante y bloque del IAT con sus agregados, en vez de los trials"""
+    yield list(BLOCK_SUMMARY_COLUMNS)
+    trial_cache.sweep(max_age=0)
+    players = exports.export_players(players, DSCORE_ROUNDS)
+    for p, trials in exports.trials_by_player(Trial, players, fields=('reaction_time', 'retries')):
+        trials = [(rt, bool(retries)) for rt, retries in trials if rt is not None]
+        if not trials:
             continue
-        sess = p.session
+        summary = stats.block_summary(trials)
+        # iat_round: el bloque de BLOCKS que se mostró (el de la página depende del orden del participante)
+        yield [p.session.code, p.participant.code, p.round_number, get_actual_iat_round(p)] + [
+            summary[name] for name in BLOCK_SUMMARY_COLUMNS[4:]
+        ]
+
+
+STIAT_META_FIELDS = ("n_total", "n_fast_300ms", "excluded_fast_prop", "n_compat_used", "n_incompat_used", "sd_pooled")
+
+PARTICIPANT_SUMMARY_COLUMNS = (
+    (
+        "session",
+        "participant_code",
+        "dscore1",
+        "dscore2",
+        "dscore1_ci_low",
+        "dscore1_ci_high",
+        "dscore2_ci_low",
+        "dscore2_ci_high",
+    )
+    + tuple(f"{score}_{name}" for score in ("dscore1", "dscore2") for name in stats.VARIANTS)
+    + ("stiat_d", "stiat_class")
+    + tuple(f"stiat_{name}" for name in STIAT_META_FIELDS)
+)
+
+
+def custom_export_participants(players):
+    """Una fila por participante: d-scores del IAT (con variantes e intervalos) y el ST-IAT"""
+    yield list(PARTICIPANT_SUMMARY_COLUMNS)
+    # los campos del jugador se guardan en rondas distintas; se toma el primer valor de cada uno
+    fields = ('dscore1', 'dscore2', 'dscore1_ci_low', 'dscore1_ci_high', 'dscore2_ci_low', 'dscore2_ci_high', 'stiat_d')
+    found = {}
+    for p in players:
         part = p.participant
-        for t in Trial.filter(player=p):
-            rnd = p.round_number
-            pv = part.vars
-            yield [
-                sess.code,
-                part.code,
-                rnd,
-                t.iteration,
-                t.timestamp,
-                t.stimulus_cls,
-                t.stimulus_cat,
-                t.stimulus,
-                t.correct,
-                t.response,
-                t.is_correct,
-                t.reaction_time,
-                # Leemos de participant.vars:
-                pv.get(f'cat_r{rnd}'),
-                pv.get(f'dictator_offer_r{rnd}'),
-                pv.get(f'kept_r{rnd}'),
-                pv.get(f'assigned_r{rnd}'),
-                pv.get(f'payoff_r{rnd}'),
-                # ... (más campos IAT si los deseas) ...
-            ]
+        values = found.get(part.code)
+        if values is None:
+            values = found[part.code] = dict(session=p.session.code, participant=part)
+        for name in fields:
+            if values.get(name) is None:
+                values[name] = p.field_maybe_none(name)
+
+    for code, values in found.items():
+        pv = values['participant'].vars
+        variants = pv.get('iat_dscores', {})
+        meta = pv.get('stiat_meta', {})
+        row = [values['session'], code] + [values[name] for name in fields[:6]]
+        for score in ("dscore1", "dscore2"):
+            row += [variants.get(score, {}).get(name) for name in stats.VARIANTS]
+        row += [values['stiat_d'], pv.get('stiat_class')]
+        row += [meta.get(name) for name in STIAT_META_FIELDS]
+        yield row
+
 
 def play_game(player: Player, message: dict):
     try:
         session = player.session
         my_id = player.id_in_group
         ret_params = session.params
+        # las urls salen de los estímulos de la sesión, aunque después se haya recargado stimuli.csv
+        stimuli_registry = session_stimuli(session)
         max_iters = get_num_iterations_for_round(player)
         now = time.time()
+        # pendientes de otros jugadores (p. ej. de quien abandonó a mitad del bloque)
+        trial_cache.maybe_sweep(now)
         current = get_current_trial(player)
         message_type = message.get('type')
 
@@ -1294,7 +1577,7 @@ def play_game(player: Player, message: dict):
         if message_type == 'load':
             p = get_progress(player)
             if current:
-                return {my_id: dict(type='status', progress=p, trial=encode_trial(current))}
+                return {my_id: dict(type='status', progress=p, trial=encode_trial(current, stimuli_registry))}
             else:
                 return {my_id: dict(type='status', progress=p)}
 
@@ -1309,14 +1592,52 @@ def play_game(player: Player, message: dict):
                     return {my_id: dict(type='status', progress=get_progress(player), iterations_left=0)}
             # Generar y retornar un nuevo trial
             new_trial = generate_trial(player)
+            trial_cache.maybe_flush(player)
+            p = get_progress(player)
+            return {my_id: dict(type='trial', trial=encode_trial(new_trial, stimuli_registry), progress=p)}
+
+        # Caso "preloaded": el cliente terminó de descargar y decodificar las imágenes del bloque
+        elif message_type == 'preloaded':
+            player.participant.vars[f'preload_r{player.round_number}'] = dict(
+                count=message.get('count'),
+                failed=message.get('failed'),
+                ms=message.get('ms'),
+            )
+            return
+
+        # Caso "block": el cliente pide la secuencia completa del bloque y la recorre localmente
+        elif message_type == 'block':
             p = get_progress(player)
-            return {my_id: dict(type='trial', trial=encode_trial(new_trial), progress=p)}
+            return {my_id: dict(type='block', trials=encode_block(player, current), progress=p)}
 
         # Caso "answer": el jugador envía una respuesta
-        elif message_type == "answer":
+        # Caso "answer_next": igual, pero si es correcta se devuelve también el siguiente trial
+        elif message_type in ("answer", "answer_next"):
+            iteration = message.get('iteration')
+            if iteration is not None and iteration == player.iteration + 1:
+                # modo bloque: la respuesta corresponde al siguiente trial de la secuencia precargada,
+                # se aplican las mismas validaciones que en "next" antes de registrarlo
+                if iteration > max_iters:
+                    return {my_id: dict(type='error', message="No quedan trials en este bloque.")}
+                if current is not None:
+                    if current.response is None:
+                        return {my_id: dict(type='error', message="Debes resolver el trial actual antes de continuar.")}
+                    if now < current.timestamp + ret_params["trial_delay"]:
+                        return {my_id: dict(type='error', message="Estás intentando avanzar demasiado rápido.")}
+                # el servidor no ve cuándo se mostró el trial: se guarda la hora en que llegó
+                # la respuesta; el tiempo de reacción que mide el cliente queda en reaction_time
+                current = generate_trial(player, timestamp=now)
+            elif iteration is not None and iteration != player.iteration:
+                # p. ej. tras un reinicio del servidor: el cliente debe pedir de nuevo el bloque
+                return {my_id: dict(type='error', message="La respuesta no corresponde al trial actual.", resync=True)}
+
             if current is None:
                 return {my_id: dict(type='error', message="No hay trial activo para responder.")}
+            # Un trial entregado por "answer_next" no puede contestarse antes de su not_before
+            if now < current.timestamp:
+                return {my_id: dict(type='error', message="Estás respondiendo demasiado rápido.")}
             # Si ya se respondió previamente, se trata de un reintento
+            old_rt = current.reaction_time if current.response is not None else None
             if current.response is not None:
                 if now < current.response_timestamp + ret_params["retry_delay"]:
                     return {my_id: dict(type='error', message="Estás respondiendo demasiado rápido.")}
@@ -1326,12 +1647,15 @@ def play_game(player: Player, message: dict):
                     player.num_correct -= 1
                 else:
                     player.num_failed -= 1
+                    # errores antes de la respuesta final (las variantes D3-D6 los reemplazan)
+                    current.retries = (current.retries or 0) + 1
 
             answer = message.get("answer")
             if not answer:
                 return {my_id: dict(type='error', message="Respuesta inválida.")}
             current.response = answer
-            current.reaction_time = message.get("reaction_time", 0)
+            current.reaction_time = float(message.get("reaction_time") or 0)
+            update_running_dscore(player, old_rt, current.reaction_time)
             current.is_correct = (current.correct == answer)
             current.response_timestamp = now
 
@@ -1341,14 +1665,24 @@ def play_game(player: Player, message: dict):
                 player.num_failed += 1
             player.num_trials += 1
 
-            p = get_progress(player)
-            return {my_id: dict(type='feedback', is_correct=current.is_correct, progress=p)}
+            reply = dict(type='feedback', is_correct=current.is_correct)
+            if message_type == "answer_next" and current.is_correct and current.iteration < max_iters:
+                # el siguiente trial sale en la misma respuesta; el cliente lo muestra a partir
+                # de not_before y el servidor rechaza respuestas anteriores a ese momento
+                not_before = now + ret_params["trial_delay"]
+                reply['trial'] = encode_trial(generate_trial(player, timestamp=not_before), stimuli_registry)
+                reply['not_before'] = not_before
+                reply['server_time'] = now
+
+            trial_cache.maybe_flush(player, done=current.is_correct and current.iteration == max_iters)
+            reply['progress'] = get_progress(player)
+            return {my_id: reply}
 
         # Caso "cheat": modo de depuración en DEBUG para generar datos automáticamente
         elif message_type == "cheat" and settings.DEBUG:
             m = float(message.get('reaction', 0))
             if current:
-                current.delete()
+                trial_cache.discard(player, current)
             for i in range(player.iteration, max_iters):
                 t = generate_trial(player)
                 t.iteration = i
@@ -1357,6 +1691,8 @@ def play_game(player: Player, message: dict):
                 t.is_correct = True
                 t.response_timestamp = now + i
                 t.reaction_time = random.gauss(m, 0.3)
+            # se reescribieron iteraciones: guardar y recargar desde la base de datos
+            trial_cache.release(player)
             return {my_id: dict(type='status', progress=get_progress(player), iterations_left=0)}
 
         # Mensaje no reconocido
@@ -1409,22 +1745,16 @@ class Intro(Page):
     @staticmethod
     def vars_for_template(player: Player):
         params = player.session.params
-        iat_round_order = player.participant.vars.get('iat_round_order', [])
-
-        if iat_round_order == [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]:
-            block_number = {1: 3, 8: 10}
-        elif iat_round_order == [8, 9, 10, 11, 12, 13, 14, 1, 2, 3, 4, 5, 6, 7]:
-            block_number = {1: 10, 8: 3}
-        else:
-            block_number = {}
-
-        block_id = block_number.get(player.round_number, None)
-        # Asegurar que block sea un diccionario válido
-        block = get_block_for_round(block_id, params) if block_id else None
+        # etiquetas del primer bloque combinado del IAT que empieza (ronda 3 o 10 de la página)
+        rnd = player.round_number + 2
+        labels = PAGE_CONTEXTS.get(
+            page_context_key(player, 'intro', rnd),
+            lambda: labels_for_block(get_player_block(player, rnd)),
+        )
 
         return dict(
             params=params,
-            labels=labels_for_block(block) if isinstance(block, dict) else {},
+            labels=labels,
         )
 
 
@@ -1437,6 +1767,10 @@ class Intro(Page):
 
 
 
+LKEYS = "/".join(k for k, side in Constants.keys.items() if side == 'left')
+RKEYS = "/".join(k for k, side in Constants.keys.items() if side == 'right')
+
+
 class RoundN(Page):
     template_name = "iat/templates/Main.html"
 
@@ -1447,39 +1781,50 @@ class RoundN(Page):
 
     @staticmethod
     def js_vars(player: Player):
-        actual_round = get_actual_iat_round(player)
         return dict(
             params=player.session.params,
             keys=Constants.keys,
-            actual_round=actual_round
+            actual_round=get_actual_iat_round(player),
+            preload=round_context(player)['preload'],
         )
 
     @staticmethod
     def vars_for_template(player: Player):
-        actual_round = get_actual_iat_round(player)
-        params = player.session.params
-        block = get_block_for_round(actual_round, params)
+        context = round_context(player)
         return dict(
-            params=params,
-            block=block,
-            thumbnails=thumbnails_for_block(block, params),
-            labels=labels_for_block(block),
+            params=player.session.params,
+            block=context['block'],
+            thumbnails=context['thumbnails'],
+            labels=context['labels'],
             num_iterations=get_num_iterations_for_round(player),
             DEBUG=settings.DEBUG,
             keys=Constants.keys,
-            lkeys="/".join(
-                [k for k in Constants.keys.keys() if Constants.keys[k] == 'left']
-            ),
-            rkeys="/".join(
-                [k for k in Constants.keys.keys() if Constants.keys[k] == 'right']
-            ),
+            lkeys=LKEYS,
+            rkeys=RKEYS,
         )
 
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened):
+        # guardar los trials que sigan en memoria antes de salir de la ronda
+        trial_cache.release(player)
+
     live_method = play_game
 
 
 #nueva página para el stiat de minno: la herramienta de minno es la herramienta que hay que implementar para ambos iat. 
 
+# campos del jugador con registros de MinnoJS; todos se guardan compactos (ver stiat.encode_stiat)
+STIAT_RAW_FIELDS = ('stiat_raw', 'stiat_sex_raw', 'stiat_dis_raw')
+
+
+def compact_stiat_fields(player: Player):
+    """Guarda compactos los registros de MinnoJS que todavía estén como CSV"""
+    for name in STIAT_RAW_FIELDS:
+        value = player.field_maybe_none(name)
+        if value and not stiat.is_encoded(value):
+            setattr(player, name, encode_stiat(value))
+
+
 # En tu clase StiatMinno, sustituye el before_next_page por éste:
 
 class StiatMinno(Page):
@@ -1493,8 +1838,8 @@ class StiatMinno(Page):
 
     @staticmethod
     def before_next_page(player: Player, timeout_happened):
-        # 1) parsear CSV de Minno
-        trials = parse_minno_stiat_csv(player.stiat_raw or "")
+        # 1) parsear CSV de Minno (si se vuelve a enviar la página ya viene compacto)
+        trials = StiatLog(player.stiat_raw).trials
 
         # 2) mapa de bloques: toma de session.config si existe; si no, usa defaults (3=compat, 5=incompat)
         bm = player.session.config.get('stiat_block_map', DEFAULT_STIAT_BLOCK_MAP)
@@ -1504,7 +1849,8 @@ class StiatMinno(Page):
         # 3) calcular D
         d, meta = compute_stiat_d(trials, compat, incompat)
 
-        # 4) guardar
+        # 4) guardar; el CSV queda compacto y se recupera con StiatLog(player.stiat_raw).raw
+        compact_stiat_fields(player)
         player.stiat_d = d
         pv = player.participant.vars
         pv['stiat_meta'] = meta
@@ -1615,7 +1961,7 @@ class Comprehension(Page):
     @staticmethod
     def is_displayed(player):
         return (
-            player.participant.vars.get('iat_round_order') == list(range(1, 15))
+            iat_order(player) == 'direct'
             and not player.participant.vars.get('compr1_shown', False)
         )
 
@@ -1660,7 +2006,7 @@ class ComprehensionFeedback(Page):
     @staticmethod
     def is_displayed(player: Player):
         return (
-            player.participant.vars.get('iat_round_order', []) == list(range(1, 15))
+            iat_order(player) == 'direct'
             and not player.participant.vars.get('feedback1_shown', False)
         )
 
@@ -1696,13 +2042,15 @@ class Comprehension2(Page):
     @staticmethod
     def is_displayed(player: Player):
         return (
-            player.participant.vars.get('iat_round_order')
-                == (list(range(8, 15)) + list(range(1, 8)))
+            iat_order(player) == 'inverted'
             and not player.participant.vars.get('compr2_shown', False)
         )
 
 
 class ComprehensionFeedback2(Page):
+    # misma página de resultados que el primer cuestionario
+    template_name = 'iat/ComprehensionFeedback.html'
+
     @staticmethod
     def vars_for_template(player):
         results = player.participant.vars['comp_results']
@@ -1711,6 +2059,7 @@ class ComprehensionFeedback2(Page):
         for fname, info in results.items():
             info['options']     = Constants.QUESTION_OPTIONS2[fname]
             info['explanation'] = Constants.CORRECT_EXPLANATIONS2[fname]
+            info['given_label'] = OrderedDict(info['options']).get(info['given'], "(sin marcar)")
 
         return dict(
             results=results,
@@ -1721,8 +2070,7 @@ class ComprehensionFeedback2(Page):
     @staticmethod
     def is_displayed(player: Player):
         return (
-                player.participant.vars.get('iat_round_order', [])
-                == (list(range(8, 15)) + list(range(1, 8)))
+                iat_order(player) == 'inverted'
                 and not player.participant.vars.get('feedback2_shown', False)
         )
 
@@ -1734,7 +2082,7 @@ class InstruccionesGenerales1(Page):
     @staticmethod
     def is_displayed(player: Player):
         return (
-            player.participant.vars.get('iat_round_order') == list(range(1, 15))
+            iat_order(player) == 'direct'
             and not player.participant.vars.get('user_generales1_completed', False)
         )
 
@@ -1747,8 +2095,7 @@ class InstruccionesGenerales2(Page):
     @staticmethod
     def is_displayed(player: Player):
         return (
-            player.participant.vars.get('iat_round_order')
-                == (list(range(8, 15)) + list(range(1, 8)))
+            iat_order(player) == 'inverted'
             and not player.participant.vars.get('user_generales2_completed', False)
         )
 
@@ -1796,91 +2143,55 @@ class IATAssessmentPage(Page):
         else:
             category = "Sin categoría asignada"
 
-        # Función para extraer los tiempos de reacción de las rondas especificadas
-        def extract(rnd):
-            trials = [
-                t
-                for t in Trial.filter(player=player.in_round(rnd))
-                if t.reaction_time is not None
-            ]
-            return [t.reaction_time for t in trials]
-
-        # Extraer datos para el primer iat (rondas 3, 4, 6, 7)
-        data3 = extract(3)
-        data4 = extract(4)
-        data6 = extract(6)
-        data7 = extract(7)
-        dscore1_result = dscore1(data3, data4, data6, data7)
-
-        # Extraer datos para el segundo iat (rondas 10, 13, 11, 14)
-        data10 = extract(10)
-        data13 = extract(13)
-        data11 = extract(11)
-        data14 = extract(14)
-        dscore2_result = dscore2(data10, data13, data11, data14)
-
-        # Recuperar el orden de las rondas y asignar dscores según ello
-        iat_round_order = player.participant.vars.get('iat_round_order', [])
-        if iat_round_order == [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]:
-            player.dscore1 = dscore1_result
-            player.dscore2 = dscore2_result
-        elif iat_round_order == [8, 9, 10, 11, 12, 13, 14, 1, 2, 3, 4, 5, 6, 7]:
-            player.dscore1 = dscore2_result
-            player.dscore2 = dscore1_result
+        # Los acumuladores que se llenan durante el juego ya tienen ambos d-scores;
+        # sólo si no están completos se vuelven a leer los trials.
+        # Ambos van por ronda de BLOCKS: dscore1 es siempre el primer IAT, sin importar el orden
+        running = running_dscores(player)
+        if running is not None:
+            dscore1_result, dscore2_result = running
         else:
-            # En caso de otro orden, se asigna directamente
-            player.dscore1 = dscore1_result
-            player.dscore2 = dscore2_result
-
-        # Función para clasificar la asociación según el dscore y la categoría
-        def clasificar(dscore, category):
-            if abs(dscore) < 0.15:
-                return "Neutral"
-            if dscore < 0:
-                if -0.35 <= dscore <= -0.15:
-                    if category == "Personas obesas/Personas delgadas":
-                        return "Leve: Personas delgadas+bueno, Personas obesas+malo"
-                    else:  # Personas homosexuales/Personas heterosexuales
-                        return "Leve: Personas heterosexuales+bueno, Personas homosexuales+malo"
-                elif -0.65 <= dscore < -0.35:
-                    if category == "Personas obesas/Personas delgadas":
-                        return "Moderada: Personas delgadas+bueno, Personas obesas+malo"
-                    else:
-                        return "Moderada: Personas heterosexuales+bueno, Personas homosexuales+malo"
-                elif -2 <= dscore < -0.65:
-                    if category == "Personas obesas/Personas delgadas":
-                        return "Fuerte: Personas delgadas+bueno, Personas obesas+malo"
-                    else:
-                        return "Fuerte: Personas heterosexuales+bueno, Personas homosexuales+malo"
-            else:  # dscore > 0
-                if 0.15 <= dscore <= 0.35:
-                    if category == "Personas obesas/Personas delgadas":
-                        return "Leve: Personas obesas+bueno, Personas delgadas+malo"
-                    else:
-                        return "Leve: Personas homosexuales+bueno, Personas heterosexuales+malo"
-                elif 0.35 < dscore <= 0.65:
-                    if category == "Personas obesas/Personas delgadas":
-                        return "Moderada: Personas obesas+bueno, Personas delgadas+malo"
-                    else:
-                        return "Moderada: Personas homosexuales+bueno, Personas heterosexuales+malo"
-                elif 0.65 < dscore <= 2:
-                    if category == "Personas obesas/Personas delgadas":
-                        return "Fuerte: Personas obesas+bueno, Personas delgadas+malo"
-                    else:
-                        return "Fuerte: Personas homosexuales+bueno, Personas heterosexuales+malo"
-            return "Sin clasificación"
+            data = {rnd: [rt for rt, _ in trials] for rnd, trials in iat_trials(player).items()}
+            # primer iat (rondas 3, 4, 6, 7)
+            dscore1_result = dscore1(data[3], data[4], data[6], data[7])
+            # segundo iat (rondas 10, 13, 11, 14)
+            dscore2_result = dscore2(data[10], data[13], data[11], data[14])
+
+        player.dscore1 = dscore1_result
+        player.dscore2 = dscore2_result
+
+        # Todas las variantes (D1-D6) y los intervalos de confianza se calculan una sola vez,
+        # al cerrar el puntaje; la exportación lee los valores guardados.
+        # Los intervalos no se muestran en esta página
+        pv = player.participant.vars
+        if 'iat_dscores' not in pv or 'iat_dscore_ci' not in pv:
+            blocks = iat_trials(player)
+            variants = iat_dscore_variants(blocks)
+            intervals = iat_dscore_intervals(blocks, seed=pv.get('iat_seed'))
+            pv['iat_dscores'] = dict(dscore1=variants['iat1'], dscore2=variants['iat2'])
+            pv['iat_dscore_ci'] = dict(dscore1=intervals['iat1'], dscore2=intervals['iat2'])
+        dscore1_ci = pv['iat_dscore_ci']['dscore1']
+        dscore2_ci = pv['iat_dscore_ci']['dscore2']
+        if dscore1_ci is not None:
+            player.dscore1_ci_low, player.dscore1_ci_high = dscore1_ci
+        if dscore2_ci is not None:
+            player.dscore2_ci_low, player.dscore2_ci_high = dscore2_ci
 
         # Se asigna la asociación de forma fija:
         # - iat1 corresponde siempre a "Personas obesas/Personas delgadas"
         # - iat2 corresponde siempre a "Personas homosexuales/Personas heterosexuales"
-        player.iat1_association = clasificar(player.dscore1, "Personas obesas/Personas delgadas")
-        player.iat2_association = clasificar(player.dscore2, "Personas homosexuales/Personas heterosexuales")
+        # Si el intervalo cruza el límite entre dos clasificaciones la asociación queda
+        # indeterminada, para que el ruido no la cambie de "Leve" a "Moderada"
+        covered1 = clasificaciones(player.field_maybe_none('dscore1'), dscore1_ci, "Personas obesas/Personas delgadas")
+        covered2 = clasificaciones(player.field_maybe_none('dscore2'), dscore2_ci, "Personas homosexuales/Personas heterosexuales")
+        pv['iat_classifications'] = dict(dscore1=covered1, dscore2=covered2)
+        player.iat1_association = covered1[0] if len(covered1) == 1 else INDETERMINADO
+        player.iat2_association = covered2[0] if len(covered2) == 1 else INDETERMINADO
 
         return dict(
             category=category,
             endowment=Constants.endowment,
-            dscore1=player.dscore1,
-            dscore2=player.dscore2,
+            dscore1=player.field_maybe_none('dscore1'),
+            dscore2=player.field_maybe_none('dscore2'),
             iat1_association=player.iat1_association,
             iat2_association=player.iat2_association,
         )
@@ -1905,8 +2216,10 @@ class IATAssessmentPage(Page):
         expected_iat1 = player.iat1_association
         expected_iat2 = player.iat2_association
 
-        player.iat1_guess_correct = (player.iat1_self_assessment == expected_iat1)
-        player.iat2_guess_correct = (player.iat2_self_assessment == expected_iat2)
+        # con la asociación indeterminada vale cualquier clasificación que cubra el intervalo
+        covered = participant.vars.get('iat_classifications', {})
+        player.iat1_guess_correct = player.iat1_self_assessment in covered.get('dscore1', [expected_iat1])
+        player.iat2_guess_correct = player.iat2_self_assessment in covered.get('dscore2', [expected_iat2])
 
         # Validación de los rangos morales para iat 1 y iat 2
         iat1_moral_range = (
@@ -2035,7 +2348,7 @@ class MoralDecisionPageCerteza(Page):
         # Only show to participants with iat order 1-14 and not shown yet
         return (
                 player.round_number == 15 and
-                player.participant.vars.get('iat_round_order') == list(range(1, 15))
+                iat_order(player) == 'direct'
                 and not player.participant.vars.get('certeza_shown', False)
         )
 
@@ -2082,10 +2395,9 @@ class MoralDecisionPageCerteza2(Page):
     @staticmethod
     def is_displayed(player: Player):
         # Show to participants with the alternate iat order and not shown yet
-        alternate_order = list(range(8, 15)) + list(range(1, 8))
         return (
             player.round_number == 15 and
-            player.participant.vars.get('iat_round_order') == alternate_order
+            iat_order(player) == 'inverted'
             and not player.participant.vars.get('certeza2_shown', False)
         )
 
@@ -2209,10 +2521,9 @@ class DictatorOffer(Page):
 
     @staticmethod
     def is_displayed(player: Player):
-        rotated = list(range(1, 8)) + list(range(8, 15))
         return (
             player.round_number in (15, 16)
-            and player.participant.vars.get("iat_round_order") == rotated
+            and iat_order(player) == 'direct'
         )
 
     @staticmethod
@@ -2287,10 +2598,9 @@ class DictatorOffer2(Page):
 
     @staticmethod
     def is_displayed(player: Player):
-        alternate = list(range(8, 15)) + list(range(1, 8))
         return (
             player.round_number in (15, 16)
-            and player.participant.vars.get('iat_round_order') == alternate
+            and iat_order(player) == 'inverted'
         )
 
     @staticmethod
@@ -2369,7 +2679,7 @@ class DictatorOffer2(Page):
     @staticmethod
     def before_next_page(player: Player, timeout_happened):
         player.group.kept = player.dictator_offer
-        set_payoffs(player.group)
+        set_payoffs(player.group, player)
 
         rnd = player.round_number
         pv = player.participant.vars
@@ -2383,10 +2693,9 @@ class DictatorOffer2(Page):
 class ResultsDictador(Page):
     @staticmethod
     def is_displayed(player: Player):
-        rotated = list(range(1, 8)) + list(range(8, 15))
         return (
             player.round_number == 16
-            and player.participant.vars.get("iat_round_order") == rotated
+            and iat_order(player) == 'direct'
         )
 
     @staticmethod
@@ -2438,14 +2747,14 @@ class ResultsDictator2(Page):
     """Resultados para participantes con ordering invertido (DictatorOffer2)."""
     @staticmethod
     def is_displayed(player: Player):
-        alternate = list(range(8, 15)) + list(range(1, 8))
         return (
             player.round_number == 16
-            and player.participant.vars.get("iat_round_order") == alternate
+            and iat_order(player) == 'inverted'
         )
 
     @staticmethod
     def vars_for_template(player: Player):
+        player.participant.finished = True
         dictator_offers = []
         pv = player.participant.vars
         for rnd in [15, 16]:
@@ -2462,7 +2771,16 @@ class ResultsDictator2(Page):
                 'kept':          kept,
                 'assigned':      assigned,
             })
-        return dict(dictator_offers=dictator_offers)
+
+        try:
+            prolific_url = player.session.prolific_completion_url
+        except KeyError:
+            prolific_url = None
+
+        return dict(
+            dictator_offers=dictator_offers,
+            prolific_url=prolific_url,
+        )
 
     @staticmethod
     def before_next_page(player: Player, timeout_happened):
@@ -2494,6 +2812,6 @@ page_sequence = [
     DictatorOffer,
     DictatorOffer2, # Rondas 16-18: Oferta del Dictador,    # Rondas 16-18: Espera de Resultados del Dictador
     ResultsDictador,  # Rondas 16-18: Resultados del Dictador,            # Ronda 18: Resultados Finales del Dictador
-    #ResultsDictator2,
+    ResultsDictator2,  # Ronda 16: resultados para el orden invertido
 ]
 
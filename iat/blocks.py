@@ -4,7 +4,6 @@ Categories are configured in session config like:
 Numbers in block config corresponds to 1st and 2nd element of corresponding pair
 """
 import copy
-import random
 
 # los participantes que reciben este bloque tiene el IAT dispacitados - discapacitados y luego el IAT homosexuales y heterosexuales. 
 BLOCKS1 = {
@@ -250,16 +249,18 @@ BLOCKS2 = {
     }
 }
 
-# Genera el iat_ordering
-direct = list(range(1, 15))
-invertido = list(range(8, 15)) + list(range(1, 8))
-iat_ordering = random.choice([direct, invertido])
 
-# Condicional para asignar la configuración de bloques
-if iat_ordering == direct:
-    BLOCKS = BLOCKS1
-else:
-    BLOCKS = BLOCKS2
+def mirrored(layout):
+    """La misma tabla de bloques con los lados cambiados: lo que iba a la izquierda va a la derecha.
+    Cada ronda conserva sus categorías; sólo cambian las teclas.
+    """
+    return {rnd: dict(block, left=block['right'], right=block['left']) for rnd, block in layout.items()}
+
+
+# disposiciones de teclas; cada participante tiene la suya (ver counterbalance.py).
+# BLOCKS2 no es una disposición: es el orden invertido de los IAT, que ya da counterbalance.ORDERS
+LAYOUTS = {1: BLOCKS1, 2: mirrored(BLOCKS1)}
+BLOCKS = BLOCKS1
 
 def configure(block, config):
     """Insertar nombres de categorías desde la configuración en el setup del bloque.
@@ -281,3 +282,65 @@ def configure(block, config):
                 # Si idx no es un entero, asignar una cadena vacía o manejarlo según tu lógica
                 result[side][cls] = ''
     return result
+
+
+class FrozenBlock(dict):
+    """dict de sólo lectura para los bloques compilados.
+    Es un dict normal para las plantillas y js_vars, pero no se puede modificar.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Los bloques compilados son de sólo lectura")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return FrozenBlock, (dict(self),)
+
+
+def compile_block(block, config, pools):
+    """Configura un bloque una sola vez y precalcula sus candidatos.
+    pools: {categoría: [estímulos]}, normalmente stimuli.DICT
+    result: el bloque configurado más
+      'candidates': ((side, cls, category, (estímulos...)), ...)
+      'by_side': {'left': (candidatos de la izquierda), 'right': (...)}
+    """
+    configured = configure(block, config)
+    candidates = []
+    by_side = {}
+    for side in ['left', 'right']:
+        side_candidates = []
+        for cls, cat in configured[side].items():
+            if not cat:
+                # rondas sin IAT (15+) o categoría no configurada
+                continue
+            side_candidates.append((side, cls, cat, tuple(pools[cat])))
+        by_side[side] = tuple(side_candidates)
+        candidates.extend(side_candidates)
+    result = dict(configured)
+    result['left'] = FrozenBlock(configured['left'])
+    result['right'] = FrozenBlock(configured['right'])
+    result['candidates'] = tuple(candidates)
+    result['by_side'] = FrozenBlock(by_side)
+    return FrozenBlock(result)
+
+
+# tablas compiladas, por configuración de categorías
+_compiled = {}
+
+
+def compile_blocks(config, pools, layout=None):
+    """Tabla {ronda: bloque compilado} para todas las rondas de `layout` (BLOCKS por defecto).
+    Se compila una vez por configuración, layout y versión de los estímulos (sesiones
+    con estímulos distintos pueden estar activas a la vez, ver registry.Library).
+    """
+    if layout is None:
+        layout = BLOCKS
+    key = (id(layout), id(pools), tuple(config.get('primary') or ()), tuple(config.get('secondary') or ()))
+    cached = _compiled.get(key)
+    if cached is not None and cached[0] is layout and cached[1] is pools:
+        return cached[2]
+    table = FrozenBlock({rnd: compile_block(block, config, pools) for rnd, block in layout.items()})
+    _compiled[key] = (layout, pools, table)
+    return table
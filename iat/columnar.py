@@ -0,0 +1,249 @@
+"""Exportación por columnas de los trials
+
+Guarda las mismas columnas que custom_export, pero cada una en su propio
+archivo .npy dentro de un directorio:
+ - tiempos (timestamp, reaction_time) y montos del dictador como float64 (NaN si faltan)
+ - enteros (round, iteration, retries) como int32 (-1 si faltan)
+ - is_correct como int8 (1, 0 o -1 si falta)
+ - textos (sesión, participante, categorías, estímulo...) como códigos int32
+   sobre un diccionario guardado en meta.json (-1 si faltan)
+Los .npy se pueden abrir con numpy.load(..., mmap_mode='r') sin copiar ni parsear
+nada; `load` y `to_dataframe` hacen eso mismo. El archivo se escribe por partes,
+así que no hace falta tener la exportación completa en memoria.
+
+Uso (desde la raíz del proyecto, a partir del CSV de custom_export):
+    python iat/columnar.py export.csv trials_columnar/
+Desde `otree shell` también se puede escribir directo desde la base de datos:
+    from iat import columnar, custom_export, Player
+    columnar.write(custom_export(Player.objects_filter()), 'trials_columnar')
+
+En Python:
+    from iat.columnar import to_dataframe
+    df = to_dataframe('trials_columnar')
+"""
+import argparse
+import ast
+import csv
+import json
+import math
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+FORMAT = "iat-columnar"
+VERSION = 1
+META = "meta.json"
+
+# tipo de cada columna de custom_export; las que no están aquí se guardan como categoría
+FLOAT_COLUMNS = ("timestamp", "reaction_time", "dictator_offer", "assigned", "kept", "payoff")
+INT_COLUMNS = ("round", "iat_round", "iteration", "retries")
+BOOL_COLUMNS = ("is_correct",)
+
+# typecode de array, dtype de numpy
+_KINDS = dict(
+    float=('d', '<f8'),
+    int=('i', '<i4'),
+    bool=('b', '|i1'),
+    category=('i', '<i4'),
+)
+
+_MAGIC = b'\x93NUMPY\x01\x00'
+_HEADER_LEN = 118  # 10 + 118 = 128 bytes, alineado a 64 como escribe numpy
+FLUSH_ROWS = 65536
+
+
+def _kind(name):
+    if name in FLOAT_COLUMNS:
+        return 'float'
+    if name in INT_COLUMNS:
+        return 'int'
+    if name in BOOL_COLUMNS:
+        return 'bool'
+    return 'category'
+
+
+def _missing(value):
+    return value is None or value == '' or value == 'None'
+
+
+def _to_float(value):
+    return math.nan if _missing(value) else float(value)
+
+
+def _to_int(value):
+    return -1 if _missing(value) else int(value)
+
+
+def _to_bool(value):
+    if _missing(value):
+        return -1
+    if isinstance(value, str):
+        return 1 if value.strip().lower() in ('1', 'true') else 0
+    return 1 if value else 0
+
+
+def _npy_header(dtype, n):
+    text = repr(dict(descr=dtype, fortran_order=False, shape=(n,))).encode('latin1')
+    text = text.ljust(_HEADER_LEN - 1) + b'\n'
+    return _MAGIC + struct.pack('<H', _HEADER_LEN) + text
+
+
+def _le_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class _Column:
+    """Un archivo .npy que se va llenando; el encabezado se completa al cerrar"""
+
+    def __init__(self, path, name):
+        self.name = name
+        self.kind = _kind(name)
+        self.typecode, self.dtype = _KINDS[self.kind]
+        self.file = open(path / f"{name}.npy", 'wb')
+        self.file.write(_npy_header(self.dtype, 0))
+        self.buffer = array(self.typecode)
+        self.n = 0
+        self.codes = {} if self.kind == 'category' else None
+
+    def add(self, value):
+        if self.kind == 'float':
+            self.buffer.append(_to_float(value))
+        elif self.kind == 'int':
+            self.buffer.append(_to_int(value))
+        elif self.kind == 'bool':
+            self.buffer.append(_to_bool(value))
+        elif _missing(value):
+            self.buffer.append(-1)
+        else:
+            value = str(value)
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.codes)
+            self.buffer.append(code)
+
+    def flush(self):
+        self.file.write(_le_bytes(self.buffer))
+        self.n += len(self.buffer)
+        self.buffer = array(self.typecode)
+
+    def close(self):
+        self.flush()
+        self.file.seek(0)
+        self.file.write(_npy_header(self.dtype, self.n))
+        self.file.close()
+
+
+def write(rows, path):
+    """Escribe las filas de custom_export (la primera es el encabezado) en el directorio `path`.
+    result: número de trials escritos
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    rows = iter(rows)
+    header = [str(name) for name in next(rows)]
+    columns = [_Column(path, name) for name in header]
+    pending = 0
+    try:
+        for row in rows:
+            if not row:
+                continue
+            for column, value in zip(columns, row):
+                column.add(value)
+            pending += 1
+            if pending == FLUSH_ROWS:
+                for column in columns:
+                    column.flush()
+                pending = 0
+    finally:
+        for column in columns:
+            column.close()
+
+    n = columns[0].n if columns else 0
+    meta = dict(
+        format=FORMAT,
+        version=VERSION,
+        n_rows=n,
+        columns={c.name: dict(kind=c.kind, dtype=c.dtype, file=f"{c.name}.npy") for c in columns},
+        categories={c.name: list(c.codes) for c in columns if c.codes is not None},
+    )
+    with open(path / META, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+    return n
+
+
+def read_meta(path):
+    with open(Path(path) / META, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT or meta.get('version') != VERSION:
+        raise ValueError(f"{path} no es una exportación {FORMAT} v{VERSION}")
+    return meta
+
+
+def _read_npy(file, typecode):
+    """Lee un .npy 1-D escrito por `write` sin numpy"""
+    with open(file, 'rb') as f:
+        prefix = f.read(10)
+        if prefix[:8] != _MAGIC:
+            raise ValueError(f"{file} no es un .npy v1.0")
+        header = ast.literal_eval(f.read(struct.unpack('<H', prefix[8:])[0]).decode('latin1'))
+        values = array(typecode)
+        values.frombytes(f.read())
+    if sys.byteorder == 'big':
+        values.byteswap()
+    if len(values) != header['shape'][0]:
+        raise ValueError(f"{file} está incompleto")
+    return values
+
+
+def load(path, mmap=True):
+    """Abre una exportación por columnas.
+    result: (columns, meta) con columns = {nombre: arreglo}; las categorías quedan
+      como códigos y su diccionario está en meta['categories'][nombre].
+    Con numpy instalado los arreglos son numpy (mapeados en memoria si mmap=True);
+    si no, son array.array.
+    """
+    path = Path(path)
+    meta = read_meta(path)
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    columns = {}
+    for name, info in meta['columns'].items():
+        if numpy is not None:
+            columns[name] = numpy.load(path / info['file'], mmap_mode='r' if mmap else None)
+        else:
+            columns[name] = _read_npy(path / info['file'], _KINDS[info['kind']][0])
+    return columns, meta
+
+
+def to_dataframe(path):
+    """La exportación como DataFrame de pandas, con las categorías como pandas.Categorical"""
+    import pandas
+
+    columns, meta = load(path)
+    data = {}
+    for name, values in columns.items():
+        if name in meta['categories']:
+            data[name] = pandas.Categorical.from_codes(values, meta['categories'][name])
+        else:
+            data[name] = values
+    return pandas.DataFrame(data, copy=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convierte el CSV de custom_export a columnas .npy")
+    parser.add_argument("export", help="CSV de custom_export")
+    parser.add_argument("output", help="directorio de salida")
+    args = parser.parse_args(argv)
+    with open(args.export, newline='', encoding='utf-8-sig') as f:
+        n = write(csv.reader(f), args.output)
+    print(f"{n} trials -> {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
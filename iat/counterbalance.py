@@ -0,0 +1,62 @@
+"""Contrabalanceo por participante
+
+Cada participante recibe una condición: el orden de los dos IAT (directo: rondas
+1-7 y luego 8-14; invertido: 8-14 y luego 1-7) y la disposición de las teclas
+(blocks.LAYOUTS: 1 = BLOCKS1, 2 = BLOCKS1 con la izquierda y la derecha cambiadas).
+
+Las condiciones se reparten con un cuadrado latino balanceado (Williams): la
+fila i es la primera fila desplazada i lugares y el participante k (id_in_session
+desde 1) toma la posición k - 1 de las filas una tras otra. Cada grupo consecutivo
+de len(conditions) participantes recibe todas las condiciones, y cada condición
+va antes de cada otra el mismo número de veces.
+
+La asignación sólo depende de id_in_session, así que es la misma en cualquier
+proceso (prodserver1of2 y 2of2) y no necesita un contador compartido. Se guarda
+en participant.vars['iat_condition'] (y el orden en 'iat_round_order').
+"""
+DIRECT = tuple(range(1, 15))
+INVERTED = tuple(range(8, 15)) + tuple(range(1, 8))
+ORDERS = {'direct': DIRECT, 'inverted': INVERTED}
+LAYOUT_IDS = (1, 2)
+
+
+def conditions(orders=tuple(ORDERS), layouts=LAYOUT_IDS):
+    """Condiciones posibles como (orden, disposición), p. ej. ('direct', 1)"""
+    for order in orders:
+        if order not in ORDERS:
+            raise ValueError(f"Orden de IAT desconocido: {order}")
+    return tuple((order, int(layout)) for order in orders for layout in layouts)
+
+
+def williams_square(n):
+    """Cuadrado latino balanceado de n condiciones (2n filas si n es impar)"""
+    first = [0]
+    low, high = 1, n - 1
+    while len(first) < n:
+        first.append(low)
+        low += 1
+        if len(first) < n:
+            first.append(high)
+            high -= 1
+    rows = [tuple((c + i) % n for c in first) for i in range(n)]
+    if n % 2:
+        rows += [tuple(reversed(row)) for row in rows]
+    return tuple(rows)
+
+
+def assign(id_in_session, options):
+    """Condición del participante con ese id_in_session: {'order': ..., 'layout': ...}"""
+    square = williams_square(len(options))
+    k = (id_in_session - 1) % (len(square) * len(options))
+    order, layout = options[square[k // len(options)][k % len(options)]]
+    return dict(order=order, layout=layout)
+
+
+def round_order(condition):
+    return list(ORDERS[condition['order']])
+
+
+def legacy_condition(iat_round_order):
+    """Condición de participantes creados antes del contrabalanceo (sólo tenían el orden)"""
+    order = 'inverted' if tuple(iat_round_order or ()) == INVERTED else 'direct'
+    return dict(order=order, layout=1)
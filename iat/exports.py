@@ -0,0 +1,90 @@
+"""Lectura en lote de la tabla Trial para las exportaciones
+
+oTree le pasa a custom_export todos los Player (ya con participant, session y
+subsession cargados). En vez de un `Trial.filter(player=p)` por cada jugador y
+ronda, aquí se filtran primero las rondas que se exportan y los trials se leen
+con una consulta por cada CHUNK_SIZE jugadores, sólo con las columnas que se
+necesitan (tuplas, no objetos del ORM). En memoria sólo hay un grupo de
+jugadores a la vez, así que el costo no crece con el tamaño de la sesión.
+"""
+import csv
+import gzip
+from itertools import groupby, islice
+
+from otree.database import db
+
+# rondas con trials del IAT (las de práctica no se exportan) y del dictador
+EXPORT_ROUNDS = (3, 4, 6, 7, 10, 11, 13, 14, 15, 16)
+
+TRIAL_FIELDS = (
+    'iteration',
+    'timestamp',
+    'stimulus_cls',
+    'stimulus_cat',
+    'stimulus',
+    'correct',
+    'response',
+    'is_correct',
+    'reaction_time',
+    'retries',
+)
+
+CHUNK_SIZE = 500
+PARTICIPANTS_PER_FILE = 200
+
+
+def chunks(items, size):
+    """Parte cualquier iterable en listas de a lo más `size` elementos, sin leerlo completo"""
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_players(players, rounds=EXPORT_ROUNDS):
+    return (p for p in players if p.round_number in rounds)
+
+
+def trials_by_player(Trial, players, fields=TRIAL_FIELDS, chunk_size=CHUNK_SIZE):
+    """Recorre (player, [tupla con `fields` de cada trial]) en el orden de `players`.
+    Los trials de cada jugador van en el orden en que se crearon.
+    """
+    columns = [getattr(Trial, name) for name in fields]
+    for chunk in chunks(players, chunk_size):
+        grouped = {p.id: [] for p in chunk}
+        query = db.query(Trial.player_id, *columns).filter(Trial.player_id.in_(list(grouped))).order_by(Trial.id)
+        for row in query:
+            grouped[row[0]].append(tuple(row[1:]))
+        for p in chunk:
+            yield p, grouped[p.id]
+
+
+def participant_groups(players, size=PARTICIPANTS_PER_FILE):
+    """Ordena los jugadores por participante y ronda y los reparte en grupos de `size` participantes"""
+    players = sorted(players, key=lambda p: (p.participant_id, p.round_number))
+    by_participant = (list(group) for _, group in groupby(players, key=lambda p: p.participant_id))
+    for chunk in chunks(by_participant, size):
+        yield [p for group in chunk for p in group]
+
+
+def open_csv(path):
+    """Abre un CSV para escribir; si termina en .gz se comprime al vuelo"""
+    path = str(path)
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', newline='', encoding='utf-8')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+
+def write_csv(rows, path):
+    """Escribe las filas de un generador de exportación (encabezado incluido) sin juntarlas en memoria.
+    result: número de filas sin contar el encabezado
+    """
+    n = -1
+    with open_csv(path) as f:
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow(row)
+            n += 1
+    return max(n, 0)
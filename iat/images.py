@@ -0,0 +1,114 @@
+"""Optimización de las imágenes de estímulos
+
+Reduce cada imagen referenciada en stimuli.DICT al tamaño en que se muestra,
+y genera una versión WebP y otra PNG/JPEG de respaldo, con el hash del
+contenido en el nombre:
+    static/images/build/1_A.3f9c2a41d0.webp
+    static/images/build/1_A.3f9c2a41d0.jpg
+El archivo static/images/build/manifest.json relaciona el nombre original
+con las versiones generadas; `url_for_image` lo consulta y, si una imagen
+no está en el manifest, sirve el archivo original.
+
+Uso (desde la raíz del proyecto, después de modificar imágenes o stimuli):
+    python iat/images.py
+"""
+import hashlib
+import io
+import json
+from pathlib import Path
+
+IMAGES_DIR = Path(__file__).parent / "static" / "images"
+BUILD_DIR = IMAGES_DIR / "build"
+MANIFEST = BUILD_DIR / "manifest.json"
+
+# las imágenes se muestran a 200px de ancho (ver Main.html); el doble para pantallas HiDPI
+DISPLAY_BOX = (400, 480)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+IMAGE_EXTENSIONS = (".png", ".jpg")
+
+
+def load_manifest():
+    """Return {original filename: {'webp': ..., 'fallback': ..., 'width': ..., 'height': ...}}"""
+    if not MANIFEST.exists():
+        return {}
+    with open(MANIFEST, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def referenced_images(pools):
+    """Nombres de archivo de todas las imágenes usadas como estímulos"""
+    names = set()
+    for pool in pools.values():
+        for stimulus in pool:
+            if stimulus.endswith(IMAGE_EXTENSIONS):
+                names.add(stimulus)
+    return sorted(names)
+
+
+def _write_hashed(stem, ext, data):
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    name = f"{stem}.{digest}{ext}"
+    path = BUILD_DIR / name
+    if not path.exists():
+        path.write_bytes(data)
+    return f"build/{name}"
+
+
+def optimize(filename):
+    """Genera las versiones de una imagen y devuelve su entrada del manifest"""
+    from PIL import Image, ImageOps
+
+    with Image.open(IMAGES_DIR / filename) as src:
+        img = ImageOps.exif_transpose(src)
+        img.thumbnail(DISPLAY_BOX, Image.LANCZOS)  # nunca agranda
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha else "RGB")
+
+        stem = Path(filename).stem
+        buf = io.BytesIO()
+        img.save(buf, format="WEBP", quality=WEBP_QUALITY, method=6)
+        webp = _write_hashed(stem, ".webp", buf.getvalue())
+
+        buf = io.BytesIO()
+        if has_alpha:
+            img.save(buf, format="PNG", optimize=True)
+            fallback = _write_hashed(stem, ".png", buf.getvalue())
+        else:
+            img.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            fallback = _write_hashed(stem, ".jpg", buf.getvalue())
+
+        return dict(webp=webp, fallback=fallback, width=img.width, height=img.height)
+
+
+def build(pools):
+    """Optimiza todas las imágenes referenciadas, reescribe el manifest y borra versiones viejas"""
+    BUILD_DIR.mkdir(exist_ok=True)
+    manifest = {name: optimize(name) for name in referenced_images(pools)}
+
+    keep = {MANIFEST.name}
+    for entry in manifest.values():
+        keep.add(Path(entry['webp']).name)
+        keep.add(Path(entry['fallback']).name)
+    for path in BUILD_DIR.iterdir():
+        if path.name not in keep:
+            path.unlink()
+
+    with open(MANIFEST, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+def main():
+    # ejecutado como script: el directorio iat/ está en sys.path
+    import stimuli
+
+    manifest = build(stimuli.DICT)
+    before = sum((IMAGES_DIR / name).stat().st_size for name in manifest)
+    after = sum((IMAGES_DIR / entry['webp']).stat().st_size for entry in manifest.values())
+    print(f"{len(manifest)} imágenes: {before / 1024:.0f} KB -> {after / 1024:.0f} KB (webp)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""Exportación incremental de los trials
+
+Cada consumidor (un analista, un script...) tiene su marca en watermarks.json
+dentro del directorio de salida: el último Trial.id que ya recibió. `pull`
+sólo lee los trials con id mayor (una búsqueda por rango sobre la llave
+primaria) y los escribe en un archivo parcial nuevo:
+    exports/ana.part00001.csv, exports/ana.part00002.csv, ...
+`compact` une los parciales (y el archivo compactado anterior) en exports/ana.csv,
+ordenado por trial_id, sin cargarlos completos en memoria.
+
+Un trial sólo se exporta cuando ya no va a cambiar: cuando se contestó bien.
+Los que todavía no tienen respuesta o se contestaron mal (el participante
+puede reintentar) quedan pendientes en watermarks.json y se revisan en el
+siguiente `pull`. Si pasan PENDING_TIMEOUT segundos sin cambios, se exportan
+como estén (el participante abandonó).
+
+Los ids no llegan en orden: con varios procesos escribiendo (p. ej. dos
+prodserver), un trial con id menor puede confirmarse después de que un
+`pull` ya vio uno mayor. Por eso cada `pull` vuelve a leer los últimos
+OVERLAP_IDS ids antes de la marca, y watermarks.json guarda los ids que ya se
+exportaron en esa ventana para no repetirlos.
+
+Las columnas son las de custom_export más trial_id y response_timestamp, sin
+las del dictador (están en participant.vars y sólo se leen con custom_export).
+
+Uso (desde la raíz del proyecto):
+    python iat/incremental.py pull ana -o exports/
+    python iat/incremental.py compact ana -o exports/
+Sin --db se usa DATABASE_URL (o db.sqlite3, como oTree).
+"""
+import argparse
+import csv
+import heapq
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+try:
+    from . import rescore
+except ImportError:
+    # ejecutado como script: el directorio iat/ está en sys.path
+    import rescore
+
+EXPORT_ROUNDS = (3, 4, 6, 7, 10, 11, 13, 14, 15, 16)
+PENDING_TIMEOUT = 3600.0
+# ids antes de la marca que se vuelven a leer en cada pull
+OVERLAP_IDS = 1000
+WATERMARKS = "watermarks.json"
+
+COLUMNS = (
+    "trial_id",
+    "session",
+    "participant_code",
+    "round",
+    "iat_round",
+    "primary_left",
+    "primary_right",
+    "secondary_left",
+    "secondary_right",
+    "iteration",
+    "timestamp",
+    "stimulus_class",
+    "stimulus_category",
+    "stimulus",
+    "expected",
+    "response",
+    "is_correct",
+    "reaction_time",
+    "retries",
+    "response_timestamp",
+)
+
+DELTA_SQL = """
+SELECT t.id, s.code, p.code, pl.round_number, COALESCE(pl.iat_round, pl.round_number),
+       sub.primary_left, sub.primary_right, sub.secondary_left, sub.secondary_right,
+       t.iteration, t.timestamp, t.stimulus_cls, t.stimulus_cat, t.stimulus,
+       t.correct, t.response, t.is_correct, t.reaction_time, t.retries, t.response_timestamp
+FROM iat_trial t
+JOIN iat_player pl ON pl.id = t.player_id
+JOIN iat_subsession sub ON sub.id = pl.subsession_id
+JOIN otree_participant p ON p.id = pl.participant_id
+JOIN otree_session s ON s.id = pl.session_id
+WHERE ({where}) AND pl.round_number IN ({rounds})
+ORDER BY t.id
+"""
+
+# posiciones en las filas de DELTA_SQL
+_IS_CORRECT = COLUMNS.index("is_correct")
+_TIMESTAMP = COLUMNS.index("timestamp")
+_RESPONSE_TIMESTAMP = COLUMNS.index("response_timestamp")
+
+
+def load_watermarks(out_dir):
+    path = Path(out_dir) / WATERMARKS
+    if not path.exists():
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _replace(path, write):
+    """Escribe un archivo completo en uno temporal y lo reemplaza de una vez"""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, 'w', newline='', encoding='utf-8') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def save_watermarks(out_dir, watermarks):
+    _replace(Path(out_dir) / WATERMARKS, lambda f: json.dump(watermarks, f, indent=1, sort_keys=True))
+
+
+def is_settled(row, now, timeout=PENDING_TIMEOUT):
+    """Un trial ya no cambia si se contestó bien, o si lleva `timeout` segundos sin cambios"""
+    if row[_IS_CORRECT]:
+        return True
+    last = row[_RESPONSE_TIMESTAMP] or row[_TIMESTAMP] or 0
+    return now - last >= timeout
+
+
+def pull(conn, out_dir, consumer, *, now=None, timeout=PENDING_TIMEOUT, overlap=OVERLAP_IDS, batch_size=10000):
+    """Escribe los trials nuevos de `consumer` en un archivo parcial.
+    result: (ruta del parcial o None si no hubo nada nuevo, número de trials, número de pendientes)
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    now = time.time() if now is None else now
+    watermarks = load_watermarks(out_dir)
+    state = watermarks.get(consumer, dict(last_id=0, pending=[], parts=0))
+    # se vuelven a leer los ids mayores que `floor`; `recent` son los que ya se exportaron entre ellos
+    # (una marca guardada antes de la ventana empieza sin ella)
+    floor = state.get('floor', state['last_id'])
+    recent = set(state.get('recent', ()))
+
+    where = f"t.id > {int(floor)}"
+    if state['pending']:
+        where += f" OR t.id IN ({', '.join(str(int(i)) for i in state['pending'])})"
+    sql = DELTA_SQL.format(where=where, rounds=", ".join(str(r) for r in EXPORT_ROUNDS))
+
+    part = out_dir / f"{consumer}.part{state['parts'] + 1:05d}.csv"
+    tmp = part.with_name(part.name + ".tmp")
+    last_id = state['last_id']
+    pending = []
+    n = 0
+    cur = conn.cursor()
+    cur.execute(sql)
+    with open(tmp, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if row[0] in recent:
+                    continue
+                last_id = max(last_id, row[0])
+                if is_settled(row, now, timeout):
+                    writer.writerow(row)
+                    recent.add(row[0])
+                    n += 1
+                else:
+                    pending.append(row[0])
+
+    floor = max(floor, last_id - overlap)
+    state = dict(
+        last_id=last_id,
+        floor=floor,
+        recent=sorted(i for i in recent if i > floor),
+        pending=pending,
+        parts=state['parts'],
+    )
+    if n:
+        os.replace(tmp, part)
+        state['parts'] += 1
+    else:
+        tmp.unlink()
+        part = None
+    watermarks[consumer] = state
+    save_watermarks(out_dir, watermarks)
+    return part, n, len(pending)
+
+
+def _rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if row:
+                yield int(row[0]), row
+
+
+def compact(out_dir, consumer):
+    """Une los parciales de `consumer` con su archivo compactado, en orden de trial_id.
+    result: (ruta del compactado, número de trials)
+    """
+    out_dir = Path(out_dir)
+    target = out_dir / f"{consumer}.csv"
+    parts = sorted(out_dir.glob(f"{consumer}.part*.csv"))
+    sources = ([target] if target.exists() else []) + parts
+    n = 0
+
+    def write(f):
+        nonlocal n
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        previous = None
+        # cada archivo ya está ordenado por trial_id; un id repetido (p. ej. si se
+        # interrumpió un pull después de escribir su parcial) se escribe una sola vez
+        for trial_id, row in heapq.merge(*map(_rows, sources), key=lambda item: item[0]):
+            if trial_id != previous:
+                writer.writerow(row)
+                n += 1
+                previous = trial_id
+
+    _replace(target, write)
+    for part in parts:
+        part.unlink()
+    return target, n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exportación incremental de los trials del IAT")
+    parser.add_argument("command", choices=("pull", "compact"))
+    parser.add_argument("consumer", help="nombre de quien recibe los datos (cada uno lleva su propia marca)")
+    parser.add_argument("-o", "--output", default="exports", help="directorio de salida (por defecto exports/)")
+    parser.add_argument("--db", help="URL de la base de datos (por defecto DATABASE_URL o sqlite:///db.sqlite3)")
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        target, n = compact(args.output, args.consumer)
+        print(f"{n} trials -> {target}", file=sys.stderr)
+        return
+
+    url = args.db or os.environ.get("DATABASE_URL") or "sqlite:///db.sqlite3"
+    conn = rescore.connect(url)
+    try:
+        part, n, n_pending = pull(conn, args.output, args.consumer)
+    finally:
+        conn.close()
+    print(f"{n} trials nuevos -> {part or '(nada)'}; {n_pending} pendientes", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
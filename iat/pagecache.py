@@ -0,0 +1,59 @@
+"""Caché de los contextos de página derivados del bloque
+
+Lo que RoundN e Intro calculan a partir del bloque (bloque compilado, miniaturas,
+etiquetas, imágenes para precargar) es igual para todos los participantes con la
+misma configuración de sesión, versión de estímulos, disposición de teclas y
+bloque. Se guarda aquí con esa llave, así que recargar una página (p. ej. todos
+a la vez después de un corte de red) no vuelve a calcular nada.
+
+Es una LRU acotada por proceso: con MAX_ENTRIES se descartan las entradas
+usadas hace más tiempo. `invalidate` la vacía (se llama cuando se recargan los
+estímulos); las entradas se reconstruyen cuando se vuelven a pedir.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 512
+
+
+def fingerprint(value):
+    """Hash corto de un valor serializable (p. ej. session.params)"""
+    data = json.dumps(value, sort_keys=True, default=str, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+class ContextCache:
+    def __init__(self, maxsize=MAX_ENTRIES):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        # la recarga de estímulos invalida desde otro hilo
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, build):
+        """El contexto guardado para `key`, o el resultado de build() (que se guarda)"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._entries.clear()
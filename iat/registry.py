@@ -0,0 +1,244 @@
+"""Registro de estímulos
+
+Se construye una sola vez al arrancar la app a partir de stimuli.DICT:
+ - cada imagen referenciada tiene que existir en static/images y Pillow tiene
+   que poder leerla; se guardan sus dimensiones y su tamaño en bytes
+ - para cada estímulo se precalcula si es imagen y la url con que se sirve
+   (la versión optimizada del manifest de images.py, si existe)
+Si falta alguna imagen o está dañada, `build` lanza StimulusError con la lista
+completa y la app no arranca, en vez de mostrar un trial en blanco.
+
+Después, las páginas y el live method sólo buscan en diccionarios:
+    registry.get(stimulus).url, registry.thumbnail(category), registry.image_sources(category)
+Cada estímulo lleva las categorías en que aparece (`categories`; puede ser más de
+una, p. ej. las mismas palabras en 'Bueno' y 'bueno peso').
+Las imágenes llevan también `fallback_url` (PNG/JPEG) para los navegadores sin WebP.
+
+`Library` guarda la versión actual y la recarga cuando cambia stimuli.csv
+(fecha de modificación o tamaño): un hilo revisa el archivo cada RELOAD_SECONDS,
+lo vuelve a leer y validar fuera de las peticiones y cambia la versión actual
+con una sola asignación. Si el archivo nuevo tiene problemas, se registra el
+error y se sigue con la versión anterior; se vuelve a intentar en cada revisión
+(p. ej. hasta que se suban las imágenes nuevas), aunque el archivo no cambie.
+
+Cada versión se identifica por un hash de su contenido. Las sesiones guardan
+la versión y sus estímulos al crearse (ver `pinned`), así que siguen con los
+mismos estímulos aunque el archivo cambie, en cualquier proceso.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+
+try:
+    from . import images
+except ImportError:
+    # ejecutado como script: el directorio iat/ está en sys.path
+    import images
+
+
+logger = logging.getLogger(__name__)
+
+RELOAD_SECONDS = 5.0
+
+
+class StimulusError(ValueError):
+    pass
+
+
+class Stimulus(NamedTuple):
+    text: str
+    is_image: bool
+    url: str  # para los textos, el texto mismo
+    fallback_url: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    size: Optional[int] = None
+    categories: Tuple[str, ...] = ()  # categorías que lo incluyen, en el orden de los pools
+
+
+def default_url(filename, fallback=False):
+    return f"/static/images/{filename}"
+
+
+def inspect_image(path):
+    """(ancho, alto, bytes) de una imagen; lanza StimulusError si no existe o no se puede leer"""
+    from PIL import Image
+
+    if not path.is_file():
+        raise StimulusError(f"no existe {path.name}")
+    size = path.stat().st_size
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            img.verify()
+    except Exception as exc:
+        raise StimulusError(f"{path.name} no es una imagen válida ({exc})")
+    return width, height, size
+
+
+class Registry:
+    """Índices de sólo lectura sobre los estímulos"""
+
+    def __init__(self, pools, index, url_for):
+        self.pools = pools
+        self.version = version_of(pools)
+        self.index = index
+        self.url_for = url_for
+        self.thumbnails = {}
+        self.images = {}
+        for cat, pool in pools.items():
+            entries = [index[s] for s in pool]
+            if entries and entries[0].is_image:
+                self.thumbnails[cat] = entries[0]
+            self.images[cat] = tuple(e for e in entries if e.is_image)
+
+    def get(self, stimulus):
+        """Datos de un estímulo. Los que no están registrados (p. ej. trials de una
+        versión anterior de los estímulos) se resuelven sin validar.
+        """
+        entry = self.index.get(stimulus)
+        if entry is None:
+            entry = _entry(str(stimulus), self.url_for)
+        return entry
+
+    def thumbnail(self, category):
+        """La primera imagen de la categoría (para las esquinas), o None"""
+        return self.thumbnails.get(category)
+
+    def image_urls(self, category):
+        return tuple(e.url for e in self.images.get(category, ()))
+
+    def image_sources(self, category):
+        """((url, fallback_url), ...) de las imágenes de la categoría"""
+        return tuple((e.url, e.fallback_url) for e in self.images.get(category, ()))
+
+
+def _entry(stimulus, url_for, width=None, height=None, size=None):
+    if stimulus.endswith(images.IMAGE_EXTENSIONS):
+        return Stimulus(stimulus, True, url_for(stimulus), url_for(stimulus, fallback=True), width, height, size)
+    return Stimulus(stimulus, False, stimulus, stimulus)
+
+
+def version_of(pools):
+    """Identificador de un conjunto de estímulos: el mismo contenido da la misma versión en cualquier proceso"""
+    data = json.dumps(pools, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def build(pools, url_for=default_url, images_dir=images.IMAGES_DIR, strict=True):
+    """Valida todos los estímulos de `pools` ({categoría: [estímulos]}) y construye el registro.
+    Con strict=False las imágenes con problemas se registran sin dimensiones en vez de fallar.
+    """
+    index = {}
+    categories = {}
+    problems = []
+    for cat, pool in pools.items():
+        for stimulus in pool:
+            if cat not in categories.setdefault(stimulus, []):
+                categories[stimulus].append(cat)
+            if stimulus in index:
+                continue
+            if stimulus.endswith(images.IMAGE_EXTENSIONS):
+                try:
+                    width, height, size = inspect_image(images_dir / stimulus)
+                except StimulusError as exc:
+                    problems.append(f"{cat}: {exc}")
+                    if not strict:
+                        index[stimulus] = _entry(stimulus, url_for)
+                    continue
+                index[stimulus] = _entry(stimulus, url_for, width, height, size)
+            else:
+                index[stimulus] = _entry(stimulus, url_for)
+    if problems and strict:
+        raise StimulusError("Estímulos con problemas:\n" + "\n".join(problems))
+    index = {stimulus: entry._replace(categories=tuple(categories[stimulus])) for stimulus, entry in index.items()}
+    return Registry(pools, index, url_for)
+
+
+class Library:
+    """La versión actual del registro (recargable) y las que fijaron las sesiones"""
+
+    def __init__(self, load, path, url_for=default_url, images_dir=images.IMAGES_DIR):
+        self.load = load
+        self.path = path
+        self.url_for = url_for
+        self.images_dir = images_dir
+        self.versions = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stamp = self._stat()
+        self._failed = None  # marca del último archivo que no se pudo cargar (para no repetir el error)
+        self.current = self._register(build(load(), url_for, images_dir))
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _register(self, registry):
+        with self._lock:
+            return self.versions.setdefault(registry.version, registry)
+
+    def check(self):
+        """Vuelve a leer el archivo si cambió.
+        result: True si hay una versión actual nueva
+        """
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return False
+        try:
+            registry = build(self.load(), self.url_for, self.images_dir)
+        except (StimulusError, OSError, ValueError, KeyError) as exc:
+            # la marca no se guarda: se reintenta en la siguiente revisión
+            if stamp != self._failed:
+                logger.error("No se recargaron los estímulos de %s: %s", self.path, exc)
+                self._failed = stamp
+            return False
+        self._stamp = stamp
+        self._failed = None
+        if registry.version == self.current.version:
+            return False
+        # una sola asignación: cada lectura ve la versión anterior o la nueva completa
+        self.current = self._register(registry)
+        logger.info("Estímulos recargados de %s (versión %s)", self.path, registry.version)
+        for listener in self.listeners:
+            listener(registry)
+        return True
+
+    def subscribe(self, listener):
+        """listener(registro) se llama después de cada recarga (p. ej. para invalidar cachés)"""
+        self.listeners.append(listener)
+
+    def watch(self, interval=RELOAD_SECONDS):
+        """Revisa el archivo cada `interval` segundos en un hilo aparte"""
+        if self._thread is not None or not interval:
+            return
+        self._thread = threading.Thread(target=self._watch, args=(interval,), name="stimuli-reload", daemon=True)
+        self._thread.start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Error revisando %s", self.path)
+
+    def pinned(self, version, pools):
+        """Registro de la versión con que se creó una sesión. Si este proceso no la tiene
+        (p. ej. arrancó después del cambio), se reconstruye con los estímulos guardados en la sesión.
+        """
+        registry = self.versions.get(version)
+        if registry is None:
+            registry = self._register(build(pools, self.url_for, self.images_dir, strict=False))
+        return registry
+
+    def get(self, stimulus):
+        return self.current.get(stimulus)
@@ -0,0 +1,264 @@
+"""Recalcula los d-scores fuera de línea
+
+Lee la salida de custom_export (CSV) o directamente la base de datos de oTree,
+agrupa los trials por participante y calcula los d-scores en varios procesos
+con las mismas funciones que usa la app (stats.dscore con IAT1_PAIRS/IAT2_PAIRS,
+como dscore1/dscore2, stats.dscore_variants para D1-D6 y stiat.compute_stiat_d).
+Las reglas de recorte se pueden cambiar desde la línea de comandos. El resultado
+es un CSV con una fila por participante.
+
+dscore1/dscore2 son los de las rondas 3-7 y 10-14 de BLOCKS, como los calcula
+IATAssessmentPage: cada trial se agrupa por iat_round (la ronda de BLOCKS que se
+mostró), no por la ronda de la página, que depende del orden del participante.
+Las exportaciones y jugadores sin iat_round (anteriores al contrabalanceo, todos
+con el orden directo) usan la ronda de la página.
+
+Uso (desde la raíz del proyecto):
+    python iat/rescore.py export.csv -o dscores.csv
+    python iat/rescore.py --db sqlite:///db.sqlite3 -o dscores.csv
+    python iat/rescore.py export.csv --max-rt 5 --min-rt 0.4 -o dscores_5s.csv
+
+Sin --db ni archivo se usa DATABASE_URL (o db.sqlite3, como oTree).
+El ST-IAT sólo se puede recalcular desde la base de datos (el CSV no trae stiat_raw).
+"""
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+try:
+    from . import stats, stiat
+except ImportError:
+    # ejecutado como script: el directorio iat/ está en sys.path
+    import stats
+    import stiat
+
+IAT_ROUNDS = (3, 4, 6, 7, 10, 11, 13, 14)
+
+# exportaciones anteriores: las filas no traían primary_left... ni el orden assigned/kept del encabezado
+LEGACY_COLUMNS = (
+    "session",
+    "participant_code",
+    "round",
+    "iteration",
+    "timestamp",
+    "stimulus_class",
+    "stimulus_category",
+    "stimulus",
+    "expected",
+    "response",
+    "is_correct",
+    "reaction_time",
+    "dictator_category",
+    "dictator_offer",
+    "kept",
+    "assigned",
+    "payoff",
+)
+
+OUTPUT_COLUMNS = (
+    "session",
+    "participant_code",
+    "n_trials",
+    "dscore1",
+    "dscore2",
+) + tuple(f"{score}_{name}" for score in ("dscore1", "dscore2") for name in stats.VARIANTS) + (
+    "stiat_d",
+    "stiat_class",
+    "stiat_n_total",
+    "stiat_n_fast_300ms",
+    "stiat_excluded_fast_prop",
+)
+
+
+def _new_participant():
+    return dict(blocks={}, stiat_raw=None)
+
+
+def read_export(path):
+    """Agrupa los trials de un CSV de custom_export.
+    result: {(session, participant_code): {'blocks': {ronda de BLOCKS: [(rt, es_error)]}, 'stiat_raw': None}}
+    Las exportaciones sin la columna retries se leen como si no hubiera errores.
+    """
+    participants = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return participants
+        current = {name: i for i, name in enumerate(header)}
+        legacy = {name: i for i, name in enumerate(LEGACY_COLUMNS)}
+        for row in reader:
+            if not row:
+                continue
+            cols = legacy if len(row) == len(LEGACY_COLUMNS) != len(header) else current
+            try:
+                rnd = int(row[cols["round"]])
+                iat_round = row[cols["iat_round"]] if "iat_round" in cols else ""
+                if iat_round not in ("", "None"):
+                    rnd = int(iat_round)
+                rt = row[cols["reaction_time"]]
+                if rnd not in IAT_ROUNDS or rt in ("", "None"):
+                    continue
+                rt = float(rt)
+                retries = row[cols["retries"]] if "retries" in cols else ""
+                error = retries not in ("", "None") and int(retries) > 0
+            except (IndexError, ValueError):
+                # celda dañada: se salta la fila, no toda la exportación
+                continue
+            key = (row[cols["session"]], row[cols["participant_code"]])
+            entry = participants.get(key)
+            if entry is None:
+                entry = participants[key] = _new_participant()
+            entry['blocks'].setdefault(rnd, []).append((rt, error))
+    return participants
+
+
+TRIALS_SQL = """
+SELECT s.code, p.code, COALESCE(pl.iat_round, pl.round_number), t.reaction_time, t.retries
+FROM iat_trial t
+JOIN iat_player pl ON pl.id = t.player_id
+JOIN otree_participant p ON p.id = pl.participant_id
+JOIN otree_session s ON s.id = pl.session_id
+WHERE t.reaction_time IS NOT NULL AND pl.round_number IN ({rounds})
+ORDER BY p.id, pl.round_number, t.iteration
+"""
+
+STIAT_SQL = """
+SELECT s.code, p.code, pl.stiat_raw
+FROM iat_player pl
+JOIN otree_participant p ON p.id = pl.participant_id
+JOIN otree_session s ON s.id = pl.session_id
+WHERE pl.stiat_raw IS NOT NULL AND pl.stiat_raw <> ''
+"""
+
+
+def connect(url):
+    """Conexión DB-API a partir de una URL como la de DATABASE_URL"""
+    if url.startswith(("postgres://", "postgresql://")):
+        import psycopg2
+
+        return psycopg2.connect(url)
+    if url.startswith("sqlite:///"):
+        import sqlite3
+
+        return sqlite3.connect(url[len("sqlite:///"):])
+    raise ValueError(f"Base de datos no soportada: {url}")
+
+
+def read_db(url, batch_size=10000):
+    """Agrupa los trials leyendo directamente las tablas de oTree (mismo resultado que read_export)"""
+    participants = {}
+    conn = connect(url)
+    try:
+        cur = conn.cursor()
+        cur.execute(TRIALS_SQL.format(rounds=", ".join(str(r) for r in IAT_ROUNDS)))
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for session_code, participant_code, rnd, rt, retries in rows:
+                key = (session_code, participant_code)
+                entry = participants.get(key)
+                if entry is None:
+                    entry = participants[key] = _new_participant()
+                entry['blocks'].setdefault(rnd, []).append((float(rt), bool(retries)))
+
+        cur.execute(STIAT_SQL)
+        for session_code, participant_code, raw in cur.fetchall():
+            key = (session_code, participant_code)
+            entry = participants.get(key)
+            if entry is None:
+                entry = participants[key] = _new_participant()
+            entry['stiat_raw'] = raw
+    finally:
+        conn.close()
+    return participants
+
+
+def score_participant(item, *, rules, stiat_map):
+    """Una fila del resultado. Se ejecuta en los procesos del pool, así que sólo recibe datos simples."""
+    (session_code, participant_code), data = item
+    blocks = data['blocks']
+    rts = {rnd: [rt for rt, _ in trials] for rnd, trials in blocks.items()}
+    row = dict(
+        session=session_code,
+        participant_code=participant_code,
+        n_trials=sum(len(v) for v in blocks.values()),
+        dscore1=stats.dscore(rts, stats.IAT1_PAIRS, **rules),
+        dscore2=stats.dscore(rts, stats.IAT2_PAIRS, **rules),
+    )
+    for score, pairs in (("dscore1", stats.IAT1_PAIRS), ("dscore2", stats.IAT2_PAIRS)):
+        for name, d in stats.dscore_variants(blocks, pairs, **rules).items():
+            row[f"{score}_{name}"] = d
+    if data['stiat_raw']:
+        trials = stiat.StiatLog(data['stiat_raw']).trials
+        d, meta = stiat.compute_stiat_d(
+            trials,
+            stiat_map["compatible"],
+            stiat_map["incompatible"],
+            min_rt_s=rules['min_rt'],
+            max_rt_s=rules['max_rt'],
+            max_fast_prop=rules['max_fast_prop'],
+        )
+        row.update(
+            stiat_d=d,
+            stiat_class=stiat.classify_stiat_black(d),
+            stiat_n_total=meta["n_total"],
+            stiat_n_fast_300ms=meta["n_fast_300ms"],
+            stiat_excluded_fast_prop=meta["excluded_fast_prop"],
+        )
+    return row
+
+
+def rescore(participants, *, rules, stiat_map=stiat.DEFAULT_STIAT_BLOCK_MAP, workers=None, chunksize=256):
+    """Calcula las filas de todos los participantes en paralelo, en el orden de entrada"""
+    work = partial(score_participant, rules=rules, stiat_map=stiat_map)
+    if workers == 1:
+        return list(map(work, participants.items()))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(work, participants.items(), chunksize=chunksize))
+
+
+def write_results(rows, out):
+    writer = csv.DictWriter(out, fieldnames=OUTPUT_COLUMNS, restval="")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recalcula los d-scores del IAT fuera de línea")
+    parser.add_argument("export", nargs="?", help="CSV de custom_export (si no se da, se lee la base de datos)")
+    parser.add_argument("--db", help="URL de la base de datos (por defecto DATABASE_URL o sqlite:///db.sqlite3)")
+    parser.add_argument("-o", "--output", help="archivo de salida (por defecto, la salida estándar)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="número de procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--max-rt", type=float, default=stats.MAX_RT, help="se descartan los trials de este tiempo o más (s)")
+    parser.add_argument("--min-rt", type=float, default=stats.MIN_RT, help="trials más rápidos que esto cuentan como rápidos (s)")
+    parser.add_argument("--max-fast-prop", type=float, default=stats.MAX_FAST_PROP, help="proporción máxima de trials rápidos")
+    parser.add_argument("--stiat-compat", type=int, nargs="+", default=stiat.DEFAULT_STIAT_BLOCK_MAP["compatible"])
+    parser.add_argument("--stiat-incompat", type=int, nargs="+", default=stiat.DEFAULT_STIAT_BLOCK_MAP["incompatible"])
+    args = parser.parse_args(argv)
+
+    if args.export and not args.db:
+        participants = read_export(args.export)
+    else:
+        url = args.db or os.environ.get("DATABASE_URL") or "sqlite:///db.sqlite3"
+        participants = read_db(url)
+
+    rules = dict(max_rt=args.max_rt, min_rt=args.min_rt, max_fast_prop=args.max_fast_prop)
+    stiat_map = dict(compatible=args.stiat_compat, incompatible=args.stiat_incompat)
+    rows = rescore(participants, rules=rules, stiat_map=stiat_map, workers=args.workers)
+
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as out:
+            write_results(rows, out)
+    else:
+        write_results(rows, sys.stdout)
+    print(f"{len(rows)} participantes", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Secuencias de trials balanceadas y reproducibles
+
+Para cada bloque se genera de una vez la lista completa de trials a partir
+de la semilla del participante:
+ - izquierda/derecha aparecen el mismo número de veces (±1)
+ - dentro de cada lado, primary/secondary también se reparten por igual
+ - los estímulos de cada categoría se sacan sin reemplazo; cuando se acaban
+   se vuelve a barajar la categoría completa
+
+La secuencia se guarda como dos arreglos de índices (bytes) sobre los
+candidatos del bloque compilado (ver blocks.compile_block), así que servir
+un trial es sólo buscar una posición, y con la misma semilla, ronda y
+configuración la secuencia se reproduce exactamente.
+"""
+import random
+
+
+def make_seed():
+    return random.getrandbits(32)
+
+
+def _spread(rng, options, n):
+    """n elementos tomados de `options` lo más parejo posible, en orden aleatorio"""
+    options = list(options)
+    rng.shuffle(options)  # quién recibe el sobrante es aleatorio
+    items = [options[i % len(options)] for i in range(n)]
+    rng.shuffle(items)
+    return items
+
+
+def generate(block, n, seed, round_number):
+    """Genera n trials para un bloque compilado.
+    result: {'seed': seed, 'cand': bytes, 'stim': bytes}
+      cand[i] = índice en block['candidates'], stim[i] = índice del estímulo en ese candidato
+    """
+    rng = random.Random(f"{seed}:{round_number}")
+    candidates = block['candidates']
+    by_side = {}
+    for idx, (side, cls, cat, pool) in enumerate(candidates):
+        if len(pool) > 256:
+            raise ValueError(f"Demasiados estímulos en la categoría {cat}")
+        by_side.setdefault(side, []).append(idx)
+
+    sides = _spread(rng, sorted(by_side), n)
+    per_side = {
+        side: iter(_spread(rng, by_side[side], sides.count(side))) for side in by_side
+    }
+    cand = [next(per_side[side]) for side in sides]
+
+    decks = {}
+    stim = []
+    for idx in cand:
+        deck = decks.get(idx)
+        if not deck:
+            deck = list(range(len(candidates[idx][3])))
+            rng.shuffle(deck)
+            decks[idx] = deck
+        stim.append(deck.pop())
+
+    return dict(seed=seed, cand=bytes(cand), stim=bytes(stim))
+
+
+def trial_at(block, plan, i):
+    """El trial en la posición i (desde 0) como (cls, cat, stimulus, side)"""
+    side, cls, cat, pool = block['candidates'][plan['cand'][i]]
+    return cls, cat, pool[plan['stim'][i]], side
+
+
+def replay(block, n, seed, round_number):
+    """Reconstruye la secuencia exacta de un participante (para depurar fuera de línea)"""
+    plan = generate(block, n, seed, round_number)
+    return [trial_at(block, plan, i) for i in range(n)]
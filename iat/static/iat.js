@@ -2,17 +2,23 @@ class Model {
     /** hold all current game state */
     constructor() {
         this.progress = {};
+        this.queue = [];
+        this.iteration = null;
         this.stimulus = null;
         this.stimulus_cls = null;
         this.stimulus_cat = null;
+        this.stimulus_fallback = null;
         this.answer = null;
         this.is_correct = null;
+        this.sources = {};  // url -> fallback, for images that only decoded in their fallback version
     }
 
     resetStimulus() {
+        this.iteration = null;
         this.stimulus = null;
         this.stimulus_cls = null;
         this.stimulus_cat = null;
+        this.stimulus_fallback = null;
     }
 
     resetAnswer() {
@@ -35,6 +41,14 @@ class View {
         this.$answer = document.getElementById("answer-inp");
         this.$starthelp = document.getElementById("start-help");
         this.$warn = document.getElementById("warning-txt");
+
+        // last resort for images that weren't preloaded: switch to the PNG/JPEG version
+        this.$stimulus_img.addEventListener('error', () => {
+            let fallback = this.model.stimulus_fallback;
+            if (fallback && !this.$stimulus_img.src.endsWith(fallback)) {
+                this.$stimulus_img.src = fallback;
+            }
+        });
     }
 
     renderStimulus() {
@@ -49,7 +63,8 @@ class View {
             this.$stimulus_txt.classList.toggle("hidden", is_image);
             this.$stimulus_img.classList.toggle("hidden", !is_image);
             if (is_image) {
-                this.$stimulus_img.src = this.model.stimulus;
+                // the version that decoded during preload (WebP, or its fallback)
+                this.$stimulus_img.src = this.model.sources[this.model.stimulus] || this.model.stimulus;
                 this.$stimulus_img.classList.add(this.model.stimulus_cls);
             } else {
                 this.$stimulus_txt.textContent = this.model.stimulus;
@@ -88,6 +103,10 @@ class View {
         }
     }
 
+    showLoading(loading) {
+        this.$starthelp.classList.toggle("loading", loading);
+    }
+
     showStartInstruction() {
         this.$starthelp.classList.remove("hidden");
     }
@@ -113,25 +132,56 @@ class Controller {
         this.view = view;
 
         this.input_disabled = false;
+        this.prefetch = js_vars.params.prefetch_block;
         this.starting = true;
         this.ts_question = 0;
         this.ts_answer = 0;
+        this.images = [];  // keeping decoded images referenced
 
         window.liveRecv = (message) => this.recvMessage(message);
         document.querySelector('body').addEventListener('keydown', (e) => this.onKeypress(e));
         document.querySelector('.stimulus-container').addEventListener('touchstart', (e) => this.onTouchMiddle(e));
         document.querySelector('.corners-container').addEventListener('touchstart', (e) => this.onTouchCorner(e));
 
+        this.preloading = this.preload(js_vars.preload);
         liveSend({type: 'load'});
     }
 
+    preload(sources) {
+        /** fetch and decode all images of the block, so that first exposures don't include loading time
+         *  sources are [url, fallback] pairs; if url can't be decoded (e.g. no WebP support) the fallback is used */
+        let started = performance.now(), failed = 0;
+        this.view.showLoading(true);
+        let loading = sources.map(([url, fallback]) => {
+            let img = new Image();
+            img.src = url;
+            this.images.push(img);
+            return img.decode().catch(() => {
+                if (!fallback || fallback === url) throw new Error(`can't decode ${url}`);
+                img.src = fallback;
+                return img.decode().then(() => { this.model.sources[url] = fallback; });
+            }).catch(() => { failed += 1; });
+        });
+        return Promise.all(loading).then(() => {
+            this.view.showLoading(false);
+            liveSend({type: 'preloaded', count: sources.length, failed: failed, ms: performance.now() - started});
+        });
+    }
+
     recvMessage(message) {
         // console.debug("received:", message);
         switch(message.type) {
             case 'status':
                 if (message.trial) {  // restoring existing state
-                    this.recvTrial(message.trial);
+                    this.starting = false;
                     this.view.hideStartInstruction();
+                    this.preloading.then(() => {
+                        if (this.prefetch) {
+                            this.reqBlock();
+                        } else {
+                            this.recvTrial(message.trial);
+                        }
+                    });
                 } else if (message.progress.iteration === 0) {   // start of the game
                     this.starting = true;
                     this.view.showStartInstruction();
@@ -144,9 +194,19 @@ class Controller {
                 this.recvTrial(message.trial);
                 break;
 
+            case 'block':
+                this.recvBlock(message.trials);
+                break;
+
             case 'feedback':
                 this.recvFeedback(message);
                 break;
+
+            case 'error':
+                if (message.resync) {  // server lost track of prefetched block
+                    this.reqBlock();
+                }
+                break;
         }
 
         if ('progress' in message) { // can be added to message of any type
@@ -158,9 +218,11 @@ class Controller {
         this.ts_question = performance.now();
         this.ts_answer = 0;
 
+        this.model.iteration = data.iteration;
         this.model.stimulus = data.stimulus;
         this.model.stimulus_cls = data.cls;
         this.model.stimulus_cat = data.cat;
+        this.model.stimulus_fallback = data.fallback || null;
         this.model.resetAnswer();
 
         this.view.renderStimulus();
@@ -168,12 +230,25 @@ class Controller {
 
     }
 
+    recvBlock(trials) {
+        this.model.queue = trials;
+        this.showNext();
+    }
+
     recvFeedback(message) {
         this.model.is_correct = message.is_correct;
         this.view.renderAnswer();
 
-        if (message.is_correct) {
-            // auto advance to next after correct answer
+        if (!message.is_correct) return;
+
+        // auto advance to next after correct answer
+        if (message.trial) {
+            // next trial came along with feedback, it's valid from server's not_before
+            let delay = (message.not_before - message.server_time) * 1000;
+            window.setTimeout(() => this.showTrial(message.trial), delay);
+        } else if (this.prefetch) {
+            window.setTimeout(() => this.showNext(), js_vars.params.trial_delay * 1000);
+        } else {
             window.setTimeout(() => this.reqNext(), js_vars.params.trial_delay * 1000);
         }
     }
@@ -227,8 +302,15 @@ class Controller {
 
     startGame() {
         this.starting = false;
-        this.view.hideStartInstruction();
-        this.reqNext();
+        // the prompt stays until all images are ready
+        this.preloading.then(() => {
+            this.view.hideStartInstruction();
+            if (this.prefetch) {
+                this.reqBlock();
+            } else {
+                this.reqNext();
+            }
+        });
     }
 
     disableInput() {
@@ -251,7 +333,36 @@ class Controller {
 
     submitAnswer() {
         this.ts_answer = performance.now();
-        liveSend({type: 'answer', answer: this.model.answer, reaction_time: (this.ts_answer - this.ts_question)/1000});
+        liveSend({
+            type: this.prefetch ? 'answer' : 'answer_next',
+            iteration: this.model.iteration,
+            answer: this.model.answer,
+            reaction_time: (this.ts_answer - this.ts_question)/1000
+        });
+    }
+
+    showNext() {
+        /** show next trial from prefetched block, or ask server when it's exhausted */
+        if (this.model.queue.length === 0) {
+            this.reqNext();
+            return;
+        }
+        this.showTrial(this.model.queue.shift());
+    }
+
+    showTrial(data) {
+        this.model.resetStimulus();
+        this.model.resetAnswer();
+        this.recvTrial(data);
+    }
+
+    reqBlock() {
+        this.model.resetStimulus();
+        this.model.resetAnswer();
+        this.view.renderStimulus();
+        this.view.renderAnswer();
+
+        liveSend({type: 'block'});
     }
 
     reqNext() {
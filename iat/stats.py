@@ -1,12 +1,30 @@
 """Calculating d-score in pure python
 
-All data are list of float values
+All data are list of float values (reaction times in seconds), grouped by block (round).
 
 Implementation of d-score according to this snapshot:
 http://faculty.washington.edu/agg/iatmaterials/Summary%20of%20Improved%20Scoring%20Algorithm.pdf
+
+Cada bloque se resume una sola vez en (n, media, M2) y las desviaciones
+agrupadas se obtienen combinando esos resúmenes, sin volver a recorrer ni
+concatenar listas y sin `statistics.stdev` (que usa fracciones exactas y es lento).
 """
 
+import itertools
 import math
+import operator
+import random
+
+# reglas de recorte
+MAX_RT = 10.0  # se descartan los trials de 10 s o más
+MIN_RT = 0.300  # trials "demasiado rápidos"
+MAX_FAST_PROP = 0.1  # si más del 10% son rápidos, no hay d-score
+
+# pares de bloques (a, b): D = (media(b) - media(a)) / sd(a + b), promediado entre pares
+IAT1_PAIRS = ((3, 6), (4, 7))
+# así lo ha calculado siempre dscore2 (10 con 11, 13 con 14)
+IAT2_PAIRS = ((10, 11), (13, 14))
+
 
 def mean(data: list):
     """Calcula la media de una lista de valores."""
@@ -14,84 +32,448 @@ def mean(data: list):
         return 0
     return sum(data) / len(data)
 
+
 def std(data: list):
     """Calcula la desviación estándar de una lista de valores."""
-    if len(data) < 2:  # Manejo para listas con menos de dos elementos
+    n, _, m2 = moments(data)
+    if n < 2:  # Manejo para listas con menos de dos elementos
         return 0
-    cnt = len(data)
-    m = sum(data) / cnt
-    sqs = sum((v - m) ** 2 for v in data)
-    ssq = sqs / (cnt - 1)
-    return math.sqrt(ssq)
+    return math.sqrt(m2 / (n - 1))
 
 
-def dscore1(data3: list, data4: list, data6: list, data7: list):
-    # Filtrar valores demasiado largos
-    def not_long(value):
-        return value < 10.0
-
-    data3 = list(filter(not_long, data3))
-    data4 = list(filter(not_long, data4))
-    data6 = list(filter(not_long, data6))
-    data7 = list(filter(not_long, data7))
-
-    # Filtrar valores demasiado cortos
-    def too_short(value):
-        return value < 0.300
-
-    total_data = data3 + data4 + data6 + data7
-    short_data = list(filter(too_short, total_data))
-    if len(short_data) / len(total_data) > 0.1:
+def moments(data):
+    """Resumen (n, media, M2) de una lista de valores, M2 = suma de cuadrados de las desviaciones"""
+    n = len(data)
+    if n == 0:
+        return 0, 0.0, 0.0
+    m = sum(data) / n
+    m2 = sum((v - m) * (v - m) for v in data)
+    return n, m, m2
+
+
+def combine(a, b):
+    """Resumen de la unión de dos conjuntos a partir de sus resúmenes (Chan et al.)"""
+    na, ma, m2a = a
+    nb, mb, m2b = b
+    n = na + nb
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mb - ma
+    return n, ma + delta * nb / n, m2a + m2b + delta * delta * na * nb / n
+
+
+def dscore_from_moments(summary, pairs, n_fast, n_total, max_fast_prop=MAX_FAST_PROP):
+    """D-score a partir de los resúmenes ya filtrados de cada bloque.
+    summary: {bloque: (n, media, M2)}
+    n_fast, n_total: trials rápidos y totales (ya sin los largos) de todos los bloques de `pairs`
+    """
+    if n_total == 0 or n_fast / n_total > max_fast_prop:
         return None
 
-    # Calcular el d-score
-    combined_3_6 = data3 + data6
-    combined_4_7 = data4 + data7
+    scores = []
+    for a, b in pairs:
+        sa = summary.get(a, (0, 0.0, 0.0))
+        sb = summary.get(b, (0, 0.0, 0.0))
+        n, _, m2 = combine(sa, sb)
+        if n < 2:
+            # la desviación estándar requiere al menos dos datos
+            return None
+        sd = math.sqrt(m2 / (n - 1))
+        diff = sb[1] - sa[1] if sa[0] > 0 and sb[0] > 0 else 0
+        scores.append(diff / sd if sd > 0 else 0)
+    return sum(scores) / len(scores)
 
-    std_3_6 = std(combined_3_6)
-    std_4_7 = std(combined_4_7)
 
-    mean_3_6 = mean(data6) - mean(data3)
-    mean_4_7 = mean(data7) - mean(data4)
+def dscore(blocks: dict, pairs, *, max_rt=MAX_RT, min_rt=MIN_RT, max_fast_prop=MAX_FAST_PROP):
+    """D-score de un participante.
+    blocks: {bloque: [tiempos de reacción]}
+    pairs: pares de bloques a comparar, p. ej. IAT1_PAIRS
+    """
+    labels = {label for pair in pairs for label in pair}
+    summary = {}
+    n_total = n_fast = 0
+    for label in labels:
+        kept = [v for v in blocks.get(label, ()) if v < max_rt]
+        n_total += len(kept)
+        n_fast += sum(1 for v in kept if v < min_rt)
+        summary[label] = moments(kept)
+    return dscore_from_moments(summary, pairs, n_fast, n_total, max_fast_prop)
 
-    dscore_3_6 = mean_3_6 / std_3_6 if std_3_6 > 0 else 0
-    dscore_4_7 = mean_4_7 / std_4_7 if std_4_7 > 0 else 0
 
-    dscore_mean1 = (dscore_3_6 + dscore_4_7) * 0.5
-    return dscore_mean1
+def dscore_many(participants: dict, pairs, **rules):
+    """D-scores de muchos participantes en una sola llamada.
+    participants: {clave: {bloque: [tiempos de reacción]}}
+    result: {clave: d-score o None}
+    """
+    return {key: dscore(blocks, pairs, **rules) for key, blocks in participants.items()}
+
+
+def dscore1(data3: list, data4: list, data6: list, data7: list):
+    return dscore({3: data3, 4: data4, 6: data6, 7: data7}, IAT1_PAIRS)
 
 
 def dscore2(data10: list, data13: list, data11: list, data14: list):
-    # Filtrar valores demasiado largos
-    def not_long(value):
-        return value < 10.0
-
-    data10 = list(filter(not_long, data10))
-    data13 = list(filter(not_long, data13))
-    data11 = list(filter(not_long, data11))
-    data14 = list(filter(not_long, data14))
-
-    # Filtrar valores demasiado cortos
-    def too_short(value):
-        return value < 0.300
-
-    total_data = data10 + data13 + data11 + data14
-    short_data = list(filter(too_short, total_data))
-    if len(short_data) / len(total_data) > 0.1:
+    return dscore({10: data10, 11: data11, 13: data13, 14: data14}, IAT2_PAIRS)
+
+
+# Variantes D1-D6 del algoritmo mejorado (Greenwald, Nosek y Banaji, 2003).
+# D1/D2 usan la latencia registrada (penalización incluida: se responde hasta acertar);
+# D3-D6 reemplazan la latencia de los errores por la media de los aciertos del bloque
+# más 2 SD de los aciertos o más 600 ms. D2, D5 y D6 además descartan los trials < 400 ms.
+DROP_RT = 0.400
+ERROR_PENALTY = 0.600
+
+VARIANTS = {
+    'D1': dict(drop_fast=False, errors=None),
+    'D2': dict(drop_fast=True, errors=None),
+    'D3': dict(drop_fast=False, errors='2sd'),
+    'D4': dict(drop_fast=False, errors='600ms'),
+    'D5': dict(drop_fast=True, errors='2sd'),
+    'D6': dict(drop_fast=True, errors='600ms'),
+}
+
+
+def _welford(acc, x):
+    acc[0] += 1
+    delta = x - acc[1]
+    acc[1] += delta / acc[0]
+    acc[2] += delta * (x - acc[1])
+
+
+def summarize_block(trials, *, max_rt=MAX_RT, min_rt=MIN_RT, drop_rt=DROP_RT):
+    """Recorre una sola vez los trials de un bloque, [(rt, es_error)], y deja todo lo que
+    necesitan las variantes: {'all'|'kept': {'trials'|'correct': (n, media, M2), 'errors': n}}
+    más n_total (sin los largos) y n_fast. 'kept' son los trials de al menos drop_rt.
+    """
+    subsets = {
+        name: dict(trials=[0, 0.0, 0.0], correct=[0, 0.0, 0.0], errors=0) for name in ('all', 'kept')
+    }
+    n_total = n_fast = 0
+    for rt, error in trials:
+        if rt >= max_rt:
+            continue
+        n_total += 1
+        if rt < min_rt:
+            n_fast += 1
+        for name in ('all', 'kept') if rt >= drop_rt else ('all',):
+            s = subsets[name]
+            _welford(s['trials'], rt)
+            if error:
+                s['errors'] += 1
+            else:
+                _welford(s['correct'], rt)
+    for s in subsets.values():
+        s['trials'] = tuple(s['trials'])
+        s['correct'] = tuple(s['correct'])
+    return dict(subsets, n_total=n_total, n_fast=n_fast)
+
+
+def block_summary(trials, *, max_rt=MAX_RT, min_rt=MIN_RT, drop_rt=DROP_RT):
+    """Agregados de un bloque [(rt, es_error)] para las exportaciones, en una sola pasada.
+    Los tiempos, la tasa de errores y la proporción de rápidos son sobre los trials de menos de max_rt.
+    """
+    s = summarize_block(trials, max_rt=max_rt, min_rt=min_rt, drop_rt=drop_rt)
+    n, m, m2 = s['all']['trials']
+    nc, mc, _ = s['all']['correct']
+    return dict(
+        n_trials=len(trials),
+        n_trimmed_long=len(trials) - s['n_total'],
+        n_trimmed_short=n - s['kept']['trials'][0],
+        mean_rt=m if n else None,
+        sd_rt=math.sqrt(m2 / (n - 1)) if n > 1 else None,
+        mean_rt_correct=mc if nc else None,
+        error_rate=s['all']['errors'] / n if n else None,
+        fast_prop=s['n_fast'] / n if n else None,
+    )
+
+
+def _variant_mean(s, errors):
+    """Media del bloque según el tratamiento de errores, o None si no se puede calcular"""
+    n, m, _ = s['trials']
+    if errors is None or s['errors'] == 0:
+        return m if n > 0 else None
+    nc, mc, m2c = s['correct']
+    if nc == 0:
+        return None
+    if errors == '2sd':
+        replacement = mc + 2 * (math.sqrt(m2c / (nc - 1)) if nc > 1 else 0.0)
+    else:
+        replacement = mc + ERROR_PENALTY
+    return (nc * mc + s['errors'] * replacement) / (nc + s['errors'])
+
+
+def dscore_variants(blocks: dict, pairs, *, max_rt=MAX_RT, min_rt=MIN_RT, max_fast_prop=MAX_FAST_PROP, variants=VARIANTS):
+    """Todas las variantes del d-score recorriendo una sola vez los trials.
+    blocks: {bloque: [(tiempo de reacción, es_error)]}
+    result: {'D1': d-score o None, ...}
+    """
+    labels = {label for pair in pairs for label in pair}
+    summary = {label: summarize_block(blocks.get(label, ()), max_rt=max_rt, min_rt=min_rt) for label in labels}
+    n_total = sum(s['n_total'] for s in summary.values())
+    n_fast = sum(s['n_fast'] for s in summary.values())
+    if n_total == 0 or n_fast / n_total > max_fast_prop:
+        return {name: None for name in variants}
+
+    result = {}
+    for name, variant in variants.items():
+        subset = 'kept' if variant['drop_fast'] else 'all'
+        scores = []
+        for a, b in pairs:
+            sa, sb = summary[a][subset], summary[b][subset]
+            n, _, m2 = combine(sa['trials'], sb['trials'])
+            ma, mb = _variant_mean(sa, variant['errors']), _variant_mean(sb, variant['errors'])
+            if n < 2:
+                scores = None
+                break
+            sd = math.sqrt(m2 / (n - 1))
+            # igual que dscore_from_moments: sin datos en un bloque la diferencia es 0
+            diff = mb - ma if ma is not None and mb is not None else 0
+            scores.append(diff / sd if sd > 0 else 0)
+        result[name] = sum(scores) / len(scores) if scores else None
+    return result
+
+
+# Intervalos de confianza bootstrap (percentil)
+BOOTSTRAP_REPLICATES = 2000
+BOOTSTRAP_LEVEL = 0.95
+
+
+def _resample(rng, data, k):
+    """k elementos de `data` con reemplazo, todos con la misma probabilidad (random.choices)"""
+    return rng.choices(data, k=k)
+
+
+def _replicate_sums(rng, data, n_boot):
+    """Sumas y sumas de cuadrados de n_boot remuestreos de `data`.
+    Los n_boot remuestreos se sacan con una sola llamada, uno detrás de otro, y cada
+    tramo de n se resume con sum() sobre un pedazo de la lista.
+    """
+    n = len(data)
+    if n == 0:
+        return [0.0] * n_boot, [0.0] * n_boot
+    draws = _resample(rng, data, n * n_boot)
+    squares = list(map(operator.mul, draws, draws))
+    starts = range(0, n * n_boot, n)
+    return [sum(draws[i:i + n]) for i in starts], [sum(squares[i:i + n]) for i in starts]
+
+
+def bootstrap_dscore(
+    blocks: dict,
+    pairs,
+    *,
+    n_boot=BOOTSTRAP_REPLICATES,
+    level=BOOTSTRAP_LEVEL,
+    seed=None,
+    max_rt=MAX_RT,
+    min_rt=MIN_RT,
+    max_fast_prop=MAX_FAST_PROP,
+):
+    """Intervalo de confianza percentil del d-score, remuestreando los trials dentro de cada bloque.
+    La exclusión por trials rápidos se decide con los datos originales, no en cada réplica.
+    blocks: {bloque: [tiempos de reacción]}
+    result: (inferior, superior), o None si el participante no tiene d-score
+    """
+    if dscore(blocks, pairs, max_rt=max_rt, min_rt=min_rt, max_fast_prop=max_fast_prop) is None:
         return None
+    rng = random.Random(seed)
+    kept = {
+        label: [v for v in blocks.get(label, ()) if v < max_rt]
+        for label in sorted({label for pair in pairs for label in pair})
+    }
+    replicates = {label: _replicate_sums(rng, data, n_boot) for label, data in kept.items()}
+
+    scores = [0.0] * n_boot
+    for a, b in pairs:
+        na, nb = len(kept[a]), len(kept[b])
+        n = na + nb
+        if na == 0 or nb == 0:
+            continue  # igual que dscore: sin datos en un bloque la diferencia es 0
+        (sa, qa), (sb, qb) = replicates[a], replicates[b]
+        for i, (x, y, q) in enumerate(zip(sa, sb, map(operator.add, qa, qb))):
+            var = (q - (x + y) * (x + y) / n) / (n - 1)
+            if var > 0:
+                scores[i] += (y / nb - x / na) / math.sqrt(var)
+    scores = sorted(score / len(pairs) for score in scores)
+
+    k = int((1 - level) / 2 * n_boot)
+    return scores[k], scores[n_boot - 1 - k]
+
+
+# Confiabilidad split-half por permutaciones
+SPLIT_HALF_SPLITS = 1000
+
+
+def _pair_scores(na, sa, qa, nb, sb, qb):
+    """D de un par de bloques (a, b) para muchos participantes a la vez.
+    Cada argumento es una lista con un valor por participante: conteos, sumas y sumas de cuadrados.
+    """
+    scores = []
+    for n1, s1, q1, n2, s2, q2 in zip(na, sa, qa, nb, sb, qb):
+        n = n1 + n2
+        if n < 2:
+            scores.append(None)
+            continue
+        total = s1 + s2
+        var = (q1 + q2 - total * total / n) / (n - 1)
+        diff = s2 / n2 - s1 / n1 if n1 > 0 and n2 > 0 else 0
+        scores.append(diff / math.sqrt(var) if var > 0 else 0)
+    return scores
+
+
+def _mean_scores(per_pair):
+    """Promedio entre pares, participante por participante (None si falta alguno)"""
+    return [None if None in scores else sum(scores) / len(scores) for scores in zip(*per_pair)]
+
+
+def pearson(xs, ys):
+    """Correlación de Pearson, o None si alguna de las dos series no varía"""
+    n = len(xs)
+    if n < 2:
+        return None
+    mx, my = sum(xs) / n, sum(ys) / n
+    dx = [x - mx for x in xs]
+    dy = [y - my for y in ys]
+    sxx = sum(map(operator.mul, dx, dx))
+    syy = sum(map(operator.mul, dy, dy))
+    if sxx <= 0 or syy <= 0:
+        return None
+    return sum(map(operator.mul, dx, dy)) / math.sqrt(sxx * syy)
+
+
+def split_half_reliability(
+    participants: dict,
+    pairs,
+    *,
+    n_splits=SPLIT_HALF_SPLITS,
+    seed=None,
+    max_rt=MAX_RT,
+    min_rt=MIN_RT,
+    max_fast_prop=MAX_FAST_PROP,
+):
+    """Confiabilidad split-half (corregida con Spearman-Brown) del d-score en un grupo de participantes.
+    En cada partición los trials de cada bloque se dividen al azar en dos mitades, se calcula el
+    d-score de cada mitad y se correlacionan las mitades entre participantes. La división de
+    posiciones es la misma para todos los participantes dentro de una partición, así que cada
+    mitad se suma con itertools.compress sin recorrer los trials en Python.
+    El promedio sobre muchas particiones aproxima el alfa de Cronbach.
+    participants: {clave: {bloque: [tiempos de reacción]}}
+    result: dict(n_participants, n_splits, r, reliability, low, high), o None con menos de 3 participantes
+    """
+    labels = sorted({label for pair in pairs for label in pair})
+    # por bloque, una lista con un elemento por participante
+    values = {label: [] for label in labels}
+    squares = {label: [] for label in labels}
+    for blocks in participants.values():
+        # los participantes excluidos (p. ej. por trials rápidos) no entran
+        if dscore(blocks, pairs, max_rt=max_rt, min_rt=min_rt, max_fast_prop=max_fast_prop) is None:
+            continue
+        for label in labels:
+            kept = [v for v in blocks.get(label, ()) if v < max_rt]
+            values[label].append(kept)
+            squares[label].append(list(map(operator.mul, kept, kept)))
+    n_participants = len(values[labels[0]])
+    if n_participants < 3:
+        return None
+    counts = {label: [len(v) for v in values[label]] for label in labels}
+    half_counts = {label: ([n // 2 for n in counts[label]], [n - n // 2 for n in counts[label]]) for label in labels}
+    totals = {label: (list(map(sum, values[label])), list(map(sum, squares[label]))) for label in labels}
+
+    rng = random.Random(seed)
+    rs = []
+    coefficients = []
+    for _ in range(n_splits):
+        halves = {}
+        for label in labels:
+            masks = {}
+            for n in set(counts[label]):
+                mask = [True] * (n // 2) + [False] * (n - n // 2)
+                rng.shuffle(mask)
+                masks[n] = mask
+            row_masks = [masks[n] for n in counts[label]]
+            sa = list(map(sum, map(itertools.compress, values[label], row_masks)))
+            qa = list(map(sum, map(itertools.compress, squares[label], row_masks)))
+            s, q = totals[label]
+            na, nb = half_counts[label]
+            halves[label] = (
+                (na, sa, qa),
+                (nb, list(map(operator.sub, s, sa)), list(map(operator.sub, q, qa))),
+            )
+        # la exclusión por trials rápidos ya se decidió con todos los trials
+        xs, ys = [], []
+        da = _mean_scores([_pair_scores(*halves[a][0], *halves[b][0]) for a, b in pairs])
+        db = _mean_scores([_pair_scores(*halves[a][1], *halves[b][1]) for a, b in pairs])
+        for x, y in zip(da, db):
+            if x is not None and y is not None:
+                xs.append(x)
+                ys.append(y)
+        r = pearson(xs, ys)
+        if r is None or r <= -1:
+            continue
+        rs.append(r)
+        coefficients.append(2 * r / (1 + r))
+    if not coefficients:
+        return None
+
+    coefficients.sort()
+    k = int(0.025 * len(coefficients))
+    return dict(
+        n_participants=n_participants,
+        n_splits=len(coefficients),
+        r=sum(rs) / len(rs),
+        reliability=sum(coefficients) / len(coefficients),
+        low=coefficients[k],
+        high=coefficients[len(coefficients) - 1 - k],
+    )
+
+
+# Acumuladores para calcular el d-score mientras se juega.
+# Cada bloque lleva una lista [n, media, M2, n_rápidos, n_largos] (Welford),
+# donde n, media, M2 y n_rápidos son sólo de los trials que no son largos.
+
+def running_new():
+    return [0, 0.0, 0.0, 0, 0]
+
 
-    # Calcular el d-score
-    combined_10_11 = data10 + data11
-    combined_13_14 = data13 + data14
+def running_add(acc, rt, *, max_rt=MAX_RT, min_rt=MIN_RT):
+    """Agrega un tiempo de reacción al acumulador"""
+    if rt >= max_rt:
+        acc[4] += 1
+        return acc
+    acc[0] += 1
+    delta = rt - acc[1]
+    acc[1] += delta / acc[0]
+    acc[2] += delta * (rt - acc[1])
+    if rt < min_rt:
+        acc[3] += 1
+    return acc
 
-    std_10_11 = std(combined_10_11)
-    std_13_14 = std(combined_13_14)
 
-    mean_10_11 = mean(data11) - mean(data10)
-    mean_13_14 = mean(data14) - mean(data13)
+def running_remove(acc, rt, *, max_rt=MAX_RT, min_rt=MIN_RT):
+    """Quita un tiempo de reacción agregado antes (p. ej. cuando se reintenta un trial)"""
+    if rt >= max_rt:
+        acc[4] -= 1
+        return acc
+    if acc[0] <= 1:
+        acc[0], acc[1], acc[2] = 0, 0.0, 0.0
+    else:
+        n = acc[0] - 1
+        old_mean = acc[1]
+        acc[1] = (acc[0] * old_mean - rt) / n
+        acc[2] = max(acc[2] - (rt - old_mean) * (rt - acc[1]), 0.0)
+        acc[0] = n
+    if rt < min_rt:
+        acc[3] -= 1
+    return acc
 
-    dscore_10_11 = mean_10_11 / std_10_11 if std_10_11 > 0 else 0
-    dscore_13_14 = mean_13_14 / std_13_14 if std_13_14 > 0 else 0
 
-    dscore_mean2 = (dscore_10_11 + dscore_13_14) * 0.5
-    return dscore_mean2
+def dscore_from_running(accs: dict, pairs, max_fast_prop=MAX_FAST_PROP):
+    """D-score a partir de los acumuladores {bloque: [n, media, M2, n_rápidos, n_largos]}"""
+    labels = {label for pair in pairs for label in pair}
+    summary = {}
+    n_total = n_fast = 0
+    for label in labels:
+        acc = accs.get(label) or running_new()
+        summary[label] = (acc[0], acc[1], acc[2])
+        n_total += acc[0]
+        n_fast += acc[3]
+    return dscore_from_moments(summary, pairs, n_fast, n_total, max_fast_prop)
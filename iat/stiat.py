@@ -0,0 +1,334 @@
+"""ST-IAT: parseo de los datos de MinnoJS y D-score
+
+No depende de oTree, así que también se usa desde las herramientas fuera de línea (rescore.py).
+"""
+import base64
+import csv
+import io
+import struct
+import sys
+import zlib
+from array import array
+from statistics import mean, stdev
+from typing import Dict, Any, List, Tuple, Optional
+
+# Por defecto, en el script de Project Implicit (qstiat6.js) los dos bloques críticos
+# suelen ser: 3 = Target+Pleasant  (compatible) y 5 = Target+Unpleasant (incompatible).
+# Si en el futuro cambias el orden, cambia estos IDs vía session.config['stiat_block_map']
+DEFAULT_STIAT_BLOCK_MAP = {
+    "compatible":   [3],
+    "incompatible": [5],
+}
+
+_BOOLS = dict.fromkeys(("1", "true", "t", "yes", "y", "si", "sí"), True)
+_BOOLS.update(dict.fromkeys(("0", "false", "f", "no", "n"), False))
+
+def _to_bool(x):
+    # Acepta 1/0, "true"/"false", "True"/"False", etc.
+    if isinstance(x, bool):
+        return x
+    if x is None:
+        return None
+    return _BOOLS.get(str(x).strip().lower())
+
+# nombres de columna aceptados, en orden de preferencia
+BLOCK_COLUMNS = ('block', 'Block', 'blockNum', 'phase')
+LATENCY_COLUMNS = ('latency', 'rt', 'latency_ms', 'responseLatency')
+CORRECT_COLUMNS = ('correct',)
+ERROR_COLUMNS = ('error', 'Error')  # 1 = error
+
+# filas que se miran para decidir si las latencias vienen en ms o en s
+UNIT_SAMPLE = 50
+
+
+class StiatTrials:
+    """Trials de un ST-IAT como arreglos paralelos: block (int), rt (segundos), correct (0/1)"""
+
+    __slots__ = ('block', 'rt', 'correct')
+
+    def __init__(self):
+        self.block = array('i')
+        self.rt = array('d')
+        self.correct = array('b')
+
+    @classmethod
+    def from_dicts(cls, rows):
+        trials = cls()
+        for r in rows:
+            trials.append(r["block"], r["rt"], r["correct"])
+        return trials
+
+    def append(self, block, rt, correct):
+        self.block.append(block)
+        self.rt.append(rt)
+        self.correct.append(1 if correct else 0)
+
+    def __len__(self):
+        return len(self.rt)
+
+    def __iter__(self):
+        # compatibilidad con el formato anterior (lista de dicts)
+        for block, rt, correct in zip(self.block, self.rt, self.correct):
+            yield dict(block=block, rt=rt, correct=bool(correct))
+
+
+def _find_column(header, names):
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def resolve_schema(header):
+    """Índices de las columnas que usamos, resueltos una sola vez por archivo"""
+    latency = _find_column(header, LATENCY_COLUMNS)
+    return dict(
+        block=_find_column(header, BLOCK_COLUMNS),
+        latency=latency,
+        correct=_find_column(header, CORRECT_COLUMNS),
+        error=_find_column(header, ERROR_COLUMNS),
+        # si el nombre lo dice, no hace falta adivinar la unidad
+        latency_ms=latency is not None and header[latency].endswith('_ms'),
+    )
+
+
+def _latency_divisor(sample):
+    """Divisor para pasar a segundos: 1000 si las latencias parecen estar en milisegundos
+    (heurística: una mediana > 50 es casi seguro milisegundos), si no 1"""
+    sample = sorted(sample)
+    return 1000.0 if sample[len(sample) // 2] > 50 else 1.0
+
+#funcion para el dscore de black. (o del primer st-iat)
+def parse_minno_stiat_csv(csv_text: str) -> StiatTrials:
+    """
+    Devuelve los trials (block, rt en segundos, correct) como StiatTrials.
+    Soporta columnas comunes de Minno: 'block','latency','rt','correct','error'.
+    Las columnas se resuelven una vez con el encabezado, y la unidad de la latencia
+    (ms o s) una vez con las primeras filas; luego las filas se leen de corrido.
+    """
+    trials = StiatTrials()
+    if not csv_text:
+        return trials
+    reader = csv.reader(io.StringIO(csv_text))
+    header = next(reader, None)
+    if header is None:
+        return trials
+    schema = resolve_schema(header)
+    b_idx, l_idx, c_idx, e_idx = schema['block'], schema['latency'], schema['correct'], schema['error']
+    if b_idx is None or l_idx is None:
+        return trials
+
+    width = max(i for i in (b_idx, l_idx, c_idx, e_idx) if i is not None) + 1
+    pending = []  # filas leídas antes de conocer la unidad
+    divisor = 1000.0 if schema['latency_ms'] else None
+    for row in reader:
+        if len(row) < width:
+            # fila corta: los campos que faltan quedan vacíos
+            row = row + [""] * (width - len(row))
+        # --- block ---
+        try:
+            block = int(row[b_idx])
+            rt = float(row[l_idx])
+        except ValueError:
+            # sin número de bloque o sin latencia, salta fila
+            continue
+
+        # --- correct / error ---
+        correct = _BOOLS.get(row[c_idx].strip().lower()) if c_idx is not None else None
+        if correct is None and e_idx is not None:
+            # Algunas hojas traen 'error' (1 = error)
+            # (como antes, un valor que no se reconoce cuenta como acierto)
+            err = row[e_idx].strip()
+            if err:
+                correct = not _BOOLS.get(err.lower())
+        # Si sigue None, asumimos "desconocido"; se guardan como incorrectos para ser conservadores
+
+        if divisor is None:
+            pending.append((block, rt, correct))
+            if len(pending) < UNIT_SAMPLE:
+                continue
+            divisor = _latency_divisor([p[1] for p in pending])
+            for block, rt, correct in pending:
+                trials.append(block, rt / divisor, correct)
+            pending = None
+            continue
+        trials.append(block, rt / divisor, correct)
+
+    if pending:
+        divisor = _latency_divisor([p[1] for p in pending])
+        for block, rt, correct in pending:
+            trials.append(block, rt / divisor, correct)
+    return trials
+
+def compute_stiat_d(
+    trials: StiatTrials,
+    compat_blocks: List[int],
+    incompat_blocks: List[int],
+    *,
+    error_penalty_s: float = 0.600,  # 600 ms
+    min_rt_s: float = 0.300,
+    max_rt_s: float = 10.000,
+    max_fast_prop: float = 0.10,
+) -> Tuple[Optional[float], Dict[str, Any]]:
+    """
+    Implementación estilo Greenwald et al. (2003) adaptada a ST-IAT:
+      • descarta RT < 300 ms y > 10 s
+      • exclusión si >10% de todos los trials (antes de descartar por >10s) < 300 ms
+      • penaliza errores sumando 600 ms al RT del ensayo
+      • D = (mean_incompat - mean_compat) / sd_pooled(trials de ambos bloques críticos)
+    trials: StiatTrials (de parse_minno_stiat_csv) o una lista de dicts block/rt/correct.
+    Devuelve (D, meta) donde meta trae contadores/flags útiles para depurar.
+    """
+    if not isinstance(trials, StiatTrials):
+        trials = StiatTrials.from_dicts(trials)
+    rts = trials.rt
+    meta = {
+        "n_total": len(rts),
+        "n_fast_300ms": 0,
+        "excluded_fast_prop": False,
+        "n_compat_used": 0,
+        "n_incompat_used": 0,
+        "sd_pooled": None,
+    }
+    if not rts:
+        return None, meta
+
+    # Proporción <300 ms (con el conjunto completo que vino)
+    meta["n_fast_300ms"] = sum(1 for rt in rts if rt < min_rt_s)
+    if meta["n_total"] > 0 and (meta["n_fast_300ms"] / meta["n_total"]) > max_fast_prop:
+        meta["excluded_fast_prop"] = True
+        return None, meta  # recomendación habitual: excluir participante
+
+    # Mantén solo bloque crítico y RT dentro de [300ms,10s]; aplica penalización a errores
+    compat = set(compat_blocks)
+    incompat = set(incompat_blocks)
+    compat_rts = []
+    incompat_rts = []
+    for block, rt, correct in zip(trials.block, rts, trials.correct):
+        if rt < min_rt_s or rt > max_rt_s:
+            continue
+        if not correct:
+            rt += error_penalty_s
+        if block in compat:
+            compat_rts.append(rt)
+        elif block in incompat:
+            incompat_rts.append(rt)
+
+    meta["n_compat_used"] = len(compat_rts)
+    meta["n_incompat_used"] = len(incompat_rts)
+
+    if len(compat_rts) < 2 or len(incompat_rts) < 2:
+        return None, meta
+
+    pooled = compat_rts + incompat_rts
+    sd = stdev(pooled) if len(pooled) >= 2 else 0.0
+    meta["sd_pooled"] = sd
+
+    if sd == 0:
+        return None, meta
+
+    d = (mean(incompat_rts) - mean(compat_rts)) / sd
+    return float(round(d, 4)), meta
+
+def classify_stiat_black(d: Optional[float]) -> str:
+    """
+    Umbrales habituales: |D| < .15 = Neutral; .15–.35 = Leve; .35–.65 = Moderada; >.65 = Fuerte.
+    Para ST-IAT de 'Black people':
+      D > 0 → Black+Pleasant más rápido (evaluación implícita positiva hacia Black)
+      D < 0 → Black+Unpleasant más rápido (evaluación implícita negativa hacia Black)
+    """
+    if d is None:
+        return "Sin clasificación"
+    x = abs(d)
+    if x < 0.15:
+        return "Neutral"
+    level = "Leve" if x <= 0.35 else ("Moderada" if x <= 0.65 else "Fuerte")
+    return f"{level}: {'Black+positivo' if d>0 else 'Black+negativo'}"
+
+
+# === Almacenamiento compacto de los registros de MinnoJS =====================
+# En los campos *_raw del ST-IAT se guarda "stiat:v2:" + base85(zlib(texto original)).
+# Sólo se guarda el CSV: los trials se parsean de él cuando se piden (StiatLog.trials).
+# Los valores sin prefijo son CSV de antes y se siguen leyendo, igual que los "stiat:v1:",
+# que además del texto traían los trials ya parseados como arreglos.
+STORAGE_PREFIX = "stiat:v2:"
+V1_PREFIX = "stiat:v1:"
+_V1_HEADER = struct.Struct('<IIc')  # número de trials, bytes del texto original, tipo de rt
+
+
+def _from_le_bytes(typecode, data):
+    # los arreglos de v1 se guardaron en little-endian, sea cual sea la máquina
+    arr = array(typecode)
+    arr.frombytes(data)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+
+def encode_stiat(csv_text: str) -> str:
+    """Versión compacta de un registro de MinnoJS para guardar en un campo *_raw"""
+    if not csv_text:
+        return ""
+    return STORAGE_PREFIX + base64.b85encode(zlib.compress(csv_text.encode('utf-8'), 9)).decode('ascii')
+
+
+def is_encoded(value) -> bool:
+    return bool(value) and value.startswith((STORAGE_PREFIX, V1_PREFIX))
+
+
+def _decode_v1(value):
+    payload = zlib.decompress(base64.b64decode(value[len(V1_PREFIX):]))
+    n, raw_len, rt_code = _V1_HEADER.unpack_from(payload)
+    pos = _V1_HEADER.size
+    trials = StiatTrials()
+    trials.block = _from_le_bytes('i', payload[pos:pos + 4 * n])
+    pos += 4 * n
+    if rt_code == b'i':
+        trials.rt = array('d', [v / 1000 for v in _from_le_bytes('i', payload[pos:pos + 4 * n])])
+        pos += 4 * n
+    else:
+        trials.rt = _from_le_bytes('d', payload[pos:pos + 8 * n])
+        pos += 8 * n
+    trials.correct = _from_le_bytes('b', payload[pos:pos + n])
+    pos += n
+    return trials, payload[pos:pos + raw_len].decode('utf-8')
+
+
+def decode_raw(value) -> str:
+    """El CSV original guardado en un campo *_raw (compacto o de antes)"""
+    if not value:
+        return ""
+    if value.startswith(STORAGE_PREFIX):
+        return zlib.decompress(base64.b85decode(value[len(STORAGE_PREFIX):])).decode('utf-8')
+    if value.startswith(V1_PREFIX):
+        return _decode_v1(value)[1]
+    return value
+
+
+class StiatLog:
+    """Valor guardado en un campo *_raw del ST-IAT (compacto o CSV de antes); se decodifica sólo al pedirlo"""
+
+    def __init__(self, value):
+        self.value = value or ""
+        self._decoded = None
+
+    def _load(self):
+        if self._decoded is None:
+            if self.value.startswith(V1_PREFIX):
+                self._decoded = _decode_v1(self.value)
+            else:
+                raw = decode_raw(self.value)
+                self._decoded = (parse_minno_stiat_csv(raw), raw)
+        return self._decoded
+
+    @property
+    def trials(self) -> StiatTrials:
+        return self._load()[0]
+
+    @property
+    def raw(self) -> str:
+        """El CSV original de MinnoJS"""
+        if self._decoded is None:
+            # para el texto no hace falta parsear los trials
+            return decode_raw(self.value)
+        return self._decoded[1]
@@ -6,6 +6,8 @@ The categories should be paired and put into `primary` or `secondary` session co
 If a file stimuli.csv is present in app dir,
 it's content is loaded into the DICT.
 the csv should contain (at least) two columns: category, stimulus.
+Changes to stimuli.csv are picked up while the server runs (see registry.Library);
+sessions keep the stimuli they were created with.
 """
 
 from pathlib import Path
@@ -102,14 +104,27 @@ DICT = {
     ],
 }
 
-csvfile = Path(__file__).parent / "stimuli.csv"
+CSV_FILE = Path(__file__).parent / "stimuli.csv"
 
-if csvfile.exists():
-    with open(csvfile, encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            cat = row['category']
-            word = row['stimulus']
-            if cat not in DICT:
-                DICT[cat] = []
-            DICT[cat].append(word)
+# los estímulos definidos aquí; stimuli.csv se agrega encima
+BUILTIN = {cat: tuple(pool) for cat, pool in DICT.items()}
+
+
+def load(csvfile=CSV_FILE):
+    """Un dict nuevo con los estímulos de BUILTIN más los de stimuli.csv (si existe).
+    Se usa al arrancar y cada vez que cambia stimuli.csv (ver registry.Library).
+    """
+    pools = {cat: list(pool) for cat, pool in BUILTIN.items()}
+    if csvfile.exists():
+        with open(csvfile, encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                cat = row['category']
+                word = row['stimulus']
+                if cat not in pools:
+                    pools[cat] = []
+                pools[cat].append(word)
+    return pools
+
+
+DICT = load()
@@ -4,7 +4,10 @@ from contextlib import contextmanager
 from otree.api import *
 from otree import settings
 
-from . import Player, Trial as Puzzle, Intro, RoundN, Results, generate_trial
+from . import (
+    Constants, Player, Trial as Puzzle, Comprehension, ComprehensionFeedback, Comprehension2,
+    ComprehensionFeedback2, UserInfo, Intro, RoundN, generate_trial, trial_cache, planned_trial, iat_order,
+)
 
 # tests copypasted from real-effort tasks because of the same communication proto
 # adjusted to skip missing features
@@ -29,10 +32,26 @@ class PlayerBot(Bot):
         "retrying_incorrect",  # answering the same puzzle incorrectly after correct answer, for no reason
         "retrying_nodelay",  # retrying w/out delay
         "retrying_many",  # retrying many times
+        "block_prefetch",  # playing a prefetched block locally
+        "answer_next",  # answering and receiving next trial in one message
     ]
 
     def play_round(self):
-        if self.player.round_number == 1:
+        player = self.player
+        if player.round_number > 14:
+            # los bots sólo cubren las rondas del IAT
+            return
+
+        if player.round_number == 1:
+            if iat_order(player) == 'direct':
+                yield Submission(Comprehension, Constants.CORRECT_ANSWERS, check_html=False)
+                yield Submission(ComprehensionFeedback, check_html=False)
+            else:
+                yield Submission(Comprehension2, Constants.CORRECT_ANSWERS2, check_html=False)
+                yield Submission(ComprehensionFeedback2, check_html=False)
+            yield Submission(UserInfo, dict(edad=30, sexo='ND', ha_participado='No'), check_html=False)
+
+        if player.round_number in [1, 8]:
             yield Submission(Intro, check_html=False)
 
         yield Submission(RoundN, check_html=False)
@@ -46,11 +65,9 @@ class PlayerBot(Bot):
         expect(player.num_failed, num_incorrect)
         expect(player.num_trials, num_total)
 
-        if self.player.round_number == 14:
-            yield Submission(Results, check_html=False)
-
 
 def get_last_puzzle(player: Player) -> Puzzle:
+    trial_cache.flush(player)
     trials = Puzzle.filter(player=player, iteration=player.iteration)
     trial = trials[-1] if len(trials) else None
     return trial
@@ -75,6 +92,7 @@ def expect_failure(*exceptions):
 
 def get_last_puzzle_clone(p):
     # makes a clone to check changes of the same instance
+    trial_cache.flush(p)
     data = Puzzle.values_dicts(player=p)  # noqa
     if len(data) == 0:
         return None
@@ -83,6 +101,7 @@ def get_last_puzzle_clone(p):
 
 
 def get_progress(p):
+    trial_cache.flush(p)
     return {
         "total": len(Puzzle.filter(player=p)),
         "correct": len(Puzzle.filter(player=p, is_correct=True)),
@@ -122,6 +141,24 @@ def give_answer(m, p, ans):
     return _response[p.id_in_group]
 
 
+def request_block(m, p):
+    return m(p.id_in_group, dict(type='block'))[p.id_in_group]
+
+
+def give_block_answer(m, p, iteration, ans):
+    _response = m(p.id_in_group, dict(type="answer", iteration=iteration, answer=ans, reaction_time=1.0))
+    return _response[p.id_in_group]
+
+
+def give_answer_next(m, p, ans):
+    _response = m(p.id_in_group, dict(type="answer_next", answer=ans, reaction_time=1.0))
+    return _response[p.id_in_group]
+
+
+def planned_solution(p, iteration):
+    return planned_trial(p, iteration)[3]
+
+
 def expect_progress(p, **values):
     progress = get_progress(p)
     expect(progress, values)
@@ -179,6 +216,12 @@ def expect_response_progress(response, **values):
     expect(response["progress"], values)
 
 
+def expect_response_error(response):
+    # los mensajes inválidos se rechazan con una respuesta de error, sin excepción
+    expect(response['type'], 'error')
+    expect("message", "in", response)
+
+
 def expect_response_correct(response):
     expect(response['type'], 'feedback')
     expect("is_correct", "in", response)
@@ -325,8 +368,7 @@ def live_test_replying_incorrect(method, player, conf):
 
 
 def live_test_messaging_bogus(method, player, conf):
-    with expect_failure(TypeError):
-        method(player.id_in_group, "BOGUS")
+    expect_response_error(method(player.id_in_group, "BOGUS")[player.id_in_group])
 
 
 def live_test_reloading_start(method, player, conf):
@@ -366,15 +408,13 @@ def live_test_reloading_midgame(method, player, conf):
 
 def live_test_replying_empty(method, player, conf):
     move_forward(method, player)
-    with expect_failure(ValueError):
-        give_answer(method, player, "")
+    expect_response_error(give_answer(method, player, ""))
     expect_not_answered(player)
 
 
 def live_test_replying_null(method, player, conf):
     move_forward(method, player)
-    with expect_failure(ValueError):
-        give_answer(method, player, None)
+    expect_response_error(give_answer(method, player, None))
     expect_not_answered(player)
 
 
@@ -382,8 +422,7 @@ def live_test_replying_premature(method, player, conf):
     last = get_last_puzzle(player)
     expect(last, None)
     answer = "123"
-    with expect_failure(RuntimeError):
-        give_answer(method, player, answer)
+    expect_response_error(give_answer(method, player, answer))
 
 
 def live_test_retrying_correct(method, player, conf):
@@ -448,8 +487,7 @@ def live_test_retrying_nodelay(method, player, conf):
     answer2 = solution(player)
 
     # no matter if retry is allowed or not
-    with expect_failure(RuntimeError):
-        give_answer(method, player, answer2)
+    expect_response_error(give_answer(method, player, answer2))
     expect_not_reanswered(player, last)
     # state not changed
     expect_answered_incorrectly(player, answer1)
@@ -486,8 +524,7 @@ def live_test_forward_nodelay(method, player, conf):
     answer = solution(player)
     give_answer(method, player, answer)
 
-    with expect_failure(RuntimeError):
-        move_forward(method, player)
+    expect_response_error(move_forward(method, player))
     expect_not_forwarded(player, last)
 
 
@@ -500,8 +537,7 @@ def live_test_skipping_unanswered(method, player, conf):
 
     time.sleep(trial_delay)
 
-    with expect_failure(RuntimeError):
-        move_forward(method, player)
+    expect_response_error(move_forward(method, player))
     expect_not_forwarded(player, last)
     expect_progress(player, total=1, correct=0, incorrect=0)
 
@@ -522,8 +558,7 @@ def live_test_skipping_incorrect(method, player, conf):
     time.sleep(trial_delay)
 
     if force_solve:
-        with expect_failure(RuntimeError):
-            move_forward(method, player)
+        expect_response_error(move_forward(method, player))
         expect_not_forwarded(player, last)
         expect_progress(player, total=1, correct=0, incorrect=1)
     else:  # just a part of normal flow
@@ -531,6 +566,192 @@ def live_test_skipping_incorrect(method, player, conf):
         expect_forwarded(player, last)
         expect_progress(player, total=2, correct=0, incorrect=1)
 
+def live_test_block_prefetch(method, player, conf):
+    trial_delay = conf['trial_delay']
+    max_iters = conf['num_iterations'][player.round_number]
+
+    resp = request_block(method, player)
+    expect(resp['type'], 'block')
+    expect(len(resp['trials']), max_iters)
+    expect(resp['trials'][0]['iteration'], 1)
+    expect("correct", "not in", resp['trials'][0])
+    # nothing is stored until the client answers
+    expect_progress(player, total=0, correct=0, incorrect=0)
+
+    answer = planned_solution(player, 1)
+    resp = give_block_answer(method, player, 1, answer)
+    expect_response_correct(resp)
+    last = get_last_puzzle(player)
+    expect(last.response, answer)
+    expect(last.is_correct, True)
+    # the server stores when the answer arrived; the client's RT is kept apart
+    expect(last.timestamp, last.response_timestamp)
+    expect(last.reaction_time, 1.0)
+    expect_progress(player, total=1, correct=1, incorrect=0)
+
+    # out of sequence answers are rejected
+    resp = give_block_answer(method, player, 3, "left")
+    expect(resp['type'], 'error')
+    expect_not_forwarded(player, last)
+
+    time.sleep(trial_delay)
+
+    answer = planned_solution(player, 2)
+    resp = give_block_answer(method, player, 2, answer)
+    expect_response_correct(resp)
+    expect_forwarded(player, last)
+    expect_progress(player, total=2, correct=2, incorrect=0)
+
+    # a reload resumes the sequence after the last solved trial
+    resp = request_block(method, player)
+    expect(len(resp['trials']), max_iters - 2)
+    if max_iters > 2:
+        expect(resp['trials'][0]['iteration'], 3)
+
+
+def live_test_answer_next(method, player, conf):
+    trial_delay = conf['trial_delay']
+    max_iters = conf['num_iterations'][player.round_number]
+
+    move_forward(method, player)
+    last = get_last_puzzle(player)
+
+    # incorrect answer doesn't advance
+    resp = give_answer_next(method, player, "0")
+    expect_response_incorrect(resp)
+    expect("trial", "not in", resp)
+    expect_not_forwarded(player, last)
+
+    time.sleep(conf['retry_delay'])
+
+    answer = solution(player)
+    resp = give_answer_next(method, player, answer)
+    expect_response_correct(resp)
+    expect_response_trial(dict(resp, type='trial'))
+    expect(abs(resp['not_before'] - resp['server_time'] - trial_delay), "<", 1e-6)
+    expect_forwarded(player, last)
+    expect_progress(player, total=2, correct=1, incorrect=0)
+
+    # the delivered trial can't be answered before not_before
+    resp = give_answer_next(method, player, solution(player))
+    expect(resp['type'], 'error')
+
+    time.sleep(trial_delay)
+
+    resp = give_answer_next(method, player, solution(player))
+    expect_response_correct(resp)
+    expect_response_progress(
+        resp, iteration=min(3, max_iters), num_trials=2, num_correct=2, num_incorrect=0, total=max_iters
+    )
+
+
+def test_dscore_engine_matches_previous_implementation():
+    """stats.dscore1/dscore2 give the scores of the implementation they replaced, on fixed inputs
+    covering long trials, the too-fast exclusion, empty blocks and the error penalty."""
+    from statistics import mean, stdev
+    from . import stats
+
+    def previous(a1, b1, a2, b2):
+        # dscore1/dscore2 de iat/__init__.py antes de consolidarlos, con los pares (a1, b1) y (a2, b2)
+        a1, b1, a2, b2 = ([v for v in block if v < 10.0] for block in (a1, b1, a2, b2))
+        total = a1 + b1 + a2 + b2
+        if len(total) == 0 or len([v for v in total if v < 0.300]) / len(total) > 0.1:
+            return None
+        if len(a1 + b1) < 2 or len(a2 + b2) < 2:
+            return None
+        scores = []
+        for a, b in ((a1, b1), (a2, b2)):
+            sd = stdev(a + b)
+            diff = mean(b) - mean(a) if len(a) > 0 and len(b) > 0 else 0
+            scores.append(diff / sd if sd > 0 else 0)
+        return (scores[0] + scores[1]) * 0.5
+
+    slow = [0.62, 0.71, 0.58, 0.95, 0.66, 0.80, 0.74, 0.69, 0.77, 0.83]
+    fast = [0.51, 0.47, 0.55, 0.60, 0.49, 0.58, 0.52, 0.45, 0.57, 0.50]
+    cases = [
+        (fast, slow, fast[::-1], slow[::-1]),
+        (fast + [12.0], slow + [10.0, 30.0], fast, slow),  # 10 s o más se descarta
+        ([0.2] * 4 + fast[4:], slow, fast, slow),  # 4 de 40 rápidos: justo el 10%, sí hay d-score
+        ([0.2] * 5 + fast[5:], slow, fast, slow),  # 5 de 40: más del 10%, no hay d-score
+        ([], slow, fast, slow),  # bloque vacío: ese par aporta 0
+        ([0.5], [], [0.6], []),  # menos de dos datos por par
+        ([], [], [], []),
+        ([0.5, 0.5], [0.5, 0.5], fast, slow),  # sin variación en un par
+    ]
+    for a1, b1, a2, b2 in cases:
+        expected = previous(a1, b1, a2, b2)
+        for result in (stats.dscore1(a1, a2, b1, b2), stats.dscore2(a1, a2, b1, b2)):
+            assert (result is None) == (expected is None), (a1, b1, a2, b2)
+            if expected is not None:
+                assert abs(result - expected) < 1e-12, (result, expected)
+    assert abs(stats.dscore1(fast, fast[::-1], slow, slow[::-1]) - 1.5526396) < 1e-7
+    assert stats.dscore1([0.2] * 5 + fast[5:], fast, slow, slow) is None
+
+    # penalización de errores (D4): cada error vale la media de los aciertos del bloque + 600 ms,
+    # y la desviación estándar sigue siendo la de las latencias registradas
+    blocks = {
+        3: [(rt, i == 0) for i, rt in enumerate(fast)],
+        6: [(rt, i < 2) for i, rt in enumerate(slow)],
+        4: [(rt, False) for rt in fast],
+        7: [(rt, i == 9) for i, rt in enumerate(slow)],
+    }
+
+    def penalized(block):
+        correct = mean(rt for rt, error in block if not error)
+        return [correct + 0.600 if error else rt for rt, error in block]
+
+    expected = mean(
+        (mean(penalized(blocks[b])) - mean(penalized(blocks[a]))) / stdev([rt for rt, _ in blocks[a] + blocks[b]])
+        for a, b in stats.IAT1_PAIRS
+    )
+    variants = stats.dscore_variants(blocks, stats.IAT1_PAIRS)
+    assert abs(variants['D4'] - expected) < 1e-12
+    assert abs(variants['D1'] - previous(fast, slow, fast, slow)) < 1e-12
+
+
+def test_running_dscore_matches_batch():
+    """The streaming accumulators give the same d-scores as the batch scorer,
+    including retried trials whose reaction time gets replaced."""
+    import random
+    from . import stats
+
+    rng = random.Random(0)
+
+    def random_rt():
+        kind = rng.random()
+        if kind < 0.05:
+            return rng.uniform(10.0, 15.0)  # too long
+        if kind < 0.12:
+            return rng.uniform(0.05, 0.3)  # too fast
+        return rng.lognormvariate(-0.3, 0.4)
+
+    for _ in range(500):
+        blocks = {}
+        running = {}
+        for rnd in (3, 4, 6, 7, 10, 11, 13, 14):
+            acc = stats.running_new()
+            rts = []
+            for _ in range(rng.choice([0, 1, 2, 5, 10, 20])):
+                rt = random_rt()
+                stats.running_add(acc, rt)
+                while rng.random() < 0.2:  # retrying replaces the reaction time
+                    new_rt = random_rt()
+                    stats.running_remove(acc, rt)
+                    stats.running_add(acc, new_rt)
+                    rt = new_rt
+                rts.append(rt)
+            blocks[rnd] = rts
+            running[rnd] = acc
+
+        for pairs in (stats.IAT1_PAIRS, stats.IAT2_PAIRS):
+            batch = stats.dscore(blocks, pairs)
+            streamed = stats.dscore_from_running(running, pairs)
+            if batch is None:
+                assert streamed is None, (batch, streamed)
+            else:
+                assert abs(batch - streamed) < 1e-9, (batch, streamed)
+
+
 # Add new test for UserInfo page
 
 def test_user_info():
@@ -546,3 +767,717 @@ def test_user_info():
     assert player.random_number == 12, "Random number field is not working correctly."
 
     print("UserInfo tests passed successfully.")
+
+
+def test_dscore_variants_match_reference():
+    """The single-pass D1-D6 scorer agrees with a direct implementation of each variant."""
+    import random
+    from statistics import mean, stdev
+    from . import stats
+
+    rng = random.Random(1)
+
+    def reference(blocks, pairs, drop_fast, errors):
+        trials = {b: [(rt, e) for rt, e in blocks[b] if rt < stats.MAX_RT] for b in blocks}
+        allrt = [rt for b in trials for rt, _ in trials[b]]
+        if not allrt or sum(rt < stats.MIN_RT for rt in allrt) / len(allrt) > stats.MAX_FAST_PROP:
+            return None
+        if drop_fast:
+            trials = {b: [(rt, e) for rt, e in trials[b] if rt >= stats.DROP_RT] for b in trials}
+        values = {}
+        for b, ts in trials.items():
+            correct = [rt for rt, e in ts if not e]
+            if errors is None:
+                values[b] = [rt for rt, _ in ts]
+            else:
+                extra = 2 * stdev(correct) if errors == '2sd' else stats.ERROR_PENALTY
+                values[b] = [rt if not e else mean(correct) + extra for rt, e in ts]
+        scores = []
+        for a, b in pairs:
+            sd = stdev([rt for rt, _ in trials[a] + trials[b]])
+            scores.append((mean(values[b]) - mean(values[a])) / sd)
+        return mean(scores)
+
+    for _ in range(200):
+        blocks = {
+            rnd: [
+                (rng.lognormvariate(-0.3, 0.4) if rng.random() > 0.02 else 12.0, rng.random() < 0.1)
+                for _ in range(20)
+            ]
+            for rnd in (3, 4, 6, 7)
+        }
+        result = stats.dscore_variants(blocks, stats.IAT1_PAIRS)
+        assert abs(result['D1'] - stats.dscore({b: [rt for rt, _ in ts] for b, ts in blocks.items()}, stats.IAT1_PAIRS)) < 1e-9
+        for name, variant in stats.VARIANTS.items():
+            expected = reference(blocks, stats.IAT1_PAIRS, **variant)
+            assert (result[name] is None) == (expected is None), name
+            if expected is not None:
+                assert abs(result[name] - expected) < 1e-9, (name, result[name], expected)
+
+
+def test_bootstrap_dscore_interval():
+    """The bootstrap interval is reproducible with a seed, brackets the point estimate
+    and is missing exactly when the d-score is."""
+    import random
+    from . import stats
+
+    rng = random.Random(2)
+    for _ in range(50):
+        blocks = {
+            rnd: [rng.lognormvariate(-0.3, 0.4) + (0.1 if rnd in (6, 7) else 0) for _ in range(n)]
+            for rnd, n in ((3, 10), (4, 20), (6, 10), (7, 20))
+        }
+        d = stats.dscore(blocks, stats.IAT1_PAIRS)
+        ci = stats.bootstrap_dscore(blocks, stats.IAT1_PAIRS, seed=7)
+        if d is None:
+            assert ci is None
+            continue
+        assert ci == stats.bootstrap_dscore(blocks, stats.IAT1_PAIRS, seed=7)
+        low, high = ci
+        assert low <= high
+        assert low - 0.2 < d < high + 0.2, (low, d, high)
+
+    # remuestreo uniforme sobre range(n), también si n no es potencia de 2
+    for n in (1, 3, 40, 300):
+        counts = [0] * n
+        idx = stats._resample(rng, range(n), 2000 * n)
+        assert len(idx) == 2000 * n
+        for i in idx:
+            counts[i] += 1
+        assert min(counts) > 1700 and max(counts) < 2300, (n, min(counts), max(counts))
+
+
+def test_classification_with_interval():
+    """A classification is only reported when the whole interval falls in one band."""
+    from . import clasificaciones, clasificar
+
+    category = "Personas obesas/Personas delgadas"
+    leve = "Leve: Personas obesas+bueno, Personas delgadas+malo"
+    moderada = "Moderada: Personas obesas+bueno, Personas delgadas+malo"
+    assert clasificaciones(0.3, (0.2, 0.33), category) == [leve]
+    assert clasificaciones(0.3, (0.1, 0.5), category) == ["Neutral", leve, moderada]
+    assert clasificaciones(-0.3, None, category) == [clasificar(-0.3, category)]
+    assert clasificaciones(None, None, category) == ["Sin clasificación"]
+    # fuera de [-2, 2] cuenta como la clasificación más fuerte
+    assert clasificaciones(1.8, (1.0, 2.4), category) == [clasificar(1.0, category)]
+    assert len(clasificaciones(-1.0, (-2.5, 0.0), category)) == 4
+
+
+def test_split_half_reliability():
+    """Split-half reliability is high when participants differ consistently and near zero when they do not."""
+    import random
+    from . import stats
+
+    rng = random.Random(3)
+
+    def sample(effect_sd):
+        participants = {}
+        for p in range(60):
+            effect = rng.gauss(0.15, effect_sd)
+            participants[p] = {
+                rnd: [rng.lognormvariate(-0.3, 0.3) + (effect if rnd in (6, 7) else 0) for _ in range(n)]
+                for rnd, n in ((3, 10), (4, 20), (6, 10), (7, 20))
+            }
+        return participants
+
+    consistent = stats.split_half_reliability(sample(0.2), stats.IAT1_PAIRS, n_splits=200, seed=1)
+    assert 50 <= consistent['n_participants'] <= 60
+    assert consistent['reliability'] > 0.7, consistent
+    assert consistent['low'] <= consistent['reliability'] <= consistent['high']
+
+    noise = stats.split_half_reliability(sample(0.0), stats.IAT1_PAIRS, n_splits=200, seed=1)
+    assert noise['reliability'] < consistent['reliability'] - 0.5, (noise, consistent)
+
+    assert stats.split_half_reliability({}, stats.IAT1_PAIRS) is None
+
+
+def test_parse_minno_stiat_csv():
+    """Columns and latency unit are resolved once per file, and compute_stiat_d
+    gives the same result for parsed arrays and for a list of dicts."""
+    from . import stiat
+
+    ms = stiat.parse_minno_stiat_csv("block,latency,correct\n3,850,1\n5,40,0\n5,1200,true\nx,1,1\n")
+    assert list(ms.block) == [3, 5, 5]
+    assert list(ms.rt) == [0.85, 0.04, 1.2]  # 40 ms sigue siendo milisegundos
+    assert list(ms.correct) == [1, 0, 1]
+
+    seconds = stiat.parse_minno_stiat_csv("Block,rt,error\n3,0.85,0\n5,1.2,1\n")
+    assert list(seconds.rt) == [0.85, 1.2]
+    assert list(seconds.correct) == [1, 0]
+
+    # un 'error' que no se reconoce cuenta como acierto; vacío, como desconocido (error)
+    unknown = stiat.parse_minno_stiat_csv("block,latency,error\n3,850,x\n3,850,\n3,850,yes\n")
+    assert list(unknown.correct) == [1, 0, 0]
+
+    named = stiat.parse_minno_stiat_csv("blockNum,latency_ms\n3,20\n")
+    assert list(named.rt) == [0.02] and list(named.correct) == [0]
+
+    assert len(stiat.parse_minno_stiat_csv("")) == 0
+    assert len(stiat.parse_minno_stiat_csv("foo,bar\n1,2\n")) == 0
+
+    rows = [
+        dict(block=block, rt=0.5 + 0.05 * i + (0.2 if block == 5 else 0), correct=i % 4 != 0)
+        for i, block in enumerate([3, 5] * 10)
+    ]
+    arrays = stiat.StiatTrials.from_dicts(rows)
+    assert list(arrays) == rows
+    assert stiat.compute_stiat_d(arrays, [3], [5]) == stiat.compute_stiat_d(rows, [3], [5])
+
+
+def test_stiat_compact_storage():
+    """Encoded ST-IAT logs decode to the same trials and the exact original text; legacy CSV still works."""
+    from . import stiat
+
+    text = "block,latency,correct,stimulus\n" + "\n".join(
+        f"{3 if i % 2 else 5},{400 + 37 * i},{int(i % 5 != 0)},palabra {i}" for i in range(120)
+    )
+    encoded = stiat.encode_stiat(text)
+    assert stiat.is_encoded(encoded)
+    assert len(encoded) < len(text)
+
+    log = stiat.StiatLog(encoded)
+    assert log.raw == text
+    assert list(log.trials) == list(stiat.parse_minno_stiat_csv(text))
+
+    legacy = stiat.StiatLog(text)
+    assert legacy.raw == text
+    assert list(legacy.trials) == list(log.trials)
+
+    # "stiat:v1:" guardaba los trials parseados además del texto; se sigue leyendo
+    import base64
+    import struct
+    import zlib
+    from array import array
+    trials = stiat.parse_minno_stiat_csv(text)
+    raw = text.encode('utf-8')
+    ms = array('i', [round(rt * 1000) for rt in trials.rt])
+    payload = struct.pack('<IIc', len(trials), len(raw), b'i') + trials.block.tobytes() + ms.tobytes()
+    payload += trials.correct.tobytes() + raw
+    v1 = stiat.StiatLog("stiat:v1:" + base64.b64encode(zlib.compress(payload)).decode('ascii'))
+    assert v1.raw == text
+    assert list(v1.trials) == list(log.trials)
+
+    assert stiat.encode_stiat("") == ""
+    assert len(stiat.StiatLog(None).trials) == 0
+
+
+def test_export_chunks():
+    """Players are grouped lazily, in order, into chunks of at most the given size."""
+    from . import exports
+
+    consumed = []
+    source = (consumed.append(i) or i for i in range(7))
+    chunks = exports.chunks(source, 3)
+    assert next(chunks) == [0, 1, 2]
+    assert consumed == [0, 1, 2]
+    assert list(chunks) == [[3, 4, 5], [6]]
+    assert list(exports.chunks([], 3)) == []
+
+
+def test_trials_by_player():
+    """Trials come back grouped per player, players in the given order and trials in creation order."""
+    from types import SimpleNamespace
+
+    from sqlalchemy import Column, Integer, create_engine
+    from sqlalchemy.ext.declarative import declarative_base
+    from sqlalchemy.orm import Session
+
+    from . import exports
+
+    class Trial(declarative_base()):
+        __tablename__ = 'trial'
+        id = Column(Integer, primary_key=True)
+        player_id = Column(Integer)
+        iteration = Column(Integer)
+
+    engine = create_engine('sqlite://')
+    Trial.metadata.create_all(engine)
+    session = Session(bind=engine)
+    # los trials de los jugadores se intercalan, como cuando juegan a la vez
+    for trial_id, player_id, iteration in [(1, 2, 1), (2, 1, 1), (3, 2, 2), (4, 3, 1), (5, 1, 2), (6, 2, 3)]:
+        session.add(Trial(id=trial_id, player_id=player_id, iteration=iteration))
+    session.commit()
+
+    previous, exports.db._db = exports.db._db, session
+    try:
+        players = [SimpleNamespace(id=pid) for pid in (3, 2, 4, 1)]
+        result = list(exports.trials_by_player(Trial, players, fields=('id', 'iteration'), chunk_size=2))
+    finally:
+        exports.db._db = previous
+        session.close()
+
+    assert [p.id for p, _ in result] == [3, 2, 4, 1]
+    assert [trials for _, trials in result] == [
+        [(4, 1)],
+        [(1, 1), (3, 2), (6, 3)],
+        [],  # jugador sin trials
+        [(2, 1), (5, 2)],
+    ]
+
+
+def test_columnar_roundtrip():
+    """The columnar export keeps the custom_export values: numbers as numbers, text as category codes."""
+    import tempfile
+
+    from . import columnar
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        header = ["session", "round", "stimulus", "is_correct", "reaction_time", "retries", "payoff"]
+        rows = [
+            ["abc", 3, "feliz", True, 0.512, 0, None],
+            ["abc", "4", "triste", "False", "0.73", "", "1.5"],
+            ["abc", 4, "feliz", None, None, 2, 0],
+        ]
+        assert columnar.write([header] + rows, tmp_path) == 3
+
+        columns, meta = columnar.load(tmp_path, mmap=False)
+        assert meta['n_rows'] == 3
+        assert [int(v) for v in columns['round']] == [3, 4, 4]
+        assert [int(v) for v in columns['is_correct']] == [1, 0, -1]
+        assert [int(v) for v in columns['retries']] == [0, -1, 2]
+        rt = [float(v) for v in columns['reaction_time']]
+        assert rt[:2] == [0.512, 0.73] and rt[2] != rt[2]
+        stimuli = meta['categories']['stimulus']
+        assert [stimuli[int(c)] for c in columns['stimulus']] == ["feliz", "triste", "feliz"]
+        assert meta['categories']['session'] == ["abc"]
+
+
+def test_rescore_read_export_skips_malformed_rows():
+    """Rows with an unreadable reaction time or retries cell are skipped instead of aborting the rescore."""
+    import tempfile
+    from pathlib import Path
+    from . import rescore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "export.csv"
+        path.write_text(
+            "session,participant_code,round,iat_round,reaction_time,retries\n"
+            "s,p,3,3,0.8,0\n"
+            "s,p,3,3,abc,0\n"
+            "s,p,4,4,0.9,1.0\n"
+            "s,p,10,3,0.7,2\n"  # orden invertido: la ronda 10 de la página es la 3 de BLOCKS
+            "s,p,4,4,,0\n",
+            encoding='utf-8',
+        )
+        participants = rescore.read_export(path)
+    assert participants == {('s', 'p'): dict(blocks={3: [(0.8, False), (0.7, True)]}, stiat_raw=None)}
+
+
+def test_incremental_export():
+    """Each pull only emits new settled trials; pending ones come later and compaction merges the parts."""
+    import csv
+    import sqlite3
+    import tempfile
+
+    from . import incremental
+
+    conn = sqlite3.connect(":memory:")
+    conn.executescript("""
+        CREATE TABLE otree_session (id INTEGER PRIMARY KEY, code TEXT);
+        CREATE TABLE otree_participant (id INTEGER PRIMARY KEY, code TEXT);
+        CREATE TABLE iat_subsession (id INTEGER PRIMARY KEY, primary_left TEXT, primary_right TEXT,
+                                     secondary_left TEXT, secondary_right TEXT);
+        CREATE TABLE iat_player (id INTEGER PRIMARY KEY, participant_id INTEGER, session_id INTEGER,
+                                 subsession_id INTEGER, round_number INTEGER, iat_round INTEGER);
+        CREATE TABLE iat_trial (id INTEGER PRIMARY KEY, player_id INTEGER, iteration INTEGER, timestamp REAL,
+                                stimulus_cls TEXT, stimulus_cat TEXT, stimulus TEXT, correct TEXT, response TEXT,
+                                is_correct INTEGER, reaction_time REAL, retries INTEGER, response_timestamp REAL);
+        INSERT INTO otree_session VALUES (1, 'sess');
+        INSERT INTO otree_participant VALUES (1, 'part');
+        INSERT INTO iat_subsession VALUES (1, 'a', 'b', 'c', 'd'), (2, 'a', 'b', 'c', 'd');
+        INSERT INTO iat_player VALUES (1, 1, 1, 1, 1, 8), (2, 1, 1, 2, 3, 10);  -- orden invertido
+    """)
+
+    def add(trial_id, player_id, is_correct, ts):
+        conn.execute(
+            "INSERT INTO iat_trial VALUES (?, ?, 1, ?, 'primary', 'x', 'y', 'left', 'left', ?, 0.5, 0, ?)",
+            (trial_id, player_id, ts, is_correct, ts),
+        )
+
+    def ids(path):
+        with open(path, newline='', encoding='utf-8') as f:
+            return [int(row[0]) for row in list(csv.reader(f))[1:]]
+
+    with tempfile.TemporaryDirectory() as out:
+        add(1, 1, 1, 100.0)  # ronda de práctica: no se exporta
+        add(2, 2, 1, 100.0)
+        add(3, 2, 0, 100.0)  # error: se puede reintentar
+        part, n, n_pending = incremental.pull(conn, out, "ana", now=110.0)
+        assert (n, n_pending) == (1, 1) and ids(part) == [2]
+        with open(part, newline='', encoding='utf-8') as f:
+            assert next(csv.DictReader(f))['iat_round'] == '10'
+
+        assert incremental.pull(conn, out, "ana", now=120.0)[0] is None
+
+        conn.execute("UPDATE iat_trial SET is_correct = 1, retries = 1 WHERE id = 3")
+        add(4, 2, 1, 130.0)
+        part, n, n_pending = incremental.pull(conn, out, "ana", now=140.0)
+        assert (n, n_pending) == (2, 0) and ids(part) == [3, 4]
+
+        # otro consumidor empieza desde el principio
+        assert incremental.pull(conn, out, "beto", now=140.0)[1] == 3
+
+        target, n = incremental.compact(out, "ana")
+        assert n == 3 and ids(target) == [2, 3, 4]
+        add(5, 2, None, 150.0)  # sin respuesta y abandonado: sale después del timeout
+        part, n, _ = incremental.pull(conn, out, "ana", now=150.0 + incremental.PENDING_TIMEOUT)
+        assert ids(part) == [5]
+        assert incremental.compact(out, "ana")[1] == 4
+
+        # otro proceso confirma el id 6 después de que ya se exportó el 7: se recupera sin repetir el 7
+        add(7, 2, 1, 160.0)
+        assert ids(incremental.pull(conn, out, "ana", now=170.0)[0]) == [7]
+        add(6, 2, 1, 160.0)
+        assert ids(incremental.pull(conn, out, "ana", now=180.0)[0]) == [6]
+        assert incremental.pull(conn, out, "ana", now=190.0)[0] is None
+        target, n = incremental.compact(out, "ana")
+        assert n == 6 and ids(target) == [2, 3, 4, 5, 6, 7]
+
+
+def test_block_summary():
+    """Block aggregates match a direct computation over the trials under the time limit."""
+    from statistics import mean, stdev
+    from . import stats
+
+    trials = [(0.25, False), (0.35, True), (0.6, False), (0.9, True), (1.2, False), (12.0, False)]
+    summary = stats.block_summary(trials)
+    kept = [(rt, e) for rt, e in trials if rt < stats.MAX_RT]
+    rts = [rt for rt, _ in kept]
+    assert summary['n_trials'] == 6
+    assert summary['n_trimmed_long'] == 1
+    assert summary['n_trimmed_short'] == 2
+    assert abs(summary['mean_rt'] - mean(rts)) < 1e-12
+    assert abs(summary['sd_rt'] - stdev(rts)) < 1e-12
+    assert abs(summary['mean_rt_correct'] - mean(rt for rt, e in kept if not e)) < 1e-12
+    assert summary['error_rate'] == 2 / 5
+    assert summary['fast_prop'] == 1 / 5
+    assert stats.block_summary([])['mean_rt'] is None
+
+
+def test_export_files_by_participant():
+    """Players are regrouped by participant before splitting, and .gz files are compressed on the fly."""
+    import gzip
+    import os
+    import tempfile
+    from types import SimpleNamespace
+
+    from . import exports
+
+    players = [SimpleNamespace(participant_id=pid, round_number=rnd) for rnd in (1, 2) for pid in (3, 1, 2)]
+    groups = list(exports.participant_groups(players, 2))
+    assert [[(p.participant_id, p.round_number) for p in g] for g in groups] == [
+        [(1, 1), (1, 2), (2, 1), (2, 2)],
+        [(3, 1), (3, 2)],
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "trials.csv.gz")
+        rows = (["a", "b"] if i == 0 else [i, i * 0.5] for i in range(1001))
+        assert exports.write_csv(rows, path) == 1000
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        assert lines[0] == "a,b" and lines[-1] == "1000,500.0"
+        assert os.path.getsize(path) < sum(len(line) + 2 for line in lines)
+
+
+def test_counterbalance_latin_square():
+    """Every run of consecutive participants covers all conditions and each ordered pair appears equally often."""
+    from collections import Counter
+    from . import counterbalance
+
+    options = counterbalance.conditions()
+    assert len(options) == 4
+    square = counterbalance.williams_square(4)
+    assert Counter((row[i], row[i + 1]) for row in square for i in range(3)) == Counter(
+        {(a, b): 1 for a in range(4) for b in range(4) if a != b}
+    )
+
+    assigned = [counterbalance.assign(i, options) for i in range(1, 41)]
+    for start in range(0, 40, 4):
+        assert len({(c['order'], c['layout']) for c in assigned[start:start + 4]}) == 4
+    assert counterbalance.assign(3, options) == counterbalance.assign(3, options)
+
+    only_direct = counterbalance.conditions(['direct'], [1, 2])
+    assert {counterbalance.assign(i, only_direct)['order'] for i in range(1, 9)} == {'direct'}
+    assert counterbalance.round_order(dict(order='inverted', layout=1))[:2] == [8, 9]
+    assert counterbalance.legacy_condition(list(range(1, 15))) == dict(order='direct', layout=1)
+
+
+def test_counterbalanced_rounds_show_expected_categories():
+    """In all four conditions each page round shows the expected categories on each side, and
+    d-scores are computed per IAT whatever the order."""
+    from types import SimpleNamespace
+    from . import blocks, counterbalance, stats, running_dscores
+
+    config = dict(primary=['A', 'B', 'C', 'D'], secondary=['g1', 'b1', 'g2', 'b2'])
+    # (izquierda, derecha) de las categorías primarias en las rondas 1-14 con el orden directo
+    direct = [
+        ('A', 'B'), ('', ''), ('A', 'B'), ('A', 'B'), ('B', 'A'), ('B', 'A'), ('B', 'A'),
+        ('C', 'D'), ('', ''), ('C', 'D'), ('C', 'D'), ('D', 'C'), ('D', 'C'), ('D', 'C'),
+    ]
+    expected = {
+        ('direct', 1): direct,
+        ('direct', 2): [(right, left) for left, right in direct],
+        ('inverted', 1): direct[7:] + direct[:7],
+        ('inverted', 2): [(right, left) for left, right in direct[7:] + direct[:7]],
+    }
+    assert set(expected) == set(counterbalance.conditions())
+    for (order, layout), sides in expected.items():
+        round_order = counterbalance.round_order(dict(order=order, layout=layout))
+        for page_round, (left, right) in enumerate(sides, start=1):
+            block = blocks.configure(blocks.LAYOUTS[layout][round_order[page_round - 1]], config)
+            shown = (block['left'].get('primary', ''), block['right'].get('primary', ''))
+            assert shown == (left, right), (order, layout, page_round, shown)
+            if page_round in (3, 10):
+                # en los bloques combinados, 'bueno' va con la primera categoría en ambas disposiciones
+                first = block['left'] if left in ('A', 'C') else block['right']
+                assert first['secondary'] in ('g1', 'g2')
+
+    # el IAT de A/B se juega en las rondas 3-7 de la página (directo) o en las 10-14 (invertido);
+    # dscore1 sale siempre de él
+    def player(order, running):
+        return SimpleNamespace(
+            participant=SimpleNamespace(vars=dict(iat_condition=dict(order=order, layout=1), iat_running=running)),
+            session=SimpleNamespace(params=dict(num_iterations={rnd: 3 for rnd in range(1, 15)})),
+        )
+
+    def accumulators(rts):
+        return {rnd: stats.running_add(stats.running_add(stats.running_add(stats.running_new(), rt), rt + 0.1), rt + 0.3)
+                for rnd, rt in rts.items()}
+
+    by_block = {3: 0.5, 4: 0.6, 6: 0.9, 7: 1.0, 10: 0.7, 11: 0.7, 13: 0.6, 14: 0.5}
+    inverted_pages = {counterbalance.INVERTED.index(rnd) + 1: rt for rnd, rt in by_block.items()}
+    d1, d2 = running_dscores(player('direct', accumulators(by_block)))
+    assert d1 > 0 > d2
+    assert running_dscores(player('inverted', accumulators(inverted_pages))) == (d1, d2)
+
+
+def test_stimulus_registry():
+    """The registry indexes words and images once and refuses missing or broken image files."""
+    import tempfile
+    from pathlib import Path
+    from PIL import Image
+    from . import registry
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        Image.new("RGB", (40, 30), "white").save(tmp / "a.png")
+        pools = {'images:A': ["a.png"], 'words': ["feliz", "triste"], 'more words': ["feliz"]}
+        reg = registry.build(pools, images_dir=tmp)
+
+        a = reg.get("a.png")
+        assert a.is_image and (a.width, a.height) == (40, 30) and a.size == (tmp / "a.png").stat().st_size
+        assert a.url == "/static/images/a.png"
+        assert reg.get("feliz") == registry.Stimulus("feliz", False, "feliz", "feliz", categories=('words', 'more words'))
+        assert a.categories == ('images:A',) and reg.get("triste").categories == ('words',)
+        assert reg.get("no registrado").categories == ()
+        assert reg.thumbnail('images:A') == a and reg.thumbnail('words') is None
+        assert reg.image_urls('images:A') == (a.url,) and reg.image_urls('words') == ()
+
+        # con el build de images.py cada imagen tiene su WebP y su PNG/JPEG de respaldo
+        def url_for(filename, fallback=False):
+            return f"/static/images/build/{filename}.{'png' if fallback else 'webp'}"
+
+        built = registry.build(pools, url_for, images_dir=tmp)
+        assert built.image_sources('images:A') == (("/static/images/build/a.png.webp", "/static/images/build/a.png.png"),)
+        assert built.thumbnail('images:A').fallback_url == "/static/images/build/a.png.png"
+        assert built.image_sources('words') == ()
+
+        # el live method codifica con el registro de la sesión, no con la versión actual
+        from . import encode_stimulus
+        assert encode_stimulus('primary', 'images:A', "a.png", built) == dict(
+            cls='primary', cat='images:A', stimulus="/static/images/build/a.png.webp", fallback="/static/images/build/a.png.png",
+        )
+
+        (tmp / "roto.jpg").write_bytes(b"no es un jpeg")
+        try:
+            registry.build({'images:B': ["roto.jpg", "falta.png"]}, images_dir=tmp)
+        except registry.StimulusError as exc:
+            assert "roto.jpg" in str(exc) and "falta.png" in str(exc)
+        else:
+            raise AssertionError("se esperaba StimulusError")
+
+
+def test_stimulus_library_reload():
+    """Editing the csv swaps in a new version; old versions stay available and a broken edit is retried."""
+    import csv
+    import os
+    import tempfile
+    from pathlib import Path
+    from . import registry
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "stimuli.csv"
+
+        def write(rows, mtime):
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows([("category", "stimulus")] + rows)
+            os.utime(path, ns=(mtime, mtime))
+
+        def load():
+            with open(path, encoding='utf-8') as f:
+                pools = {}
+                for row in csv.DictReader(f):
+                    pools.setdefault(row['category'], []).append(row['stimulus'])
+                return pools
+
+        write([("bueno", "feliz")], 1_000_000_000)
+        library = registry.Library(load, path, images_dir=Path(tmp))
+        first = library.current
+        reloaded = []
+        library.subscribe(reloaded.append)
+        assert not library.check()
+
+        write([("bueno", "feliz"), ("bueno", "alegre")], 2_000_000_000)
+        assert library.check()
+        assert reloaded == [library.current]
+        assert library.current.pools == {'bueno': ["feliz", "alegre"]}
+        assert library.pinned(first.version, first.pools) is first
+
+        write([("images:x", "falta.png")], 3_000_000_000)
+        assert not library.check()
+        assert library.current.pools == {'bueno': ["feliz", "alegre"]}
+        assert len(reloaded) == 1
+
+        # la imagen se sube después, sin tocar el csv: la siguiente revisión la carga
+        from PIL import Image
+        Image.new("RGB", (4, 4), "white").save(Path(tmp) / "falta.png")
+        assert library.check()
+        assert library.current.pools == {'images:x': ["falta.png"]}
+        assert not library.check()
+
+        # otro proceso, que arrancó después del cambio, reconstruye la versión desde lo que guardó la sesión
+        write([("bueno", "feliz"), ("bueno", "alegre")], 4_000_000_000)
+        other = registry.Library(load, path, images_dir=Path(tmp))
+        assert first.version not in other.versions
+        assert other.pinned(first.version, {'bueno': ["feliz"]}).version == first.version
+
+
+def test_page_context_cache():
+    """Contexts are built once per key, evicted least-recently-used first, and dropped on invalidate."""
+    from . import pagecache
+
+    cache = pagecache.ContextCache(maxsize=2)
+    built = []
+
+    def build(name):
+        def f():
+            built.append(name)
+            return dict(name=name)
+        return f
+
+    params = dict(retry_delay=0.5, primary=['a', 'b'])
+    key_a = ('round', pagecache.fingerprint(params), 'v1', 1, 3)
+    assert pagecache.fingerprint(dict(reversed(list(params.items())))) == key_a[1]
+    assert pagecache.fingerprint(dict(params, retry_delay=1.0)) != key_a[1]
+
+    assert cache.get(key_a, build('a')) == dict(name='a')
+    assert cache.get(key_a, build('a')) is cache.get(key_a, build('a'))
+    assert built == ['a'] and cache.hits == 2 and cache.misses == 1
+
+    # se descarta la entrada usada hace más tiempo
+    cache.get('b', build('b'))
+    cache.get(key_a, build('a'))
+    cache.get('c', build('c'))
+    assert len(cache) == 2
+    cache.get('b', build('b'))
+    assert built == ['a', 'b', 'c', 'b']
+
+    cache.invalidate()
+    assert len(cache) == 0
+    cache.get(key_a, build('a'))
+    assert built[-1] == 'a'
+
+
+def test_trial_cache_sweeps_abandoned_players():
+    """Pending trials of a player who stops sending messages are written by any later sweep."""
+    from types import SimpleNamespace
+    from . import trialcache
+
+    class FakeTrial:
+        rows = []
+
+        @classmethod
+        def create(cls, **values):
+            row = SimpleNamespace(**dict(dict.fromkeys(trialcache.FIELDS), **values))
+            cls.rows.append(row)
+            return row
+
+        @classmethod
+        def objects_filter(cls, **kwargs):
+            return [r for r in cls.rows if all(getattr(r, k) == v for k, v in kwargs.items())]
+
+        @classmethod
+        def filter(cls, player):
+            return cls.objects_filter(player_id=player.id)
+
+    def add_trial(player, iteration):
+        trial = cache.create(player, round=3, iteration=iteration, timestamp=float(iteration), correct='left')
+        player.iteration = iteration
+        trial.response = 'right'
+        trial.is_correct = False
+        return trial
+
+    cache = trialcache.TrialCache(FakeTrial)
+    abandoned = SimpleNamespace(id=1, iteration=0)
+    active = SimpleNamespace(id=2, iteration=0)
+    trial = add_trial(abandoned, 1)
+    add_trial(abandoned, 2)
+    add_trial(active, 1)
+
+    # nada se escribe antes de SWEEP_SECONDS ni antes de FLUSH_SECONDS
+    cache.maybe_sweep(now=cache.swept_at + trialcache.SWEEP_SECONDS / 2)
+    cache.maybe_sweep(now=cache.swept_at + trialcache.SWEEP_SECONDS)
+    assert FakeTrial.rows == []
+
+    # el jugador activo escribió hace poco; el que abandonó no volvió a mandar mensajes
+    now = time.time() + trialcache.FLUSH_SECONDS
+    cache.entries[active.id].flushed_at = now - 1
+    cache.maybe_sweep(now=now)
+    assert [(r.player_id, r.iteration) for r in FakeTrial.rows] == [(1, 1), (1, 2)]
+    assert cache.entries[active.id].pending()
+    assert not cache.entries[abandoned.id].pending()
+
+    # un cambio posterior a un trial guardado actualiza su fila; las exportaciones escriben todo
+    trial.response = 'left'
+    assert cache.sweep(max_age=0, now=now) == 2
+    assert FakeTrial.objects_filter(player_id=1, iteration=1)[0].response == 'left'
+    assert len(FakeTrial.objects_filter(player_id=2)) == 1
+
+
+def test_trial_sequences_balanced_and_reproducible():
+    """A seed always gives the same plan, and sides, categories and stimuli stay balanced (±1)."""
+    from collections import Counter
+    from . import blocks, sequences
+
+    pools = {'a': ['a1', 'a2', 'a3'], 'b': ['b1', 'b2'], 'x': ['x1', 'x2', 'x3', 'x4'], 'y': ['y1']}
+    block = blocks.compile_block(blocks.BLOCKS1[3], dict(primary=['a', 'b'], secondary=['x', 'y']), pools)
+
+    # la misma semilla y ronda dan exactamente los mismos bytes (también en otro proceso o versión)
+    plan = sequences.generate(block, 10, 12345, 3)
+    assert plan == dict(
+        seed=12345,
+        cand=b'\x00\x02\x01\x00\x03\x01\x02\x03\x03\x01',
+        stim=b'\x02\x00\x01\x01\x00\x02\x01\x00\x00\x00',
+    )
+    assert sequences.generate(block, 10, 12345, 3) == plan
+    assert sequences.generate(block, 10, 12345, 4) != plan
+    assert sequences.replay(block, 10, 12345, 3)[0] == ('primary', 'a', 'a3', 'left')
+
+    def spread(counter, keys):
+        counts = [counter.get(k, 0) for k in keys]
+        return max(counts) - min(counts)
+
+    for seed in range(200):
+        for n in (1, 5, 10, 19, 20, 40):
+            trials = sequences.replay(block, n, seed, 3)
+            assert len(trials) == n
+            assert spread(Counter(side for _, _, _, side in trials), ['left', 'right']) <= 1
+            for side in ('left', 'right'):
+                cats = [cat for _, cat, _, s in trials if s == side]
+                side_cats = [c[2] for c in block['by_side'][side]]
+                assert spread(Counter(cats), side_cats) <= 1
+            # sin reemplazo: ningún estímulo se repite antes de usar toda su categoría
+            for cat, pool in pools.items():
+                used = Counter(stim for _, c, stim, _ in trials if c == cat)
+                assert spread(used, pool) <= 1, (seed, n, cat, used)
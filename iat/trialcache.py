@@ -0,0 +1,188 @@
+"""Caché en memoria de los trials de la ronda activa de cada jugador
+
+Los live methods sólo corren en el proceso web (`otree prodserver1of2`),
+así que un dict por proceso basta para evitar el `Trial.filter` y la
+escritura de cada mensaje. Los cambios se escriben a la tabla `Trial`
+en lote (write-behind): al terminar el bloque, al enviar la página o
+cuando se acumulan demasiados pendientes o pasa demasiado tiempo.
+
+El tiempo no sólo se revisa con los mensajes del mismo jugador: cualquier
+mensaje (como mucho cada SWEEP_SECONDS) escribe los pendientes de todos los
+jugadores que llevan FLUSH_SECONDS sin escribirse, así que lo de quien
+abandona a mitad del bloque también llega a la base de datos. Las
+exportaciones escriben todos los pendientes antes de leer.
+
+Si el proceso se reinicia, la caché se reconstruye desde la base de datos
+y el progreso del jugador se ajusta a lo que realmente quedó guardado.
+"""
+import time
+from collections import OrderedDict
+
+# umbrales de escritura
+FLUSH_SIZE = 20  # trials pendientes
+FLUSH_SECONDS = 30.0  # segundos desde la última escritura
+SWEEP_SECONDS = 5.0  # cada cuánto se revisan los pendientes de los demás jugadores
+# número de jugadores que se mantienen en memoria
+MAX_PLAYERS = 2000
+
+FIELDS = (
+    'round',
+    'iteration',
+    'timestamp',
+    'stimulus_cls',
+    'stimulus_cat',
+    'stimulus',
+    'correct',
+    'response',
+    'response_timestamp',
+    'reaction_time',
+    'is_correct',
+    'retries',
+)
+
+
+class CachedTrial:
+    """Copia en memoria de una fila de Trial.
+    Cualquier asignación a un campo la marca como pendiente de guardar.
+    """
+
+    __slots__ = FIELDS + ('stored', 'dirty')
+
+    def __init__(self, stored=False, **values):
+        for name in FIELDS:
+            object.__setattr__(self, name, values.get(name))
+        object.__setattr__(self, 'stored', stored)
+        object.__setattr__(self, 'dirty', not stored)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in FIELDS:
+            object.__setattr__(self, 'dirty', True)
+
+    def values(self):
+        return {name: getattr(self, name) for name in FIELDS if getattr(self, name) is not None}
+
+
+class _Entry:
+    __slots__ = ('trials', 'flushed_at')
+
+    def __init__(self, trials):
+        self.trials = trials  # iteration -> CachedTrial
+        self.flushed_at = time.time()
+
+    def pending(self):
+        return [t for t in self.trials.values() if t.dirty]
+
+
+class TrialCache:
+    def __init__(self, model):
+        self.model = model
+        self.entries = OrderedDict()  # player.id -> _Entry
+        self.swept_at = time.time()
+
+    def _entry(self, player):
+        entry = self.entries.get(player.id)
+        if entry is None:
+            entry = self._load(player)
+            self.entries[player.id] = entry
+            self._evict()
+        else:
+            self.entries.move_to_end(player.id)
+        return entry
+
+    def _load(self, player):
+        """Reconstruye la entrada desde la base de datos (arranque o reinicio del proceso)"""
+        trials = {}
+        for row in self.model.filter(player=player):
+            trials[row.iteration] = CachedTrial(
+                stored=True, **{name: getattr(row, name) for name in FIELDS}
+            )
+        last = max(trials) if trials else 0
+        if last < player.iteration:
+            # se perdieron escrituras pendientes (p. ej. el proceso murió):
+            # el progreso vuelve a lo que sí quedó guardado
+            player.iteration = last
+            answered = [t for t in trials.values() if t.response is not None]
+            player.num_trials = len(answered)
+            player.num_correct = len([t for t in answered if t.is_correct])
+            player.num_failed = player.num_trials - player.num_correct
+        return _Entry(trials)
+
+    def _evict(self):
+        # sólo se descartan jugadores sin escrituras pendientes
+        for player_id in list(self.entries):
+            if len(self.entries) <= MAX_PLAYERS:
+                break
+            if not self.entries[player_id].pending():
+                del self.entries[player_id]
+
+    def current(self, player):
+        """El trial actual del jugador, o None"""
+        return self._entry(player).trials.get(player.iteration)
+
+    def create(self, player, **values):
+        trial = CachedTrial(**values)
+        self._entry(player).trials[trial.iteration] = trial
+        return trial
+
+    def discard(self, player, trial):
+        entry = self._entry(player)
+        entry.trials.pop(trial.iteration, None)
+        if trial.stored:
+            for row in self.model.filter(player=player, iteration=trial.iteration):
+                row.delete()
+
+    def flush(self, player):
+        """Escribe todos los trials pendientes del jugador"""
+        entry = self.entries.get(player.id)
+        if entry is None:
+            return
+        self._write(player.id, entry, time.time())
+
+    def _write(self, player_id, entry, now):
+        # por player_id: el sweep escribe jugadores que no son los de la petición actual
+        for trial in entry.pending():
+            if trial.stored:
+                for row in self.model.objects_filter(player_id=player_id, iteration=trial.iteration):
+                    for name, value in trial.values().items():
+                        setattr(row, name, value)
+            else:
+                self.model.create(player_id=player_id, **trial.values())
+                object.__setattr__(trial, 'stored', True)
+            object.__setattr__(trial, 'dirty', False)
+        entry.flushed_at = now
+
+    def maybe_flush(self, player, done=False):
+        """Escribe los pendientes si terminó el bloque o se rebasó algún umbral"""
+        entry = self.entries.get(player.id)
+        if entry is None:
+            return
+        pending = entry.pending()
+        if not pending:
+            return
+        if done or len(pending) >= FLUSH_SIZE or time.time() - entry.flushed_at >= FLUSH_SECONDS:
+            self.flush(player)
+
+    def sweep(self, max_age=FLUSH_SECONDS, now=None):
+        """Escribe los pendientes de todos los jugadores que llevan `max_age` segundos sin escribirse.
+        result: número de jugadores escritos
+        """
+        now = time.time() if now is None else now
+        self.swept_at = now
+        written = 0
+        for player_id, entry in list(self.entries.items()):
+            if entry.pending() and now - entry.flushed_at >= max_age:
+                self._write(player_id, entry, now)
+                written += 1
+        return written
+
+    def maybe_sweep(self, now=None):
+        """sweep() si pasaron SWEEP_SECONDS desde el anterior; se llama con cada mensaje"""
+        now = time.time() if now is None else now
+        if now - self.swept_at >= SWEEP_SECONDS:
+            self.sweep(now=now)
+
+    def release(self, player):
+        """Guarda todo y libera la memoria del jugador (al terminar la ronda)"""
+        self.flush(player)
+        self.entries.pop(player.id, None)
@@ -83,93 +83,20 @@ ROOMS = [
 
 
 if sys.argv[1] == 'test':
-    MAX_ITERATIONS = 5
     FREEZE_TIME = 100
     TRIAL_PAUSE = 200
-    TRIAL_TIMEOUT = 300
 
     SESSION_CONFIGS = [
-        dict(
-            name=f"testing_generic",
-            num_demo_participants=1,
-            app_sequence=['generic'],
-            auto_response_time=None,
-            input_freezing_time=FREEZE_TIME,
-            inter_trial_time=TRIAL_PAUSE,
-            num_iterations=MAX_ITERATIONS,
-            attempts_per_trial=1,
-            categories={'foo': 'positive', 'bar': 'negative'},
-            labels={'foo': 'Positive', 'bar': 'Negative'},
-        ),
-        dict(
-            name=f"testing_generic_retries",
-            num_demo_participants=1,
-            app_sequence=['generic'],
-            auto_response_time=None,
-            input_freezing_time=FREEZE_TIME,
-            inter_trial_time=TRIAL_PAUSE,
-            num_iterations=MAX_ITERATIONS,
-            attempts_per_trial=3,
-            categories={'foo': 'positive', 'bar': 'negative'},
-            labels={'foo': 'Positive', 'bar': 'Negative'},
-        ),
-        dict(
-            name=f"testing_generic_gonogo",
-            num_demo_participants=1,
-            app_sequence=['generic'],
-            auto_response_time=TRIAL_TIMEOUT,
-            input_freezing_time=FREEZE_TIME,
-            inter_trial_time=TRIAL_PAUSE,
-            num_iterations=MAX_ITERATIONS,
-            attempts_per_trial=1,
-            categories={'foo': 'positive', 'bar': 'negative'},
-            labels={'foo': 'Positive', 'bar': 'Negative'},
-        ),
         dict(
             name=f"testing_iat",
             num_demo_participants=1,
             app_sequence=['iat'],
             trial_delay=TRIAL_PAUSE / 1000.0,
             retry_delay=FREEZE_TIME / 1000.0,
-            primary=['canidae', 'felidae'],
-            secondary=['positive', 'negative'],
-            num_iterations={1: 2, 2: 2, 3: 3, 4: 3, 5: 2, 6: 3, 7: 3},
-        ),
-        dict(
-            name=f"testing_sliders",
-            num_demo_participants=1,
-            app_sequence=['sliders'],
-            trial_delay=TRIAL_PAUSE / 1000.0,
-            retry_delay=FREEZE_TIME / 1000.0,
-            num_sliders=3,
-            attempts_per_slider=3,
+            primary=['male', 'female', 'Personas obesas', 'Personas delgadas'],
+            secondary=['career', 'family', 'bueno', 'malo'],
+            num_iterations={1: 2, 2: 2, 3: 3, 4: 3, 5: 2, 6: 3, 7: 3,
+                            8: 2, 9: 2, 10: 3, 11: 3, 12: 2, 13: 3, 14: 3,
+                            15: 1, 16: 1},
         ),
     ]
-    for task in ['decoding', 'matrix', 'transcription']:
-        SESSION_CONFIGS.extend(
-            [
-                dict(
-                    name=f"testing_{task}_defaults",
-                    num_demo_participants=1,
-                    app_sequence=['real_effort'],
-                    puzzle_delay=TRIAL_PAUSE / 1000.0,
-                    retry_delay=FREEZE_TIME / 1000.0,
-                ),
-                dict(
-                    name=f"testing_{task}_retrying",
-                    num_demo_participants=1,
-                    app_sequence=['real_effort'],
-                    puzzle_delay=TRIAL_PAUSE / 1000.0,
-                    retry_delay=FREEZE_TIME / 1000.0,
-                    attempts_per_puzzle=5,
-                ),
-                dict(
-                    name=f"testing_{task}_limited",
-                    num_demo_participants=1,
-                    app_sequence=['real_effort'],
-                    puzzle_delay=TRIAL_PAUSE / 1000.0,
-                    retry_delay=FREEZE_TIME / 1000.0,
-                    max_iterations=MAX_ITERATIONS,
-                ),
-            ]
-        )
\ No newline at end of file